@@ -1,13 +1,26 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
+import numpy as np
 from datetime import datetime, time, date, timedelta, timezone
 import calendar
 import os
 import json
 import base64
+import hashlib
+import socket
+import unicodedata
+import uuid
+import sqlite3
+import threading
+import queue
+from time import monotonic, sleep
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import gspread
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import Request
 
 # Zona horaria de Colombia (UTC-5)
 COLOMBIA_UTC_OFFSET = timedelta(hours=-5)
@@ -19,17 +32,11 @@ def obtener_hora_colombia():
 
 def obtener_hora_limite_dia(fecha=None):
     """Obtener la hora límite según el día de la semana.
-    Viernes (weekday=4): 15:30
-    Otros días: 16:30
+    Viernes: hora de salida del viernes (15:30 por defecto)
+    Otros días: hora de salida de lunes a jueves (16:30 por defecto)
+    Se puede fijar otra con 'hora_limite' en horarios_laborales (ver HorarioDia).
     """
-    if fecha is None:
-        fecha = obtener_fecha_colombia()
-    
-    # weekday(): 0=Lunes, 1=Martes, 2=Miércoles, 3=Jueves, 4=Viernes, 5=Sábado, 6=Domingo
-    if fecha.weekday() == 4:  # Viernes
-        return time(15, 30, 0)  # 15:30:00
-    else:
-        return time(16, 30, 0)  # 16:30:00
+    return obtener_horario_dia(fecha).hora_limite
 
 def obtener_hora_colombia_time():
     """Obtener solo el objeto time en zona horaria de Colombia, con límite máximo según el día"""
@@ -52,83 +59,494 @@ def obtener_fecha_colombia():
 # y sincronizarlos automáticamente cuando vuelva
 # ============================================
 
-ARCHIVO_REGISTROS_PENDIENTES = 'registros_pendientes.json'
+ARCHIVO_REGISTROS_PENDIENTES = 'registros_pendientes.jsonl'
+ARCHIVO_REGISTROS_PENDIENTES_ANTERIOR = 'registros_pendientes.json'  # Formato anterior (lista JSON)
 ARCHIVO_CACHE_DATOS = 'cache_datos_offline.json'
 
-def verificar_conexion_internet(timeout=3):
+def fsync_directorio(ruta):
+    """
+    Fuerza a disco la entrada de directorio de 'ruta', para que un os.replace
+    sobreviva a un corte de luz. En Windows no se pueden abrir directorios (no aplica).
+    """
+    if os.name == 'nt':
+        return
+    descriptor = os.open(os.path.dirname(os.path.abspath(ruta)), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def nuevo_id_registro():
+    """Id único de un registro (uuid4 en hex). Se asigna al crearlo y se escribe en la columna id_registro"""
+    return uuid.uuid4().hex
+
+def id_registro_estable(registro):
+    """
+    Id para registros encolados antes de que existiera id_registro: se deriva
+    del contenido, así es el mismo en cada reinicio y sus reintentos también se deduplican.
+    """
+    contenido = json.dumps(registro, sort_keys=True, ensure_ascii=False, default=str)
+    return uuid.uuid5(uuid.NAMESPACE_URL, contenido).hex
+
+class EstadoConectividad:
+    """
+    Estado de la conexión a internet compartido por todo el proceso.
+    - El resultado de la última prueba se reutiliza durante un TTL corto
+    - Si el resultado venció, se devuelve el último valor conocido y la
+      prueba se repite en un hilo aparte (no bloquea la interfaz)
+    - Un fallo de red en una llamada a Sheets marca la conexión caída al instante
+    """
+    
+    TTL_ACTIVA = 15  # segundos que se confía en "conectado"
+    TTL_CAIDA = 5    # segundos que se confía en "sin conexión" (reintentar pronto)
+    DESTINOS = (("www.google.com", 80), ("8.8.8.8", 53))
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conectado = None
+        self._mensaje = "Sin verificar"
+        self._momento = None
+        self._refrescando = False
+    
+    def _probar(self, timeout):
+        """Abre una conexión TCP con timeout propio (no modifica el timeout global de socket)"""
+        for destino in self.DESTINOS:
+            try:
+                conexion = socket.create_connection(destino, timeout=timeout)
+                conexion.close()
+                return True, "Conexión activa"
+            except OSError:
+                continue
+        return False, "Sin conexión a internet"
+    
+    def _registrar(self, conectado, mensaje):
+        with self._lock:
+            self._conectado = conectado
+            self._mensaje = mensaje
+            self._momento = monotonic()
+    
+    def _vigente(self):
+        if self._momento is None:
+            return False
+        ttl = self.TTL_ACTIVA if self._conectado else self.TTL_CAIDA
+        return monotonic() - self._momento < ttl
+    
+    def _refrescar_en_segundo_plano(self, timeout):
+        with self._lock:
+            if self._refrescando:
+                return
+            self._refrescando = True
+        
+        def refrescar():
+            try:
+                self._registrar(*self._probar(timeout))
+            finally:
+                with self._lock:
+                    self._refrescando = False
+        
+        threading.Thread(target=refrescar, name="chronotrack-conectividad", daemon=True).start()
+    
+    def consultar(self, timeout=3, forzar=False):
+        """Retorna (tiene_conexion, mensaje). Solo bloquea si nunca se ha probado o si forzar=True"""
+        if forzar or self._momento is None:
+            resultado = self._probar(timeout)
+            self._registrar(*resultado)
+            return resultado
+        
+        if not self._vigente():
+            self._refrescar_en_segundo_plano(timeout)
+        
+        with self._lock:
+            return self._conectado, self._mensaje
+    
+    def marcar_caida(self, motivo="Sin conexión a internet"):
+        self._registrar(False, motivo)
+    
+    def marcar_activa(self):
+        self._registrar(True, "Conexión activa")
+
+@st.cache_resource
+def obtener_estado_conectividad():
+    """Estado de conectividad único por proceso"""
+    return EstadoConectividad()
+
+def verificar_conexion_internet(timeout=3, forzar=False):
     """
     Verifica si hay conexión a internet intentando conectar a Google.
+    Usa el resultado en caché si es reciente (ver EstadoConectividad).
     Retorna: (tiene_conexion: bool, mensaje: str)
     """
-    import socket
-    try:
-        # Intentar conectar a Google (muy confiable)
-        socket.setdefaulttimeout(timeout)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect(("www.google.com", 80))
-        return True, "Conexión activa"
-    except socket.error:
-        pass
+    return obtener_estado_conectividad().consultar(timeout=timeout, forzar=forzar)
+
+def es_error_de_red(error):
+    """True si la excepción corresponde a un problema de red (no a datos o permisos)"""
+    from google.auth.exceptions import TransportError
+    return isinstance(error, (OSError, TransportError))
+
+def codigo_http_error(error):
+    """Código HTTP de un APIError de gspread (None si la excepción no trae respuesta)"""
+    respuesta = getattr(error, 'response', None)
+    codigo = getattr(respuesta, 'status_code', None) or getattr(error, 'code', None)
+    return codigo if isinstance(codigo, int) else None
+
+def es_error_de_autenticacion(error):
+    """True si la excepción indica credenciales inválidas o token vencido (401 / RefreshError)"""
+    from google.auth.exceptions import RefreshError
+    return isinstance(error, RefreshError) or codigo_http_error(error) == 401
+
+def invalidar_tras_error_sheets(error, worksheet=None):
+    """
+    Descarta del pool solo lo que el error invalida:
+    - Autenticación: todos los clientes (obliga a autorizar de nuevo)
+    - Red, cuota (429) o errores del servidor (5xx): nada, el cliente sigue sirviendo
+    - Otros (ej: hoja renombrada o borrada): solo el handle cacheado de 'worksheet'
+    """
+    if es_error_de_autenticacion(error):
+        print(f"🔐 [POOL SHEETS] Error de autenticación, se descartan los clientes: {error}")
+        invalidar_conexion_sheets()
+        return
+    codigo = codigo_http_error(error)
+    if es_error_de_red(error) or codigo == 429 or (codigo is not None and codigo >= 500):
+        return
+    if worksheet is not None:
+        invalidar_conexion_sheets(worksheet=worksheet)
+
+def marcar_conexion_caida(error=None):
+    """
+    Marca la conexión como caída tras un fallo en una llamada a Sheets.
+    Si se pasa la excepción, solo se marca cuando es un error de red.
+    """
+    if error is not None and not es_error_de_red(error):
+        return
+    print(f"📴 [CONECTIVIDAD] Conexión marcada como caída: {error}")
+    obtener_estado_conectividad().marcar_caida()
+
+def marcar_conexion_activa():
+    """Marca la conexión como activa tras una llamada exitosa a Sheets"""
+    obtener_estado_conectividad().marcar_activa()
+
+class DiarioPendientes:
+    """
+    Diario (write-ahead log) de registros pendientes en formato JSON Lines.
+    Cada línea es una operación:
+    - {"op": "add", "id": n, "registro": {...}}  -> registro pendiente nuevo
+    - {"op": "ack", "id": n}                      -> registro ya sincronizado
+    - {"op": "base", "id": n}                     -> último id usado (al compactar)
+    - {"op": "migrado"}                           -> el archivo anterior ya se pasó al diario
+    El id del diario es local y nunca se repite (el último se conserva al compactar);
+    el id_registro de cada registro es global y es el que se deduplica contra la hoja.
+    Las escrituras solo agregan al final del archivo y hacen fsync, así un corte
+    de luz a mitad de escritura solo puede dañar la última línea (que se ignora).
+    Cuando hay muchos acks se compacta reescribiendo solo los pendientes.
+    
+    Es también la cola de salida hacia Google Sheets: cada registro tiene un
+    estado de entrega en memoria (ESTADOS_ENTREGA) y se guarda un resumen de los
+    últimos entregados para el panel de administración.
+    """
     
-    try:
-        # Intentar con servidor DNS de Google
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect(("8.8.8.8", 53))
-        return True, "Conexión activa"
-    except socket.error:
-        pass
+    UMBRAL_COMPACTACION = 200  # Cantidad de acks acumulados antes de compactar
+    ENTREGADOS_RECIENTES = 100  # Registros entregados que se conservan para consulta
+    
+    def __init__(self, archivo, archivo_anterior=None):
+        self.archivo = archivo
+        self.archivo_anterior = archivo_anterior
+        self._lock = threading.RLock()
+        self.lock_envio = threading.Lock()  # Solo un envío a Sheets a la vez (evita duplicados)
+        self._pendientes = {}  # id -> registro (en orden de llegada)
+        self._estados = {}     # id -> {'estado', 'intentos', 'ultimo_error', 'actualizado'}
+        self._entregados = deque(maxlen=self.ENTREGADOS_RECIENTES)
+        self._ultimo_id = 0
+        self._acks_acumulados = 0
+        self._cargar()
+    
+    def _cargar(self):
+        """Reproduce el diario desde disco para reconstruir los pendientes"""
+        with self._lock:
+            self._pendientes = {}
+            self._ultimo_id = 0
+            self._acks_acumulados = 0
+            self._migrado = False
+            
+            if os.path.exists(self.archivo):
+                with open(self.archivo, 'r', encoding='utf-8') as f:
+                    contenido = f.read()
+                
+                # Si la última escritura quedó a medias, cerrar la línea para que
+                # las siguientes entradas no queden pegadas a ella
+                if contenido and not contenido.endswith('\n'):
+                    self._escribir_texto('\n')
+                
+                for numero_linea, linea in enumerate(contenido.splitlines(), start=1):
+                    linea = linea.strip()
+                    if not linea:
+                        continue
+                    try:
+                        entrada = json.loads(linea)
+                    except ValueError:
+                        # Línea incompleta (escritura interrumpida): se ignora
+                        print(f"⚠️ [DIARIO PENDIENTES] Línea {numero_linea} dañada ignorada en {self.archivo}: {linea[:80]!r}")
+                        continue
+                    
+                    id_entrada = entrada.get('id', 0)
+                    self._ultimo_id = max(self._ultimo_id, id_entrada)
+                    if entrada.get('op') == 'add':
+                        registro = entrada.get('registro', {})
+                        if not registro.get('id_registro'):
+                            registro['id_registro'] = id_registro_estable(registro)
+                        self._pendientes[id_entrada] = registro
+                    elif entrada.get('op') == 'ack':
+                        self._pendientes.pop(id_entrada, None)
+                        self._acks_acumulados += 1
+                    elif entrada.get('op') == 'migrado':
+                        self._migrado = True
+            
+            self._estados = {id_pendiente: self._estado_inicial() for id_pendiente in self._pendientes}
+            
+            self._migrar_archivo_anterior()
+    
+    def _migrar_archivo_anterior(self):
+        """
+        Pasa los pendientes del archivo JSON anterior al diario (una sola vez).
+        Los registros y la marca 'migrado' van en la misma escritura (un solo fsync):
+        si el proceso se cae antes de renombrar el archivo anterior, el siguiente
+        arranque ve la marca y solo completa el renombrado, sin duplicar registros.
+        """
+        if not self.archivo_anterior or not os.path.exists(self.archivo_anterior):
+            return
+        
+        if not self._migrado:
+            try:
+                with open(self.archivo_anterior, 'r', encoding='utf-8') as f:
+                    anteriores = json.load(f)
+            except Exception as e:
+                print(f"⚠️ [DIARIO PENDIENTES] No se pudo leer {self.archivo_anterior}: {e}")
+                return
+            
+            self._agregar_varios(anteriores or [], entradas_extra=[{'op': 'migrado'}])
+            self._migrado = True
+            print(f"📦 [DIARIO PENDIENTES] Migrados {len(anteriores or [])} registro(s) de {self.archivo_anterior}")
+        
+        os.replace(self.archivo_anterior, self.archivo_anterior + '.migrado')
+        fsync_directorio(self.archivo_anterior)
+    
+    def _escribir_texto(self, texto):
+        """Agrega texto al final del diario y fuerza la escritura a disco"""
+        with open(self.archivo, 'a', encoding='utf-8') as f:
+            f.write(texto)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _escribir(self, entradas):
+        self._escribir_texto(''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in entradas))
+    
+    def _agregar(self, registro):
+        return self._agregar_varios([registro])[0]
+    
+    def _agregar_varios(self, registros, entradas_extra=()):
+        """Agrega varios registros (y entradas extra) con una sola escritura. Retorna sus ids"""
+        entradas = []
+        for registro in registros:
+            self._ultimo_id += 1
+            registro = dict(registro)
+            registro['_id_pendiente'] = self._ultimo_id
+            if not registro.get('id_registro'):
+                registro['id_registro'] = nuevo_id_registro()
+            entradas.append({'op': 'add', 'id': self._ultimo_id, 'registro': registro})
+        
+        self._escribir(entradas + list(entradas_extra))
+        for entrada in entradas:
+            self._pendientes[entrada['id']] = entrada['registro']
+            self._estados[entrada['id']] = self._estado_inicial()
+        return [entrada['id'] for entrada in entradas]
+    
+    @staticmethod
+    def _estado_inicial():
+        return {'estado': 'pendiente', 'intentos': 0, 'ultimo_error': None,
+                'actualizado': datetime.now(COLOMBIA_TZ).strftime('%Y-%m-%d %H:%M:%S')}
+    
+    def agregar(self, registro):
+        """Agrega un registro pendiente. Retorna su id"""
+        with self._lock:
+            return self._agregar(registro)
+    
+    def agregar_varios(self, registros):
+        """Agrega varios registros con una sola escritura (un solo fsync). Retorna sus ids"""
+        with self._lock:
+            return self._agregar_varios(registros)
+    
+    def marcar_enviando(self, ids):
+        """Registra que un lote salió hacia Sheets"""
+        self._cambiar_estado(ids, 'enviando', sumar_intento=True)
+    
+    def marcar_fallidos(self, ids, error):
+        """El envío falló: los registros siguen en la cola y se reintentan en el próximo ciclo"""
+        self._cambiar_estado(ids, 'fallido', error=str(error)[:200] if error else None)
+    
+    def _cambiar_estado(self, ids, estado, sumar_intento=False, error=None):
+        ahora = datetime.now(COLOMBIA_TZ).strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            for i in ids:
+                info = self._estados.get(i)
+                if info is None:
+                    continue
+                info['estado'] = estado
+                info['actualizado'] = ahora
+                if sumar_intento:
+                    info['intentos'] += 1
+                if error is not None:
+                    info['ultimo_error'] = error
+    
+    def confirmar(self, ids, entregados=True):
+        """Marca registros como sincronizados (ack). Con entregados=False solo se descartan"""
+        with self._lock:
+            ids = [i for i in ids if i in self._pendientes]
+            if not ids:
+                return
+            self._escribir([{'op': 'ack', 'id': i} for i in ids])
+            ahora = datetime.now(COLOMBIA_TZ).strftime('%Y-%m-%d %H:%M:%S')
+            for i in ids:
+                registro = self._pendientes.pop(i)
+                info = self._estados.pop(i, None) or self._estado_inicial()
+                if entregados:
+                    self._entregados.append(self._resumen_entrega(i, registro, dict(info, estado='entregado', actualizado=ahora)))
+            self._acks_acumulados += len(ids)
+            
+            if self._acks_acumulados >= self.UMBRAL_COMPACTACION or not self._pendientes:
+                self.compactar()
+    
+    def compactar(self):
+        """Reescribe el diario solo con los pendientes (archivo temporal + reemplazo atómico)"""
+        with self._lock:
+            if not os.path.exists(self.archivo):
+                return
+            temporal = self.archivo + '.tmp'
+            with open(temporal, 'w', encoding='utf-8') as f:
+                # Conservar el último id para que los ids nunca se repitan
+                f.write(json.dumps({'op': 'base', 'id': self._ultimo_id}) + '\n')
+                if self._migrado and self.archivo_anterior and os.path.exists(self.archivo_anterior):
+                    # El renombrado del archivo anterior quedó pendiente: conservar la marca
+                    f.write(json.dumps({'op': 'migrado'}) + '\n')
+                for id_pendiente, registro in self._pendientes.items():
+                    f.write(json.dumps({'op': 'add', 'id': id_pendiente, 'registro': registro}, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporal, self.archivo)
+            fsync_directorio(self.archivo)
+            self._acks_acumulados = 0
+    
+    def obtener(self):
+        """Lista de registros pendientes (copias) en orden de llegada"""
+        with self._lock:
+            return [dict(r) for r in self._pendientes.values()]
+    
+    def cantidad(self):
+        with self._lock:
+            return len(self._pendientes)
+    
+    @staticmethod
+    def _resumen_entrega(id_pendiente, registro, info):
+        return {
+            'id': id_pendiente,
+            'estado': info['estado'],
+            'cedula': registro.get('cedula', ''),
+            'empleado': registro.get('empleado', ''),
+            'fecha': registro.get('fecha', ''),
+            'op': registro.get('op', ''),
+            'tiempo_horas': registro.get('tiempo_horas', 0),
+            'hora_exacta': registro.get('hora_exacta', ''),
+            'guardado': registro.get('_timestamp_offline', ''),
+            'intentos': info['intentos'],
+            'ultimo_error': info['ultimo_error'],
+            'actualizado': info['actualizado'],
+        }
     
-    return False, "Sin conexión a internet"
+    def estados_entrega(self):
+        """
+        Estado de entrega de cada registro: primero los que siguen en la cola
+        (pendiente / enviando / fallido) y luego los últimos entregados.
+        """
+        with self._lock:
+            en_cola = [self._resumen_entrega(i, r, self._estados.get(i) or self._estado_inicial())
+                       for i, r in self._pendientes.items()]
+            return en_cola + list(reversed(self._entregados))
+    
+    def limpiar(self):
+        """Descarta todos los pendientes sin enviarlos"""
+        with self._lock:
+            self.confirmar(list(self._pendientes.keys()), entregados=False)
+
+@st.cache_resource
+def obtener_diario_pendientes():
+    """Diario de pendientes único por proceso"""
+    return DiarioPendientes(ARCHIVO_REGISTROS_PENDIENTES, ARCHIVO_REGISTROS_PENDIENTES_ANTERIOR)
 
 def obtener_registros_pendientes():
     """Obtener lista de registros pendientes de sincronización"""
-    if os.path.exists(ARCHIVO_REGISTROS_PENDIENTES):
-        try:
-            with open(ARCHIVO_REGISTROS_PENDIENTES, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    try:
+        return obtener_diario_pendientes().obtener()
+    except Exception as e:
+        print(f"⚠️ [DIARIO PENDIENTES] Error leyendo pendientes: {e}")
+        return []
 
-def guardar_registro_pendiente(registro):
+def guardar_registros_pendientes(registros):
     """
-    Guardar un registro en el archivo local de pendientes.
-    Se usa cuando no hay conexión a internet.
+    Guardar registros en el archivo local de pendientes.
+    Todos entran con una sola escritura, así el trabajador los ve juntos
+    y los sube en el mismo lote.
+    Retorna la cantidad de registros pendientes.
     """
-    pendientes = obtener_registros_pendientes()
-    
-    # Convertir objetos date/time a string para JSON
-    registro_serializable = {}
-    for key, value in registro.items():
-        if isinstance(value, (date, datetime)):
-            registro_serializable[key] = value.strftime('%Y-%m-%d')
-        elif isinstance(value, time):
-            registro_serializable[key] = value.strftime('%H:%M:%S')
-        else:
-            registro_serializable[key] = value
-    
-    # Agregar timestamp del momento en que se guardó
-    registro_serializable['_timestamp_offline'] = datetime.now(COLOMBIA_TZ).strftime('%Y-%m-%d %H:%M:%S')
-    registro_serializable['_id_pendiente'] = len(pendientes) + 1
-    
-    pendientes.append(registro_serializable)
+    timestamp = datetime.now(COLOMBIA_TZ).strftime('%Y-%m-%d %H:%M:%S')
+    serializables = []
+    for registro in registros:
+        # Convertir objetos date/time a string para JSON
+        registro_serializable = {}
+        for key, value in registro.items():
+            if isinstance(value, (date, datetime)):
+                registro_serializable[key] = value.strftime('%Y-%m-%d')
+            elif isinstance(value, time):
+                registro_serializable[key] = value.strftime('%H:%M:%S')
+            else:
+                registro_serializable[key] = value
+        
+        # Agregar timestamp del momento en que se guardó
+        registro_serializable['_timestamp_offline'] = timestamp
+        serializables.append(registro_serializable)
     
-    with open(ARCHIVO_REGISTROS_PENDIENTES, 'w', encoding='utf-8') as f:
-        json.dump(pendientes, f, ensure_ascii=False, indent=2)
+    diario = obtener_diario_pendientes()
+    diario.agregar_varios(serializables)
     
-    return len(pendientes)
+    return diario.cantidad()
 
 def eliminar_registro_pendiente(id_pendiente):
     """Eliminar un registro pendiente después de sincronizarlo"""
-    pendientes = obtener_registros_pendientes()
-    pendientes = [r for r in pendientes if r.get('_id_pendiente') != id_pendiente]
-    
-    with open(ARCHIVO_REGISTROS_PENDIENTES, 'w', encoding='utf-8') as f:
-        json.dump(pendientes, f, ensure_ascii=False, indent=2)
+    obtener_diario_pendientes().confirmar([id_pendiente])
+
+def eliminar_registros_pendientes(ids_pendientes):
+    """Eliminar varios registros pendientes de una vez (un solo fsync)"""
+    obtener_diario_pendientes().confirmar(ids_pendientes)
+
+def registros_pendientes_de_cedula_fecha(cedula, fecha_str):
+    """
+    Registros de la cola de salida (aún no entregados a Sheets) de una cédula
+    en una fecha 'dd/mm/yyyy', como filas en el orden de construir_fila_registros.
+    """
+    cedula = str(cedula).strip()
+    filas = []
+    for registro in obtener_registros_pendientes():
+        if str(registro.get('cedula', '')).strip() != cedula:
+            continue
+        try:
+            fila = construir_fila_registros(registro)
+        except Exception as e:
+            print(f"⚠️ [DIARIO PENDIENTES] Registro #{registro.get('_id_pendiente')} inválido: {e}")
+            continue
+        if fila[0] == fecha_str:
+            filas.append(fila)
+    return filas
 
 def limpiar_registros_pendientes():
     """Eliminar todos los registros pendientes (después de sincronizar exitosamente)"""
-    if os.path.exists(ARCHIVO_REGISTROS_PENDIENTES):
-        with open(ARCHIVO_REGISTROS_PENDIENTES, 'w', encoding='utf-8') as f:
-            json.dump([], f)
+    obtener_diario_pendientes().limpiar()
 
 # ============================================
 # SISTEMA DE CACHÉ PARA MODO OFFLINE
@@ -146,10 +564,19 @@ def obtener_cache_datos():
     return {'colaboradores': [], 'servicios': [], 'ops': [], 'ultima_actualizacion': None}
 
 def guardar_cache_datos(datos):
-    """Guardar datos en el caché local"""
+    """
+    Guardar datos en el caché local.
+    Se escribe en un archivo temporal y se reemplaza de una vez, así un corte
+    a mitad de escritura nunca deja el caché a medias.
+    """
     datos['ultima_actualizacion'] = datetime.now(COLOMBIA_TZ).strftime('%Y-%m-%d %H:%M:%S')
-    with open(ARCHIVO_CACHE_DATOS, 'w', encoding='utf-8') as f:
-        json.dump(datos, f, ensure_ascii=False, indent=2)
+    temporal = ARCHIVO_CACHE_DATOS + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ARCHIVO_CACHE_DATOS)
+    fsync_directorio(ARCHIVO_CACHE_DATOS)
 
 def actualizar_cache_colaboradores(registros):
     """Actualizar caché de colaboradores"""
@@ -169,55 +596,293 @@ def actualizar_cache_ops(registros):
     cache['ops'] = registros
     guardar_cache_datos(cache)
 
+# Campo clave y campo obligatorio de cada tipo de dato maestro
+CLAVES_DATOS_MAESTROS = {
+    'colaboradores': ('cedula', 'nombre'),
+    'servicios': ('codigo', 'actividad'),
+    'ops': ('orden', None),
+}
+
+def indexar_datos_maestros(tipo, registros):
+    """Diccionario clave -> registro; si hay claves repetidas se conserva la primera (igual que la búsqueda lineal)"""
+    campo_clave, campo_requerido = CLAVES_DATOS_MAESTROS[tipo]
+    indice = {}
+    for registro in registros:
+        clave = str(registro.get(campo_clave, '')).strip()
+        if not clave or clave in indice:
+            continue
+        if campo_requerido and not registro.get(campo_requerido, ''):
+            continue
+        indice[clave] = registro
+    return indice
+
+class IndiceCacheOffline:
+    """
+    Índices en memoria del caché offline (colaboradores, servicios y OPs).
+    - Se construyen una sola vez por proceso
+    - Solo se recargan cuando cambia el archivo (mtime o tamaño)
+    - Las búsquedas son un acceso directo al diccionario
+    """
+    
+    def __init__(self, archivo):
+        self.archivo = archivo
+        self._lock = threading.Lock()
+        self._firma = None
+        self.colaboradores = {}
+        self.servicios = {}
+        self.ops = {}
+    
+    def _firma_archivo(self):
+        try:
+            info = os.stat(self.archivo)
+            return (info.st_mtime_ns, info.st_size)
+        except OSError:
+            return None
+    
+    def actualizar(self):
+        """Reconstruye los índices si el archivo cambió desde la última carga"""
+        firma = self._firma_archivo()
+        if firma == self._firma:
+            return self
+        
+        with self._lock:
+            if firma == self._firma:
+                return self
+            
+            cache = obtener_cache_datos() if firma is not None else {}
+            colaboradores = indexar_datos_maestros('colaboradores', cache.get('colaboradores', []))
+            servicios = indexar_datos_maestros('servicios', cache.get('servicios', []))
+            ops = indexar_datos_maestros('ops', cache.get('ops', []))
+            
+            self.colaboradores = colaboradores
+            self.servicios = servicios
+            self.ops = ops
+            self._firma = firma
+            print(f"📦 [CACHÉ OFFLINE] Índices cargados: {len(colaboradores)} colaboradores, {len(servicios)} servicios, {len(ops)} OPs")
+        
+        return self
+
+@st.cache_resource
+def obtener_indice_cache_offline():
+    """Índice del caché offline único por proceso"""
+    return IndiceCacheOffline(ARCHIVO_CACHE_DATOS)
+
 def buscar_colaborador_en_cache(codigo_barras):
     """Buscar colaborador en el caché local"""
-    cache = obtener_cache_datos()
-    colaboradores = cache.get('colaboradores', [])
+    indice = obtener_indice_cache_offline().actualizar()
+    colab = indice.colaboradores.get(str(codigo_barras).strip())
     
-    for colab in colaboradores:
-        cedula = str(colab.get('cedula', '')).strip()
-        if cedula == str(codigo_barras).strip():
-            nombre = colab.get('nombre', '')
-            if nombre:
-                return nombre, "Colaborador encontrado (modo offline)"
+    if colab:
+        return colab.get('nombre', ''), "Colaborador encontrado (modo offline)"
     
     return None, "Colaborador no encontrado en caché local"
 
 def buscar_servicio_en_cache(codigo_barras):
     """Buscar servicio en el caché local"""
-    cache = obtener_cache_datos()
-    servicios = cache.get('servicios', [])
+    indice = obtener_indice_cache_offline().actualizar()
+    servicio = indice.servicios.get(str(codigo_barras).strip())
     
-    for servicio in servicios:
-        codigo = str(servicio.get('codigo', '')).strip()
-        if codigo == str(codigo_barras).strip():
-            actividad = servicio.get('actividad', '')
-            if actividad:
-                return codigo, actividad, "Servicio encontrado (modo offline)"
+    if servicio:
+        return str(servicio.get('codigo', '')).strip(), servicio.get('actividad', ''), "Servicio encontrado (modo offline)"
     
     return None, None, "Servicio no encontrado en caché local"
 
 def buscar_op_en_cache(codigo_barras):
     """Buscar OP en el caché local"""
-    cache = obtener_cache_datos()
-    ops = cache.get('ops', [])
-    
-    for op in ops:
-        orden = str(op.get('orden', '')).strip()
-        if orden == str(codigo_barras).strip():
-            return {
-                'orden': op.get('orden', ''),
-                'referencia': op.get('referencia', ''),
-                'cantidades': op.get('cantidades', ''),
-                'cliente': op.get('cliente', ''),
-                'item': op.get('item', '')
-            }, "OP encontrada (modo offline)"
+    indice = obtener_indice_cache_offline().actualizar()
+    op = indice.ops.get(str(codigo_barras).strip())
+    
+    if op:
+        return {
+            'orden': op.get('orden', ''),
+            'referencia': op.get('referencia', ''),
+            'cantidades': op.get('cantidades', ''),
+            'cliente': op.get('cliente', ''),
+            'item': op.get('item', '')
+        }, "OP encontrada (modo offline)"
     
     return None, "OP no encontrada en caché local"
 
+class DatosMaestros:
+    """
+    Colaboradores, servicios y OPs en memoria (stale-while-revalidate).
+    - Las búsquedas responden siempre desde memoria, sin esperar a Sheets
+    - Pasado el TTL (config 'datos_maestros' -> 'ttl_segundos') la hoja se recarga
+      en segundo plano y mientras tanto se siguen usando los datos anteriores
+    - Mientras no haya una descarga exitosa se usa el caché offline
+    - Un código desconocido dispara como máximo una recarga en segundo plano de su
+      hoja cada INTERVALO_MINIMO_RECARGA segundos (para altas recientes en la hoja);
+      el escaneo responde de inmediato "no encontrado, reintenta"
+    """
+    
+    TTL_PREDETERMINADO = 300  # segundos
+    INTERVALO_MINIMO_RECARGA = 30  # segundos
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indices = {}         # tipo -> {clave: registro} descargado de Sheets
+        self._cargado_en = {}      # tipo -> momento de la última descarga exitosa
+        self._ultimo_intento = {}  # tipo -> momento del último intento de descarga
+        self._recargando = set()
+    
+    def _ttl(self):
+        return config_valor('datos_maestros', 'ttl_segundos', defecto=self.TTL_PREDETERMINADO, tipo=float)
+    
+    def _indice(self, tipo):
+        """Índice descargado de Sheets, o el del caché offline si aún no hay descarga"""
+        with self._lock:
+            indice = self._indices.get(tipo)
+        if indice is None:
+            return getattr(obtener_indice_cache_offline().actualizar(), tipo)
+        return indice
+    
+    def recargar(self, tipo):
+        """Descarga la hoja de este tipo y reemplaza su índice. Retorna True si tuvo éxito"""
+        with self._lock:
+            self._ultimo_intento[tipo] = monotonic()
+        
+        spreadsheet, mensaje = conectar_google_sheets()
+        if spreadsheet is None:
+            print(f"⚠️ [DATOS MAESTROS] No se pudo recargar {tipo}: {mensaje}")
+            return False
+        
+        try:
+            registros = descargar_datos_maestros(spreadsheet, tipo)
+        except Exception as e:
+            marcar_conexion_caida(e)
+            print(f"⚠️ [DATOS MAESTROS] No se pudo recargar {tipo}: {e}")
+            return False
+        
+        indice = indexar_datos_maestros(tipo, registros)
+        with self._lock:
+            self._indices[tipo] = indice
+            self._cargado_en[tipo] = monotonic()
+        print(f"📥 [DATOS MAESTROS] {tipo}: {len(indice)} registros desde Sheets")
+        return True
+    
+    def _recargar_en_segundo_plano(self, tipo):
+        with self._lock:
+            if tipo in self._recargando:
+                return
+            self._recargando.add(tipo)
+        
+        def recargar():
+            try:
+                self.recargar(tipo)
+            finally:
+                with self._lock:
+                    self._recargando.discard(tipo)
+        
+        threading.Thread(target=recargar, name=f"chronotrack-maestros-{tipo}", daemon=True).start()
+    
+    def _vencido(self, tipo):
+        with self._lock:
+            cargado_en = self._cargado_en.get(tipo)
+            ultimo_intento = self._ultimo_intento.get(tipo)
+        if ultimo_intento is not None and monotonic() - ultimo_intento < self.INTERVALO_MINIMO_RECARGA:
+            return False
+        return cargado_en is None or monotonic() - cargado_en > self._ttl()
+    
+    def _en_recarga(self, tipo):
+        with self._lock:
+            return tipo in self._recargando
+    
+    def _puede_recargar_ya(self, tipo):
+        with self._lock:
+            ultimo_intento = self._ultimo_intento.get(tipo)
+            if tipo in self._recargando:
+                return False
+        return ultimo_intento is None or monotonic() - ultimo_intento >= self.INTERVALO_MINIMO_RECARGA
+    
+    def buscar(self, tipo, clave):
+        """
+        Busca por clave (cédula, código u orden). Nunca espera una descarga de la hoja.
+        Retorna: (registro o None, en_linea, actualizando)
+        - en_linea: hay conexión a internet (sin importar qué índice respondió)
+        - actualizando: la clave no estaba y la hoja se está recargando en segundo
+          plano; conviene reintentar en unos segundos
+        """
+        clave = str(clave).strip()
+        tiene_conexion, _ = verificar_conexion_internet(timeout=2)
+        
+        registro = self._indice(tipo).get(clave)
+        if not tiene_conexion:
+            return registro, False, False
+        
+        if registro is None:
+            # Código desconocido: puede ser un alta reciente en la hoja
+            if self._puede_recargar_ya(tipo):
+                self._recargar_en_segundo_plano(tipo)
+            return None, True, self._en_recarga(tipo)
+        
+        if self._vencido(tipo):
+            self._recargar_en_segundo_plano(tipo)
+        return registro, True, False
+
+@st.cache_resource
+def obtener_datos_maestros():
+    """Datos maestros únicos por proceso"""
+    return DatosMaestros()
+
+# Campos que se guardan de cada hoja maestra
+CAMPOS_DATOS_MAESTROS = {
+    'colaboradores': ('cedula', 'nombre'),
+    'servicios': ('codigo', 'actividad'),
+    'ops': ('orden', 'referencia', 'cantidades', 'cliente', 'item'),
+}
+
+TAMANO_BLOQUE_HUELLA = 500  # filas por bloque al calcular la huella de una hoja
+
+def descargar_hoja_maestra(spreadsheet, tipo):
+    """Descarga la hoja de un tipo de dato maestro. Retorna: (esquema, filas)"""
+    if tipo == 'colaboradores':
+        nombre_hoja = config_valor('google_sheets', 'worksheet_empleados', defecto='Datos_colab')
+        return leer_hoja(obtener_worksheet(spreadsheet, nombre_hoja), 'Datos_colab')
+    elif tipo == 'servicios':
+        return leer_hoja(obtener_worksheet(spreadsheet, 'Servicio'), 'Servicio')
+    return leer_hoja(obtener_worksheet(spreadsheet, 'OPS'), 'OPS')
+
+def parsear_datos_maestros(tipo, esquema, filas):
+    """
+    Convierte las filas de una hoja maestra al formato del caché offline.
+    Lanza ValueError si la hoja no tiene la columna clave.
+    """
+    campos = CAMPOS_DATOS_MAESTROS[tipo]
+    if not esquema.tiene(campos[0]):
+        raise ValueError(f"No se encontró la columna '{campos[0]}' ({tipo}). Encabezados: {esquema.headers}")
+    
+    leer = esquema.accesor(*campos)
+    registros = []
+    for fila in filas:
+        valores = leer(fila)
+        if valores[0]:
+            registros.append(dict(zip(campos, valores)))
+    return registros
+
+def descargar_datos_maestros(spreadsheet, tipo):
+    """Descarga una hoja maestra ('colaboradores', 'servicios' u 'ops') en el formato del caché offline"""
+    esquema, filas = descargar_hoja_maestra(spreadsheet, tipo)
+    return parsear_datos_maestros(tipo, esquema, filas)
+
+def huella_hoja(headers, filas):
+    """
+    Huella del contenido de una hoja: cantidad de filas, hash de los encabezados
+    y un hash por cada bloque de TAMANO_BLOQUE_HUELLA filas.
+    """
+    def resumen(valor):
+        return hashlib.sha1(json.dumps(valor, ensure_ascii=False).encode('utf-8')).hexdigest()
+    
+    return {
+        'filas': len(filas),
+        'encabezados': resumen(list(headers)),
+        'bloques': [resumen(filas[i:i + TAMANO_BLOQUE_HUELLA]) for i in range(0, len(filas), TAMANO_BLOQUE_HUELLA)]
+    }
+
 def actualizar_todo_cache_desde_sheets():
     """
-    Actualiza todo el caché descargando datos de Google Sheets.
+    Actualiza el caché offline con los datos de Google Sheets.
+    - Cada hoja se compara con su huella anterior; solo se procesan las que cambiaron
+    - Si ninguna cambió, el archivo no se reescribe
     Retorna: (exito: bool, mensaje: str)
     """
     tiene_conexion, _ = verificar_conexion_internet(timeout=3)
@@ -230,90 +895,161 @@ def actualizar_todo_cache_desde_sheets():
             return False, f"Error conectando: {mensaje}"
         
         cache = obtener_cache_datos()
+        huellas = cache.setdefault('huellas', {})
+        cambiadas = []
         
-        # 1. Actualizar colaboradores
-        try:
-            ws_colab = spreadsheet.worksheet('Datos_colab')
-            all_values = ws_colab.get_all_values()
-            if len(all_values) > 1:
-                headers = [h.strip().lower() for h in all_values[0]]
-                colaboradores = []
-                for row in all_values[1:]:
-                    if len(row) >= 2:
-                        colab = {}
-                        for i, h in enumerate(headers):
-                            if i < len(row):
-                                colab[h] = row[i]
-                        # Normalizar claves
-                        colab_normalizado = {
-                            'cedula': colab.get('cedula', colab.get('codigo', '')),
-                            'nombre': colab.get('nombre', colab.get('empleado', ''))
-                        }
-                        if colab_normalizado['cedula']:
-                            colaboradores.append(colab_normalizado)
-                cache['colaboradores'] = colaboradores
-        except Exception as e:
-            print(f"Error actualizando colaboradores: {e}")
+        # Las tres hojas se descargan a la vez
+        descargas = ejecutar_en_paralelo({
+            tipo: (lambda tipo=tipo: descargar_hoja_maestra(spreadsheet, tipo))
+            for tipo in CAMPOS_DATOS_MAESTROS
+        })
         
-        # 2. Actualizar servicios
-        try:
-            ws_serv = spreadsheet.worksheet('Servicio')
-            all_values = ws_serv.get_all_values()
-            if len(all_values) > 1:
-                headers = [h.strip().lower() for h in all_values[0]]
-                servicios = []
-                for row in all_values[1:]:
-                    if len(row) >= 2:
-                        serv = {}
-                        for i, h in enumerate(headers):
-                            if i < len(row):
-                                serv[h] = row[i]
-                        # Normalizar claves
-                        serv_normalizado = {
-                            'codigo': serv.get('codigo', ''),
-                            'actividad': serv.get('actividad', serv.get('descripcion', ''))
-                        }
-                        if serv_normalizado['codigo']:
-                            servicios.append(serv_normalizado)
-                cache['servicios'] = servicios
-        except Exception as e:
-            print(f"Error actualizando servicios: {e}")
+        # Hojas maestras: si una falla se conserva lo que ya tenía el caché
+        for tipo in CAMPOS_DATOS_MAESTROS:
+            try:
+                descarga, error = descargas[tipo]
+                if error is not None:
+                    raise error
+                esquema, filas = descarga
+                huella = huella_hoja(esquema.headers, filas)
+                anterior = huellas.get(tipo)
+                if huella == anterior and cache.get(tipo):
+                    continue
+                
+                registros = parsear_datos_maestros(tipo, esquema, filas)
+                if registros:
+                    cache[tipo] = registros
+                    huellas[tipo] = huella
+                    cambiadas.append(tipo)
+                    bloques_anteriores = (anterior or {}).get('bloques', [])
+                    bloques_cambiados = sum(
+                        1 for i, bloque in enumerate(huella['bloques'])
+                        if i >= len(bloques_anteriores) or bloques_anteriores[i] != bloque
+                    )
+                    print(f"📦 [CACHÉ OFFLINE] {tipo}: {len(registros)} registros ({bloques_cambiados} bloque(s) con cambios)")
+            except Exception as e:
+                print(f"Error actualizando {tipo}: {e}")
         
-        # 3. Actualizar OPs
-        try:
-            ws_ops = spreadsheet.worksheet('OPS')
-            all_values = ws_ops.get_all_values()
-            if len(all_values) > 1:
-                headers = [h.strip().lower() for h in all_values[0]]
-                ops = []
-                for row in all_values[1:]:
-                    if len(row) >= 1:
-                        op = {}
-                        for i, h in enumerate(headers):
-                            if i < len(row):
-                                op[h] = row[i]
-                        # Normalizar claves
-                        op_normalizado = {
-                            'orden': op.get('orden', op.get('op', '')),
-                            'referencia': op.get('referencia', ''),
-                            'cantidades': op.get('cantidades', op.get('cantidad', '')),
-                            'cliente': op.get('cliente', ''),
-                            'item': op.get('item', op.get('descripcion', ''))
-                        }
-                        if op_normalizado['orden']:
-                            ops.append(op_normalizado)
-                cache['ops'] = ops
-        except Exception as e:
-            print(f"Error actualizando OPs: {e}")
+        resumen = f"{len(cache.get('colaboradores', []))} colaboradores, {len(cache.get('servicios', []))} servicios, {len(cache.get('ops', []))} OPs"
+        if not cambiadas:
+            return True, f"Caché al día, sin cambios: {resumen}"
         
         guardar_cache_datos(cache)
-        
-        total = len(cache.get('colaboradores', [])) + len(cache.get('servicios', [])) + len(cache.get('ops', []))
-        return True, f"Caché actualizado: {len(cache.get('colaboradores', []))} colaboradores, {len(cache.get('servicios', []))} servicios, {len(cache.get('ops', []))} OPs"
+        return True, f"Caché actualizado: {resumen}"
         
     except Exception as e:
         return False, f"Error actualizando caché: {str(e)}"
 
+def sincronizar_pendientes_por_lotes(tamano_lote=100, max_reintentos=4, espera_inicial=1.0):
+    """
+    Sube los registros pendientes a Google Sheets en lotes con append_rows.
+    - Arma todas las filas primero (una sola conexión)
+    - Cada lote se reintenta con espera exponencial (1s, 2s, 4s...)
+    - Cada lote que llega a Sheets se confirma en el diario de inmediato
+    Retorna: dict con 'sincronizados' (ids), 'fallidos' (ids) y 'mensaje'
+    """
+    # Si otro hilo ya está enviando, esperar a que termine y enviar lo que quede
+    with obtener_diario_pendientes().lock_envio:
+        return _enviar_pendientes_por_lotes(tamano_lote, max_reintentos, espera_inicial)
+
+def _enviar_pendientes_por_lotes(tamano_lote, max_reintentos, espera_inicial):
+    resultado = {'sincronizados': [], 'fallidos': [], 'mensaje': ''}
+    
+    pendientes = obtener_registros_pendientes()
+    if not pendientes:
+        resultado['mensaje'] = "Sin registros pendientes"
+        return resultado
+    
+    diario = obtener_diario_pendientes()
+    spreadsheet, mensaje = conectar_google_sheets()
+    if not spreadsheet:
+        resultado['fallidos'] = [r.get('_id_pendiente') for r in pendientes]
+        resultado['mensaje'] = f"No se pudo conectar: {mensaje}"
+        diario.marcar_fallidos(resultado['fallidos'], resultado['mensaje'])
+        return resultado
+    
+    worksheet = obtener_worksheet(spreadsheet, 'Registros')
+    
+    # Registros que ya están en la hoja (un envío anterior que agotó el tiempo
+    # pero sí entró): se confirman sin volver a enviarlos
+    try:
+        ya_en_hoja, idx_id = ids_registro_en_hoja(worksheet, [r.get('id_registro') for r in pendientes])
+    except Exception as e:
+        print(f"⚠️ [SYNC LOTES] No se pudo revisar ids en la hoja: {e}")
+        if es_error_de_red(e):
+            marcar_conexion_caida(e)
+            resultado['fallidos'] = [r.get('_id_pendiente') for r in pendientes]
+            resultado['mensaje'] = f"Sin conexión: {e}"
+            diario.marcar_fallidos(resultado['fallidos'], e)
+            return resultado
+        ya_en_hoja, idx_id = set(), None
+    
+    if ya_en_hoja:
+        duplicados = [r.get('_id_pendiente') for r in pendientes if r.get('id_registro') in ya_en_hoja]
+        eliminar_registros_pendientes(duplicados)
+        resultado['sincronizados'].extend(duplicados)
+        pendientes = [r for r in pendientes if r.get('id_registro') not in ya_en_hoja]
+        print(f"♻️ [SYNC LOTES] {len(duplicados)} registro(s) ya estaban en la hoja")
+    
+    # Construir todas las filas (los registros que no se pueden convertir quedan como fallidos)
+    lote_ids = []
+    lote_filas = []
+    lote_ids_registro = []
+    for registro in pendientes:
+        try:
+            lote_filas.append(ubicar_id_registro(construir_fila_registros(registro), idx_id))
+            lote_ids.append(registro.get('_id_pendiente'))
+            lote_ids_registro.append(str(registro.get('id_registro', '')))
+        except Exception as e:
+            print(f"⚠️ [SYNC LOTES] Registro #{registro.get('_id_pendiente')} inválido: {e}")
+            resultado['fallidos'].append(registro.get('_id_pendiente'))
+            diario.marcar_fallidos([registro.get('_id_pendiente')], f"Registro inválido: {e}")
+    
+    for inicio in range(0, len(lote_filas), tamano_lote):
+        ids = lote_ids[inicio:inicio + tamano_lote]
+        filas = lote_filas[inicio:inicio + tamano_lote]
+        ids_registro = lote_ids_registro[inicio:inicio + tamano_lote]
+        
+        espera = espera_inicial
+        enviado = False
+        ultimo_error = None
+        diario.marcar_enviando(ids)
+        for intento in range(1, max_reintentos + 1):
+            try:
+                worksheet.append_rows(filas, value_input_option='USER_ENTERED')
+                enviado = True
+                break
+            except Exception as e:
+                ultimo_error = e
+                print(f"⚠️ [SYNC LOTES] Intento {intento}/{max_reintentos} falló: {e}")
+                if es_error_de_red(e):
+                    # Sin red no tiene sentido seguir reintentando ahora
+                    marcar_conexion_caida(e)
+                    break
+                if intento < max_reintentos:
+                    sleep(espera)
+                    espera *= 2
+                    # El intento pudo haber entrado aunque falló la respuesta: no reenviar esas filas
+                    filas, ids_registro = filtrar_filas_ya_en_hoja(worksheet, filas, ids_registro)
+                    if not filas:
+                        enviado = True
+                        break
+        
+        if not enviado:
+            # El lote no entró: este y los siguientes quedan pendientes para el próximo intento
+            invalidar_tras_error_sheets(ultimo_error, worksheet='Registros')
+            resultado['fallidos'].extend(lote_ids[inicio:])
+            diario.marcar_fallidos(lote_ids[inicio:], ultimo_error)
+            break
+        
+        marcar_conexion_activa()
+        eliminar_registros_pendientes(ids)
+        resultado['sincronizados'].extend(ids)
+        print(f"✅ [SYNC LOTES] Lote de {len(ids)} registro(s) sincronizado")
+    
+    resultado['mensaje'] = f"{len(resultado['sincronizados'])} sincronizado(s), {len(resultado['fallidos'])} fallido(s)"
+    return resultado
+
 def sincronizar_registros_pendientes_silencioso():
     """
     Intenta sincronizar registros pendientes de forma silenciosa.
@@ -327,43 +1063,17 @@ def sincronizar_registros_pendientes_silencioso():
     if not tiene_conexion:
         return 0, 0, len(pendientes)
     
-    sincronizados = 0
-    fallidos = 0
-    registros_fallidos = []
-    
-    for registro in pendientes:
-        try:
-            # Reconstruir fecha si es string
-            if isinstance(registro.get('fecha'), str):
-                try:
-                    registro['fecha'] = datetime.strptime(registro['fecha'], '%Y-%m-%d').date()
-                except:
-                    pass
-            
-            # Intentar guardar en Google Sheets (sin mostrar mensajes)
-            guardar_en_google_sheets_offline(registro)
-            sincronizados += 1
-        except Exception as e:
-            fallidos += 1
-            registros_fallidos.append(registro)
-    
-    # Guardar solo los fallidos
-    with open(ARCHIVO_REGISTROS_PENDIENTES, 'w', encoding='utf-8') as f:
-        json.dump(registros_fallidos, f, ensure_ascii=False, indent=2)
+    resultado = sincronizar_pendientes_por_lotes()
     
-    return sincronizados, fallidos, len(registros_fallidos)
+    return len(resultado['sincronizados']), len(resultado['fallidos']), obtener_diario_pendientes().cantidad()
 
-def guardar_en_google_sheets_offline(registro):
+def construir_fila_registros(registro):
     """
-    Función específica para guardar registros offline en Google Sheets.
-    Similar a guardar_en_google_sheets_simple pero sin mensajes de UI.
+    Convierte un registro (dict) en la fila de la hoja 'Registros'.
+    Acepta fecha como date o como string 'YYYY-MM-DD' (registros offline).
+    El id_registro queda al final (posición 16); antes de escribir la fila
+    se mueve a la columna real de la hoja con ubicar_id_registro.
     """
-    spreadsheet, mensaje = conectar_google_sheets()
-    if not spreadsheet:
-        raise Exception(f"No se pudo conectar: {mensaje}")
-    
-    worksheet = spreadsheet.worksheet('Registros')
-    
     # Preparar datos
     fecha_obj = registro.get('fecha')
     if hasattr(fecha_obj, 'strftime'):
@@ -386,17 +1096,9 @@ def guardar_en_google_sheets_offline(registro):
         codigo_servicio = partes_servicio[0].strip()
         actividad_servicio = partes_servicio[1].strip()
     
-    hora_entrada = registro.get('hora_entrada', '')
-    hora_salida = registro.get('hora_salida', '')
-    
-    if isinstance(hora_entrada, time):
-        hora_entrada = hora_entrada.strftime('%H:%M:%S')
-    if isinstance(hora_salida, time):
-        hora_salida = hora_salida.strftime('%H:%M:%S')
-    
     tiempo_horas_calculado = registro.get('tiempo_horas', 0)
     
-    fila_datos = [
+    return [
         fecha_str,
         str(registro.get('cedula', '')),
         str(registro.get('empleado', '')),
@@ -413,15 +1115,159 @@ def guardar_en_google_sheets_offline(registro):
         str(registro.get('semana', '')),
         str(registro.get('referencia', '')),
         str(registro.get('hora_exacta', '')),
+        str(registro.get('id_registro', '')),
     ]
+
+# ============================================
+# TRABAJADOR DE SINCRONIZACIÓN EN SEGUNDO PLANO
+# Un hilo por proceso revisa la conexión y sube los pendientes,
+# así la interfaz nunca espera por la red
+# ============================================
+
+class TrabajadorSincronizacion:
+    """
+    Hilo de fondo que:
+    - Verifica la conexión a internet cada cierto intervalo
+    - Sube los registros de la cola de salida cuando hay conexión (los guardados
+      del kiosco solo se encolan y piden un ciclo inmediato)
+    - Refresca el caché offline cada cierto tiempo (config 'datos_maestros' -> 'intervalo_cache_offline')
+    - Publica un resumen de estado que la interfaz solo lee
+    Las órdenes llegan por una cola ('sincronizar' fuerza un ciclo inmediato).
+    """
+    
+    INTERVALO = 30  # segundos entre ciclos automáticos
+    INTERVALO_CACHE_OFFLINE = 900  # segundos entre refrescos del caché offline (predeterminado)
+    
+    def __init__(self):
+        self._cola = queue.Queue()
+        self._lock = threading.Lock()
+        self._ultimo_refresco_cache = None
+        self._estado = {
+            'conectado': None,            # None = aún no se ha verificado
+            'mensaje_conexion': 'Verificando conexión...',
+            'pendientes': 0,
+            'sincronizando': False,
+            'sincronizados_total': 0,
+            'ultima_verificacion': None,
+            'ultima_sincronizacion': None,
+            'ultimo_error': None,
+        }
+        self._hilo = threading.Thread(target=self._ejecutar, name="chronotrack-sync", daemon=True)
+        self._hilo.start()
+    
+    def obtener_estado(self):
+        """Copia del último estado publicado (no toca la red)"""
+        with self._lock:
+            estado = dict(self._estado)
+        estado['pendientes'] = obtener_diario_pendientes().cantidad()
+        return estado
+    
+    def solicitar_sincronizacion(self):
+        """Pide un ciclo inmediato sin esperar el intervalo"""
+        self._cola.put('sincronizar')
+    
+    def _actualizar_estado(self, **cambios):
+        with self._lock:
+            self._estado.update(cambios)
+    
+    def _ejecutar(self):
+        siguiente = None
+        while True:
+            orden, siguiente = siguiente, None
+            if orden is None:
+                try:
+                    orden = self._cola.get(timeout=self.INTERVALO)
+                except queue.Empty:
+                    orden = 'sincronizar'  # ciclo automático
+            
+            if orden == 'sincronizar':
+                # Varias solicitudes seguidas se atienden en un solo ciclo (un solo lote);
+                # la primera orden distinta se guarda para la siguiente vuelta
+                try:
+                    while siguiente is None:
+                        otra = self._cola.get_nowait()
+                        if otra != 'sincronizar':
+                            siguiente = otra
+                except queue.Empty:
+                    pass
+            
+            try:
+                self._atender(orden)
+            except Exception as e:
+                print(f"⚠️ [TRABAJADOR SYNC] Error en ciclo: {e}")
+                self._actualizar_estado(sincronizando=False, ultimo_error=str(e))
+    
+    def _atender(self, orden):
+        if orden == 'sincronizar':
+            self._ciclo()
+        else:
+            print(f"⚠️ [TRABAJADOR SYNC] Orden desconocida: {orden!r}")
+    
+    def _ciclo(self):
+        tiene_conexion, mensaje = verificar_conexion_internet(timeout=3, forzar=True)
+        self._actualizar_estado(
+            conectado=tiene_conexion,
+            mensaje_conexion=mensaje,
+            ultima_verificacion=datetime.now(COLOMBIA_TZ).strftime('%Y-%m-%d %H:%M:%S')
+        )
+        
+        if not tiene_conexion:
+            return
+        
+        try:
+            self._enviar_pendientes()
+        finally:
+            self._refrescar_cache_offline()
     
-    worksheet.append_row(fila_datos, value_input_option='USER_ENTERED')
+    def _enviar_pendientes(self):
+        if obtener_diario_pendientes().cantidad() == 0:
+            return
+        
+        self._actualizar_estado(sincronizando=True)
+        resultado = sincronizar_pendientes_por_lotes()
+        
+        with self._lock:
+            self._estado['sincronizando'] = False
+            self._estado['sincronizados_total'] += len(resultado['sincronizados'])
+            self._estado['ultima_sincronizacion'] = datetime.now(COLOMBIA_TZ).strftime('%Y-%m-%d %H:%M:%S')
+            self._estado['ultimo_error'] = resultado['mensaje'] if resultado['fallidos'] else None
+        
+        print(f"🔄 [TRABAJADOR SYNC] {resultado['mensaje']}")
+    
+    def _refrescar_cache_offline(self):
+        intervalo = config_valor('datos_maestros', 'intervalo_cache_offline', defecto=self.INTERVALO_CACHE_OFFLINE, tipo=float)
+        if self._ultimo_refresco_cache is not None and monotonic() - self._ultimo_refresco_cache < intervalo:
+            return
+        
+        self._ultimo_refresco_cache = monotonic()
+        exito, mensaje = actualizar_todo_cache_desde_sheets()
+        print(f"📦 [TRABAJADOR SYNC] {mensaje}")
+
+@st.cache_resource
+def obtener_trabajador_sincronizacion():
+    """Trabajador de sincronización único por proceso (arranca su hilo al crearse)"""
+    trabajador = TrabajadorSincronizacion()
+    trabajador.solicitar_sincronizacion()
+    return trabajador
 
 def mostrar_indicador_conexion():
     """Muestra indicador visual del estado de conexión y registros pendientes"""
-    tiene_conexion, mensaje = verificar_conexion_internet(timeout=2)
-    pendientes = obtener_registros_pendientes()
-    num_pendientes = len(pendientes)
+    trabajador = obtener_trabajador_sincronizacion()
+    estado = trabajador.obtener_estado()
+    num_pendientes = estado['pendientes']
+    
+    # Si todavía no se ha verificado la conexión, asumir conectado (no bloquear la interfaz)
+    tiene_conexion = estado['conectado'] is not False
+    
+    # Avisar de los registros que el trabajador subió desde el último render
+    vistos = st.session_state.get('sync_sincronizados_vistos')
+    if vistos is not None and estado['sincronizados_total'] > vistos:
+        st.toast(f"✅ {estado['sincronizados_total'] - vistos} registro(s) sincronizados correctamente")
+    st.session_state.sync_sincronizados_vistos = estado['sincronizados_total']
+    
+    if tiene_conexion and num_pendientes > 0 and not estado['sincronizando']:
+        # Hay pendientes y el trabajador está libre: pedir un ciclo
+        trabajador.solicitar_sincronizacion()
     
     if tiene_conexion and num_pendientes == 0:
         # Todo bien, conexión activa y sin pendientes
@@ -447,12 +1293,6 @@ def mostrar_indicador_conexion():
             <span>Sincronizando {num_pendientes} registro(s)...</span>
         </div>
         """, unsafe_allow_html=True)
-        
-        # Intentar sincronizar automáticamente
-        sincronizados, fallidos, restantes = sincronizar_registros_pendientes_silencioso()
-        if sincronizados > 0:
-            st.toast(f"✅ {sincronizados} registro(s) sincronizados correctamente")
-            st.rerun()
     else:
         # Sin conexión
         if num_pendientes > 0:
@@ -871,7 +1711,8 @@ st.markdown("""
 
 # Configuración de archivos - Usar rutas absolutas basadas en la ubicación del script
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FILE = os.path.join(SCRIPT_DIR, 'horas_trabajadas.csv')
+DATA_FILE = os.path.join(SCRIPT_DIR, 'horas_trabajadas.csv')  # Formato anterior (se migra a DB_FILE)
+DB_FILE = os.path.join(SCRIPT_DIR, 'horas_trabajadas.db')
 CONFIG_FILE = os.path.join(SCRIPT_DIR, 'config.json')
 CREDENTIALS_FILE = os.path.join(SCRIPT_DIR, 'credentials.json')
 
@@ -885,8 +1726,8 @@ if 'admin_authenticated' not in st.session_state:
 if 'login_attempts' not in st.session_state:
     st.session_state.login_attempts = 0
 
-def load_config():
-    """Cargar configuración desde archivo JSON"""
+def _leer_config_archivo():
+    """Configuración predeterminada combinada con la guardada en el archivo JSON"""
     config = {
         'empleados': [],
         'codigos_barras': {},
@@ -901,21 +1742,24 @@ def load_config():
                 'hora_salida': '16:30',
                 'horas_normales': 8.5,
                 'tolerancia_entrada': 15,  # minutos de tolerancia
-                'tolerancia_salida': 15
+                'tolerancia_salida': 15,
+                'breaks': [dict(b) for b in BREAKS_PREDETERMINADOS]
             },
             'viernes': {
                 'hora_entrada': '07:00',
                 'hora_salida': '15:30',
                 'horas_normales': 7.5,
                 'tolerancia_entrada': 15,
-                'tolerancia_salida': 15
+                'tolerancia_salida': 15,
+                'breaks': [dict(b) for b in BREAKS_PREDETERMINADOS]
             },
             'sabado': {
                 'hora_entrada': '07:00',
                 'hora_salida': '12:00',
                 'horas_normales': 5,
                 'tolerancia_entrada': 15,
-                'tolerancia_salida': 15
+                'tolerancia_salida': 15,
+                'breaks': [dict(b) for b in BREAKS_PREDETERMINADOS]
             }
         },
         'google_sheets': {
@@ -940,6 +1784,10 @@ def load_config():
             },
             'servicio_nombre': 'ADECUACIÓN LOCATIVA',
             'servicio_codigo': '29'   # Código del servicio
+        },
+        'datos_maestros': {
+            'ttl_segundos': 300,  # Cada cuánto se recargan Datos_colab, Servicio y OPS
+            'intervalo_cache_offline': 900  # Cada cuánto se refresca el caché offline
         }
     }
     
@@ -953,27 +1801,236 @@ def load_config():
     
     return config
 
-def save_config(config):
-    """Guardar configuración en archivo JSON"""
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=2)
-
-def verificar_contraseña_admin(password):
-    """Verificar contraseña de administrador"""
-    config = load_config()
-    admin_config = config.get('admin', {})
-    contraseña_correcta = admin_config.get('password', 'admin123')
+class DiccionarioInmutable(dict):
+    """dict de solo lectura (sigue siendo dict para json.dumps e isinstance)"""
     
-    return password == contraseña_correcta
-
-def esta_bloqueado():
-    """Verificar si el acceso está temporalmente bloqueado"""
-    config = load_config()
-    admin_config = config.get('admin', {})
-    max_attempts = admin_config.get('max_attempts', 3)
+    def _solo_lectura(self, *args, **kwargs):
+        raise TypeError("La configuración es de solo lectura; usa load_config() para obtener una copia editable")
+    
+    __setitem__ = __delitem__ = __ior__ = _solo_lectura
+    update = pop = popitem = setdefault = clear = _solo_lectura
+
+def congelar_config(valor):
+    """Copia inmutable: dicts -> DiccionarioInmutable, listas -> tuplas"""
+    if isinstance(valor, dict):
+        return DiccionarioInmutable((clave, congelar_config(v)) for clave, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return tuple(congelar_config(v) for v in valor)
+    return valor
+
+def descongelar_config(valor):
+    """Copia editable de una configuración congelada: dicts normales y listas"""
+    if isinstance(valor, dict):
+        return {clave: descongelar_config(v) for clave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [descongelar_config(v) for v in valor]
+    return valor
+
+class ConfiguracionProceso:
+    """
+    Instantánea inmutable de la configuración, compartida por el proceso.
+    - Se lee del archivo la primera vez y cuando cambia (mtime o tamaño)
+    - El archivo se revisa como máximo cada INTERVALO_VERIFICACION segundos
+    - save_config la invalida para que el cambio se vea de inmediato
+    """
+    
+    INTERVALO_VERIFICACION = 5  # segundos
+    
+    def __init__(self, archivo):
+        self.archivo = archivo
+        self._lock = threading.Lock()
+        self._instantanea = None
+        self._firma = None
+        self._verificado_en = None
+    
+    def _firma_archivo(self):
+        try:
+            info = os.stat(self.archivo)
+            return (info.st_mtime_ns, info.st_size)
+        except OSError:
+            return None
+    
+    def obtener(self):
+        instantanea = self._instantanea
+        if instantanea is not None and monotonic() - self._verificado_en < self.INTERVALO_VERIFICACION:
+            return instantanea
+        
+        with self._lock:
+            firma = self._firma_archivo()
+            if self._instantanea is None or firma != self._firma:
+                self._instantanea = congelar_config(_leer_config_archivo())
+                self._firma = firma
+            self._verificado_en = monotonic()
+            return self._instantanea
+    
+    def invalidar(self):
+        with self._lock:
+            self._instantanea = None
+
+@st.cache_resource
+def obtener_configuracion_proceso():
+    """Configuración en memoria única por proceso"""
+    return ConfiguracionProceso(CONFIG_FILE)
+
+def obtener_config():
+    """Configuración actual de solo lectura (no toca el disco en el camino normal)"""
+    return obtener_configuracion_proceso().obtener()
+
+def config_valor(*ruta, defecto=None, tipo=None):
+    """
+    Valor anidado de la configuración, ej: config_valor('google_sheets', 'worksheet_registros', defecto='Registros').
+    Si se pasa tipo (int, float, str...), convierte el valor y usa el defecto si no se puede.
+    """
+    valor = obtener_config()
+    for clave in ruta:
+        if not isinstance(valor, dict) or clave not in valor:
+            return defecto
+        valor = valor[clave]
+    if tipo is not None:
+        try:
+            return tipo(valor)
+        except (TypeError, ValueError):
+            return defecto
+    return valor
+
+def load_config():
+    """Cargar configuración (copia editable; para solo leer usar obtener_config)"""
+    return descongelar_config(obtener_config())
+
+def save_config(config):
+    """Guardar configuración en archivo JSON"""
+    with open(CONFIG_FILE, 'w') as f:
+        json.dump(descongelar_config(config), f, indent=2)
+    obtener_configuracion_proceso().invalidar()
+
+def verificar_contraseña_admin(password):
+    """Verificar contraseña de administrador"""
+    config = obtener_config()
+    admin_config = config.get('admin', {})
+    contraseña_correcta = admin_config.get('password', 'admin123')
+    
+    return password == contraseña_correcta
+
+def esta_bloqueado():
+    """Verificar si el acceso está temporalmente bloqueado"""
+    config = obtener_config()
+    admin_config = config.get('admin', {})
+    max_attempts = admin_config.get('max_attempts', 3)
     
     return st.session_state.login_attempts >= max_attempts
 
+# ============================================
+# HORARIO COMPILADO POR DÍA
+# Entrada, salida, hora límite y ventana de adecuación locativa de cada día
+# de la semana, convertidos a objetos time una sola vez por configuración.
+# ============================================
+
+# Grupo de adecuacion_locativa que aplica a cada día (sábado y domingo no aplica)
+GRUPOS_ADECUACION_POR_DIA = {0: 'lunes_jueves', 1: 'lunes_jueves', 2: 'lunes_jueves', 3: 'lunes_jueves', 4: 'viernes'}
+
+# Valores por defecto de adecuación locativa: (hora_inicio, hora_fin, hora_registro)
+ADECUACION_PREDETERMINADA = {
+    'lunes_jueves': ('16:20', '17:00', '16:30'),
+    'viernes': ('15:20', '15:30', '15:30'),
+}
+
+def parsear_hora_config(valor, defecto):
+    """Hora 'HH:MM' de la configuración como time; usa el defecto si el valor no es válido"""
+    try:
+        return datetime.strptime(str(valor), '%H:%M').time()
+    except (TypeError, ValueError):
+        print(f"⚠️ [HORARIO] Hora inválida en configuración: {valor!r}, se usa {defecto}")
+        return datetime.strptime(defecto, '%H:%M').time()
+
+class HorarioDia:
+    """
+    Horario compilado de un día de la semana.
+    - horario: dict de horarios_laborales del día (None el domingo), como lo retorna obtener_horario_laboral
+    - hora_entrada / hora_salida / horas_normales / tolerancias
+    - hora_limite: tope de hora de registro ('hora_limite' del grupo, o su hora_salida;
+      sábado y domingo usan el límite de lunes a jueves)
+    - adecuacion_*: ventana de adecuación locativa y hora de cierre (solo lunes a viernes)
+    """
+    
+    def __init__(self, dia_semana, config):
+        horarios = config.get('horarios_laborales', {})
+        adecuacion = config.get('adecuacion_locativa', {})
+        
+        self.dia_semana = dia_semana
+        grupo = GRUPOS_HORARIO_POR_DIA[dia_semana]
+        self.horario = None if dia_semana == 6 else horarios.get(grupo, {})
+        horario = self.horario or {}
+        
+        self.hora_entrada = parsear_hora_config(horario.get('hora_entrada', '07:00'), '07:00')
+        self.hora_salida = parsear_hora_config(horario.get('hora_salida', '16:30'), '16:30')
+        self.horas_normales = horario.get('horas_normales', 8)
+        self.tolerancia_entrada = horario.get('tolerancia_entrada', 15)
+        self.tolerancia_salida = horario.get('tolerancia_salida', 15)
+        
+        # Hora límite: viernes usa su propio grupo, los demás días el de lunes a jueves
+        grupo_limite = horarios.get('viernes' if dia_semana == 4 else 'lunes_a_jueves', {})
+        limite_defecto = '15:30' if dia_semana == 4 else '16:30'
+        self.hora_limite = parsear_hora_config(
+            grupo_limite.get('hora_limite', grupo_limite.get('hora_salida', limite_defecto)), limite_defecto
+        )
+        
+        # Adecuación locativa
+        grupo_adecuacion = GRUPOS_ADECUACION_POR_DIA.get(dia_semana)
+        self.adecuacion_habilitada = grupo_adecuacion is not None and adecuacion.get('habilitado', True)
+        self.servicio_adecuacion_nombre = adecuacion.get('servicio_nombre', 'ADECUACIÓN LOCATIVA')
+        self.servicio_adecuacion_codigo = adecuacion.get('servicio_codigo', '29')
+        if grupo_adecuacion is not None:
+            inicio, fin, registro = ADECUACION_PREDETERMINADA[grupo_adecuacion]
+            config_dia = adecuacion.get(grupo_adecuacion, {})
+            self.adecuacion_inicio = parsear_hora_config(config_dia.get('hora_inicio', inicio), inicio)
+            self.adecuacion_fin = parsear_hora_config(config_dia.get('hora_fin', fin), fin)
+            self.hora_cierre_str = config_dia.get('hora_registro', registro)
+            self.hora_cierre = parsear_hora_config(self.hora_cierre_str, registro)
+        else:
+            self.adecuacion_inicio = self.adecuacion_fin = self.hora_cierre = None
+            self.hora_cierre_str = None
+    
+    def en_adecuacion(self, hora):
+        """True si la hora cae en la ventana de adecuación locativa del día"""
+        return self.adecuacion_habilitada and self.adecuacion_inicio <= hora <= self.adecuacion_fin
+    
+    def tiempo_adecuacion(self, hora):
+        """Horas desde 'hora' hasta la hora de cierre (0 si ya pasó)"""
+        if self.hora_cierre is None or hora > self.hora_cierre:
+            return 0
+        segundos = (self.hora_cierre.hour * 3600 + self.hora_cierre.minute * 60 + self.hora_cierre.second) - \
+                   (hora.hour * 3600 + hora.minute * 60 + hora.second + hora.microsecond / 1e6)
+        return round(segundos / 3600, 3)
+
+class CalendarioHorarios:
+    """Un HorarioDia por día de la semana, compilado desde la configuración"""
+    
+    def __init__(self, config):
+        self.por_dia = {dia: HorarioDia(dia, config) for dia in range(7)}
+    
+    def para_fecha(self, fecha):
+        return self.por_dia[fecha.weekday()]
+
+@st.cache_resource
+def _cache_calendario_horarios():
+    return {}
+
+def obtener_horario_dia(fecha=None):
+    """
+    Horario compilado del día de 'fecha' (hoy en Colombia si no se indica).
+    Se recompila solo cuando cambia la instantánea de configuración.
+    """
+    if fecha is None:
+        fecha = obtener_fecha_colombia()
+    config = obtener_config()
+    cache = _cache_calendario_horarios()
+    calendario = cache.get('calendario')
+    if calendario is None or cache.get('config') is not config:
+        calendario = CalendarioHorarios(config)
+        cache['calendario'] = calendario
+        cache['config'] = config
+    return calendario.para_fecha(fecha)
+
 # ============================================
 # SISTEMA DE ADECUACIÓN LOCATIVA
 # Lunes a Jueves: 4:20 PM - 5:00 PM (OP se registra a hora real, Adec. Locativa desde hora real hasta 4:30)
@@ -995,66 +2052,30 @@ def es_horario_adecuacion_locativa():
         - servicio_nombre, servicio_codigo: datos del servicio de Adec. Locativa
         - tiempo_adecuacion: tiempo en horas desde hora_actual_real hasta hora_cierre
     """
-    config = load_config()
-    adecuacion = config.get('adecuacion_locativa', {})
-    
-    if not adecuacion.get('habilitado', True):
-        return False, None
-    
     hora_actual = obtener_hora_colombia_time()
-    dia_semana = obtener_fecha_colombia().weekday()
+    horario = obtener_horario_dia()
     
-    # Sábado (5) y Domingo (6) no aplica
-    if dia_semana > 4:
+    # Deshabilitada, o sábado/domingo: no aplica
+    if not horario.en_adecuacion(hora_actual):
         return False, None
     
-    try:
-        servicio_nombre = adecuacion.get('servicio_nombre', 'ADECUACIÓN LOCATIVA')
-        servicio_codigo = adecuacion.get('servicio_codigo', '29')
-        
-        # Determinar horarios según el día
-        if dia_semana == 4:  # Viernes
-            config_dia = adecuacion.get('viernes', {})
-            hora_inicio = datetime.strptime(config_dia.get('hora_inicio', '15:20'), '%H:%M').time()
-            hora_fin = datetime.strptime(config_dia.get('hora_fin', '15:30'), '%H:%M').time()
-            hora_cierre_str = config_dia.get('hora_registro', '15:30')
-        else:  # Lunes a Jueves (0-3)
-            config_dia = adecuacion.get('lunes_jueves', {})
-            hora_inicio = datetime.strptime(config_dia.get('hora_inicio', '16:20'), '%H:%M').time()
-            hora_fin = datetime.strptime(config_dia.get('hora_fin', '17:00'), '%H:%M').time()
-            hora_cierre_str = config_dia.get('hora_registro', '16:30')
-        
-        hora_cierre = datetime.strptime(hora_cierre_str, '%H:%M').time()
-        
-        if hora_inicio <= hora_actual <= hora_fin:
-            dia_nombre = 'Viernes' if dia_semana == 4 else 'Lunes-Jueves'
-            
-            # Calcular tiempo de adecuación locativa (desde hora actual hasta hora de cierre)
-            hora_actual_dt = datetime.combine(date.today(), hora_actual)
-            hora_cierre_dt = datetime.combine(date.today(), hora_cierre)
-            
-            # Si la hora actual ya pasó la hora de cierre, el tiempo de adecuación es 0
-            if hora_actual > hora_cierre:
-                tiempo_adecuacion = 0
-            else:
-                diferencia = hora_cierre_dt - hora_actual_dt
-                tiempo_adecuacion = round(diferencia.total_seconds() / 3600, 3)
-            
-            return True, {
-                'hora_actual_real': hora_actual,
-                'hora_cierre': hora_cierre,
-                'hora_cierre_str': hora_cierre_str,
-                'servicio_nombre': servicio_nombre,
-                'servicio_codigo': servicio_codigo,
-                'tiempo_adecuacion': tiempo_adecuacion,
-                'mensaje': f'OP registrada a las {hora_actual.strftime("%H:%M")} + Adecuación Locativa ({tiempo_adecuacion:.3f}h hasta {hora_cierre_str}) ({dia_nombre})',
-                # Mantener compatibilidad con código existente
-                'hora_registro': hora_cierre_str
-            }
-    except Exception as e:
-        print(f"Error al verificar horario adecuación locativa: {e}")
-    
-    return False, None
+    dia_nombre = 'Viernes' if horario.dia_semana == 4 else 'Lunes-Jueves'
+    hora_cierre_str = horario.hora_cierre_str
+    
+    # Tiempo de adecuación locativa (desde hora actual hasta hora de cierre; 0 si ya pasó)
+    tiempo_adecuacion = horario.tiempo_adecuacion(hora_actual)
+    
+    return True, {
+        'hora_actual_real': hora_actual,
+        'hora_cierre': horario.hora_cierre,
+        'hora_cierre_str': hora_cierre_str,
+        'servicio_nombre': horario.servicio_adecuacion_nombre,
+        'servicio_codigo': horario.servicio_adecuacion_codigo,
+        'tiempo_adecuacion': tiempo_adecuacion,
+        'mensaje': f'OP registrada a las {hora_actual.strftime("%H:%M")} + Adecuación Locativa ({tiempo_adecuacion:.3f}h hasta {hora_cierre_str}) ({dia_nombre})',
+        # Mantener compatibilidad con código existente
+        'hora_registro': hora_cierre_str
+    }
 
 def aplicar_adecuacion_locativa(hora_actual):
     """Aplicar la lógica de adecuación locativa y retornar hora ajustada si aplica"""
@@ -1062,14 +2083,13 @@ def aplicar_adecuacion_locativa(hora_actual):
     
     if es_adecuacion and info:
         # Retornar la hora fija de registro (16:30)
-        hora_registro = datetime.strptime(info['hora_registro'], '%H:%M').time()
-        return True, hora_registro, info
+        return True, info['hora_cierre'], info
     
     return False, hora_actual, None
 
 def obtener_servicio_adecuacion_locativa():
     """Obtener información del servicio de adecuación locativa"""
-    config = load_config()
+    config = obtener_config()
     adecuacion = config.get('adecuacion_locativa', {})
     
     return {
@@ -1103,39 +2123,26 @@ def validar_codigo_barras(codigo):
     return True, "Formato personalizado"  # Aceptar otros formatos
 
 def obtener_horario_laboral(fecha):
-    """Obtener horario laboral según el día de la semana"""
-    config = load_config()
-    horarios = config.get('horarios_laborales', {})
-    
-    # Obtener día de la semana (0=lunes, 6=domingo)
-    dia_semana = fecha.weekday()
-    
-    if dia_semana <= 3:  # Lunes a jueves (0-3)
-        return horarios.get('lunes_a_jueves', {})
-    elif dia_semana == 4:  # Viernes (4)
-        return horarios.get('viernes', {})
-    elif dia_semana == 5:  # Sábado (5)
-        return horarios.get('sabado', {})
-    else:  # Domingo (6)
-        return None  # No hay horario laboral los domingos
+    """Obtener horario laboral según el día de la semana (None los domingos)"""
+    return obtener_horario_dia(fecha).horario
 
 def analizar_horario(hora_entrada, hora_salida, fecha):
     """Analizar el cumplimiento del horario laboral"""
-    horario = obtener_horario_laboral(fecha)
+    horario_dia = obtener_horario_dia(fecha)
     
-    if not horario:
+    if not horario_dia.horario:
         return {
             'es_dia_laboral': False,
             'mensaje': 'Día no laboral',
             'estado': 'no_laboral'
         }
     
-    # Convertir horarios de texto a objetos time
-    hora_entrada_esperada = datetime.strptime(horario['hora_entrada'], '%H:%M').time()
-    hora_salida_esperada = datetime.strptime(horario['hora_salida'], '%H:%M').time()
-    tolerancia_entrada = horario.get('tolerancia_entrada', 15)
-    tolerancia_salida = horario.get('tolerancia_salida', 15)
-    horas_normales = horario.get('horas_normales', 8)
+    # Horarios ya convertidos a objetos time
+    hora_entrada_esperada = horario_dia.hora_entrada
+    hora_salida_esperada = horario_dia.hora_salida
+    tolerancia_entrada = horario_dia.tolerancia_entrada
+    tolerancia_salida = horario_dia.tolerancia_salida
+    horas_normales = horario_dia.horas_normales
     
     # Calcular tolerancias
     entrada_con_tolerancia = datetime.combine(fecha, hora_entrada_esperada) + pd.Timedelta(minutes=tolerancia_entrada)
@@ -1174,7 +2181,7 @@ def analizar_horario(hora_entrada, hora_salida, fecha):
         
         # Calcular horas trabajadas y extras
         if hora_entrada:
-            horas_trabajadas = calcular_horas(hora_entrada, hora_salida)
+            horas_trabajadas = calcular_horas(hora_entrada, hora_salida, fecha=fecha)
             resultado['horas_trabajadas'] = horas_trabajadas
             
             if horas_trabajadas > horas_normales:
@@ -1186,176 +2193,548 @@ def analizar_horario(hora_entrada, hora_salida, fecha):
     
     return resultado
 
-def load_data():
-    """Cargar datos desde archivo CSV"""
-    # Columnas del nuevo formato
-    columnas_nuevas = [
-        'fecha', 'empleado', 'cedula', 'hora_entrada', 'codigo_actividad', 
-        'codigo_op', 'descripcion_proceso', 'hora_salida', 'horas_trabajadas', 
-        'servicio'
-    ]
+# ============================================
+# ALMACÉN LOCAL DE REGISTROS (SQLite en modo WAL)
+# Insertar un registro es una sola fila nueva (no se reescribe el archivo)
+# y las lecturas pueden filtrar por fecha/cédula en la base de datos
+# ============================================
+
+# Columnas guardadas localmente (las del CSV anterior más id_registro,
+# el mismo id que lleva la fila en la hoja 'Registros')
+COLUMNAS_REGISTRO_LOCAL = [
+    'fecha', 'empleado', 'cedula', 'hora_entrada', 'codigo_actividad',
+    'codigo_op', 'descripcion_proceso', 'hora_salida', 'horas_trabajadas',
+    'servicio', 'op', 'codigo_producto', 'cantidades', 'nombre_cliente',
+    'descripcion_op', 'hora_exacta', 'mes', 'año', 'semana', 'referencia',
+    'id_registro'
+]
+
+# Columnas que retorna load_data (en este orden).
+# Las de la OP al final las usan los reportes por OP (obtener_horas_por_op, obtener_detalle_op)
+COLUMNAS_DATOS = [
+    'fecha', 'empleado', 'cedula', 'hora_entrada', 'codigo_actividad', 
+    'codigo_op', 'descripcion_proceso', 'hora_salida', 'horas_trabajadas', 
+    'servicio', 'op', 'nombre_cliente', 'codigo_producto', 'descripcion_op'
+]
+
+class AlmacenLocal:
+    """
+    Registros locales en SQLite (modo WAL).
+    - Cada registro es una fila con id propio (el índice del DataFrame de load_data)
+      y guarda además el id_registro con el que se envió a Sheets
+    - Fechas como texto 'YYYY-MM-DD' y horas como 'HH:MM:SS' (ordenables y filtrables)
+    - La primera vez importa el CSV anterior (horas_trabajadas.csv)
+    """
     
-    if os.path.exists(DATA_FILE):
+    def __init__(self, archivo_db, archivo_csv_anterior=None):
+        self.archivo_db = archivo_db
+        self._lock = threading.RLock()
+        self.generacion = 0  # Aumenta con cada escritura de este proceso
+        self._memo = {}      # filtros -> (firma, DataFrame) para load_data
+        self._conexion = sqlite3.connect(archivo_db, check_same_thread=False)
+        with self._lock:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute("PRAGMA synchronous=NORMAL")
+            columnas = ", ".join(f'"{c}" TEXT' for c in COLUMNAS_REGISTRO_LOCAL)
+            self._conexion.execute(f"CREATE TABLE IF NOT EXISTS registros (id INTEGER PRIMARY KEY AUTOINCREMENT, {columnas})")
+            # Bases de datos creadas antes de que existiera alguna columna
+            existentes = {fila[1] for fila in self._conexion.execute("PRAGMA table_info(registros)")}
+            for columna in COLUMNAS_REGISTRO_LOCAL:
+                if columna not in existentes:
+                    self._conexion.execute(f'ALTER TABLE registros ADD COLUMN "{columna}" TEXT')
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_registros_fecha ON registros (fecha)")
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_registros_cedula_fecha ON registros (cedula, fecha)")
+            self._conexion.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+            self._conexion.commit()
+        
+        if archivo_csv_anterior:
+            self._migrar_csv(archivo_csv_anterior)
+    
+    @staticmethod
+    def _valor_texto(valor):
+        """Convierte un valor de registro al texto que se guarda en la base de datos"""
+        if valor is None:
+            return None
+        if isinstance(valor, float):
+            if pd.isna(valor):
+                return None
+            if valor.is_integer():
+                return str(int(valor))  # 1152707808.0 -> '1152707808'
+            return str(valor)
+        if isinstance(valor, datetime):
+            return valor.strftime('%Y-%m-%d')
+        if isinstance(valor, date):
+            return valor.strftime('%Y-%m-%d')
+        if isinstance(valor, time):
+            return valor.strftime('%H:%M:%S')
         try:
-            df = pd.read_csv(DATA_FILE)
-            df['fecha'] = pd.to_datetime(df['fecha']).dt.date
-            
-            # LIMPIAR REGISTROS PROBLEMÁTICOS
-            # Filtrar registros que tengan al menos cedula y hora_entrada válidos
-            registros_validos = ~df['cedula'].isna() & ~df['hora_entrada'].isna()
-            df_limpio = df[registros_validos].copy()
-            
-            # Manejar conversión de horas con valores vacíos
-            if 'hora_entrada' in df_limpio.columns:
-                df_limpio['hora_entrada'] = pd.to_datetime(df_limpio['hora_entrada'], format='%H:%M:%S', errors='coerce').dt.time
-            if 'hora_salida' in df_limpio.columns:
-                df_limpio['hora_salida'] = pd.to_datetime(df_limpio['hora_salida'], format='%H:%M:%S', errors='coerce').dt.time
-            
-            # Agregar nuevas columnas si no existen
-            for columna in columnas_nuevas:
-                if columna not in df_limpio.columns:
-                    df_limpio[columna] = ''
-            
-            # Filtrar registros donde la conversión de hora_entrada falló
-            df_limpio = df_limpio[~df_limpio['hora_entrada'].isna()]
+            if pd.isna(valor):
+                return None
+        except (TypeError, ValueError):
+            pass
+        return str(valor)
+    
+    def _migrar_csv(self, archivo_csv):
+        with self._lock:
+            migrado = self._conexion.execute("SELECT valor FROM meta WHERE clave = 'csv_migrado'").fetchone()
+            if migrado or not os.path.exists(archivo_csv):
+                return
             
-            print(f"📊 [DATA CLEANING] Registros originales: {len(df)}, Registros válidos: {len(df_limpio)}")
+            try:
+                df_csv = pd.read_csv(archivo_csv)
+            except Exception as e:
+                print(f"⚠️ [ALMACÉN LOCAL] No se pudo leer {archivo_csv}: {e}")
+                return
             
-            return df_limpio[columnas_nuevas]  # Asegurar el orden correcto
-        except Exception as e:
-            st.warning(f"Error cargando datos existentes: {e}")
-            return pd.DataFrame(columns=columnas_nuevas)
+            registros = df_csv.to_dict('records')
+            self._insertar_varios(registros)
+            self._conexion.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES ('csv_migrado', ?)",
+                                   (datetime.now(COLOMBIA_TZ).strftime('%Y-%m-%d %H:%M:%S'),))
+            self._conexion.commit()
+            self.generacion += 1
+            print(f"📦 [ALMACÉN LOCAL] Migrados {len(registros)} registro(s) desde {archivo_csv}")
+    
+    def _insertar_varios(self, registros):
+        columnas = ", ".join(f'"{c}"' for c in COLUMNAS_REGISTRO_LOCAL)
+        marcadores = ", ".join("?" for _ in COLUMNAS_REGISTRO_LOCAL)
+        cursor = self._conexion.executemany(
+            f"INSERT INTO registros ({columnas}) VALUES ({marcadores})",
+            [tuple(self._valor_texto(r.get(c)) for c in COLUMNAS_REGISTRO_LOCAL) for r in registros]
+        )
+        return cursor
+    
+    def insertar(self, registro):
+        """Inserta un registro (dict). Retorna su id"""
+        columnas = ", ".join(f'"{c}"' for c in COLUMNAS_REGISTRO_LOCAL)
+        marcadores = ", ".join("?" for _ in COLUMNAS_REGISTRO_LOCAL)
+        with self._lock:
+            cursor = self._conexion.execute(
+                f"INSERT INTO registros ({columnas}) VALUES ({marcadores})",
+                tuple(self._valor_texto(registro.get(c)) for c in COLUMNAS_REGISTRO_LOCAL)
+            )
+            self._conexion.commit()
+            self.generacion += 1
+            return cursor.lastrowid
+    
+    def actualizar(self, id_fila, cambios):
+        """Actualiza columnas de un registro existente (id_fila = id de la tabla)"""
+        cambios = {c: v for c, v in cambios.items() if c in COLUMNAS_REGISTRO_LOCAL}
+        if not cambios:
+            return
+        asignaciones = ", ".join(f'"{c}" = ?' for c in cambios)
+        with self._lock:
+            self._conexion.execute(
+                f"UPDATE registros SET {asignaciones} WHERE id = ?",
+                tuple(self._valor_texto(v) for v in cambios.values()) + (int(id_fila),)
+            )
+            self._conexion.commit()
+            self.generacion += 1
+    
+    def leer(self, fecha_inicio=None, fecha_fin=None, cedula=None):
+        """DataFrame con los registros que cumplen los filtros (índice = id)"""
+        condiciones = []
+        parametros = []
+        if fecha_inicio is not None:
+            condiciones.append("fecha >= ?")
+            parametros.append(self._valor_texto(fecha_inicio))
+        if fecha_fin is not None:
+            condiciones.append("fecha <= ?")
+            parametros.append(self._valor_texto(fecha_fin))
+        if cedula is not None:
+            condiciones.append("cedula = ?")
+            parametros.append(str(cedula).strip())
+        
+        consulta = "SELECT * FROM registros"
+        if condiciones:
+            consulta += " WHERE " + " AND ".join(condiciones)
+        consulta += " ORDER BY id"
+        
+        with self._lock:
+            return pd.read_sql_query(consulta, self._conexion, params=parametros, index_col='id')
+    
+    def firma(self):
+        """
+        Identifica el contenido actual: escrituras de este proceso más
+        mtime/tamaño de la base de datos y su WAL (escrituras de otros procesos)
+        """
+        firma = [self.generacion]
+        for archivo in (self.archivo_db, self.archivo_db + '-wal'):
+            try:
+                info = os.stat(archivo)
+                firma.append((info.st_mtime_ns, info.st_size))
+            except OSError:
+                firma.append(None)
+        return tuple(firma)
+    
+    def obtener_memo(self, clave):
+        """DataFrame memorizado para estos filtros si el contenido no ha cambiado"""
+        with self._lock:
+            entrada = self._memo.get(clave)
+            if entrada and entrada[0] == self.firma():
+                return entrada[1]
+            return None
     
-    return pd.DataFrame(columns=columnas_nuevas)
+    def guardar_memo(self, clave, df):
+        with self._lock:
+            firma = self.firma()
+            # Descartar lo calculado con contenido anterior
+            self._memo = {c: e for c, e in self._memo.items() if e[0] == firma}
+            if len(self._memo) >= 32:
+                self._memo.pop(next(iter(self._memo)))
+            self._memo[clave] = (firma, df)
+
+@st.cache_resource
+def obtener_almacen_local():
+    """Almacén local único por proceso"""
+    return AlmacenLocal(DB_FILE, DATA_FILE)
+
+def insertar_registro_local(registro):
+    """Guardar un registro nuevo en el almacén local. Retorna su id"""
+    return obtener_almacen_local().insertar(registro)
+
+def actualizar_registro_local(id_fila, cambios):
+    """Actualizar columnas de un registro local (id_fila = índice del DataFrame de load_data)"""
+    obtener_almacen_local().actualizar(id_fila, cambios)
+
+# Columnas de texto con pocos valores distintos (se guardan como categorías)
+COLUMNAS_CATEGORICAS = ['empleado', 'servicio', 'codigo_op', 'op']
+
+def hora_de_registro(valor):
+    """
+    Hora del día (time) de un valor de hora_entrada/hora_salida: Timedelta de
+    load_data, string 'HH:MM:SS' u objeto time. None si está vacío o es inválido.
+    """
+    if isinstance(valor, time):
+        return valor
+    segundos = segundos_de_hora(valor)
+    if np.isnan(segundos):
+        return None
+    segundos = int(segundos) % SEGUNDOS_POR_DIA
+    return time(segundos // 3600, segundos % 3600 // 60, segundos % 60)
+
+def texto_hora_registro(valor):
+    """'HH:MM:SS' de un valor de hora_entrada/hora_salida ('' si está vacío)"""
+    hora = hora_de_registro(valor)
+    return hora.strftime('%H:%M:%S') if hora else ''
 
-def save_data(df):
-    """Guardar datos en archivo CSV"""
-    df.to_csv(DATA_FILE, index=False)
+def registros_para_mostrar(df):
+    """Copia de un DataFrame de load_data con fecha como date y horas como 'HH:MM:SS' (tablas y CSV)"""
+    df = df.copy()
+    if 'fecha' in df.columns:
+        df['fecha'] = df['fecha'].dt.date
+    for columna in ('hora_entrada', 'hora_salida'):
+        if columna in df.columns:
+            df[columna] = df[columna].map(texto_hora_registro)
+    return df
 
-def calcular_descuento_breaks(hora_entrada, hora_salida):
+def load_data(fecha_inicio=None, fecha_fin=None, cedula=None):
+    """
+    Cargar registros desde el almacén local.
+    Los filtros opcionales (rango de fechas, cédula) se aplican en la base de datos.
+    El resultado se memoriza hasta que cambie la base de datos, así que
+    se retorna una copia: modificarla no altera el caché.
+    El índice del DataFrame es el id del registro (ver actualizar_registro_local).
+    Tipos: fecha datetime64, hora_entrada/hora_salida timedelta64 (desde
+    medianoche, ver hora_de_registro), horas_trabajadas numérica y
+    COLUMNAS_CATEGORICAS como categorías.
     """
-    Calcula el tiempo de descuento por desayuno y almuerzo según el rango trabajado.
+    almacen = obtener_almacen_local()
+    clave = (
+        AlmacenLocal._valor_texto(fecha_inicio),
+        AlmacenLocal._valor_texto(fecha_fin),
+        str(cedula).strip() if cedula is not None else None
+    )
     
-    Horarios de breaks:
-    - Desayuno: 9:00 AM a 9:10 AM (10 minutos = 0.167 horas)
-    - Almuerzo: 12:30 PM a 1:00 PM (30 minutos = 0.5 horas)
+    df_memo = almacen.obtener_memo(clave)
+    if df_memo is not None:
+        return df_memo.copy()
     
-    Retorna el total de horas a descontar
+    columnas_nuevas = COLUMNAS_DATOS
+    
+    try:
+        df = almacen.leer(fecha_inicio, fecha_fin, cedula)
+        df['fecha'] = pd.to_datetime(df['fecha'], format='%Y-%m-%d', errors='coerce')
+        df['horas_trabajadas'] = pd.to_numeric(df['horas_trabajadas'], errors='coerce')
+        
+        # LIMPIAR REGISTROS PROBLEMÁTICOS
+        # Filtrar registros que tengan al menos cedula y hora_entrada válidos
+        registros_validos = ~df['cedula'].isna() & ~df['hora_entrada'].isna()
+        df_limpio = df[registros_validos].copy()
+        
+        # Manejar conversión de horas con valores vacíos
+        df_limpio['hora_entrada'] = pd.to_timedelta(df_limpio['hora_entrada'], errors='coerce')
+        df_limpio['hora_salida'] = pd.to_timedelta(df_limpio['hora_salida'], errors='coerce')
+        
+        # Filtrar registros donde la conversión de hora_entrada falló
+        df_limpio = df_limpio[~df_limpio['hora_entrada'].isna()]
+        
+        for columna in COLUMNAS_CATEGORICAS:
+            df_limpio[columna] = df_limpio[columna].astype('category')
+        
+        print(f"📊 [DATA CLEANING] Registros originales: {len(df)}, Registros válidos: {len(df_limpio)}")
+        
+        df_limpio = df_limpio[columnas_nuevas]  # Asegurar el orden correcto
+        almacen.guardar_memo(clave, df_limpio)
+        return df_limpio.copy()
+    except Exception as e:
+        st.warning(f"Error cargando datos existentes: {e}")
+        return pd.DataFrame(columns=columnas_nuevas)
+
+# ============================================
+# CÁLCULO DE HORAS POR LOTES (vectorizado)
+# Las horas se manejan como segundos desde medianoche en arreglos numpy,
+# así un mes de registros se calcula sin ciclos en Python
+# ============================================
+
+SEGUNDOS_POR_DIA = 24 * 3600
+
+# Breaks por defecto (si config.json no define 'breaks' para el día)
+BREAKS_PREDETERMINADOS = [
+    {'nombre': 'desayuno', 'inicio': '09:00', 'fin': '09:10'},
+    {'nombre': 'almuerzo', 'inicio': '12:30', 'fin': '13:00'},
+]
+
+# Grupo de horarios_laborales que aplica a cada día (0=lunes ... 6=domingo)
+GRUPOS_HORARIO_POR_DIA = {
+    0: 'lunes_a_jueves', 1: 'lunes_a_jueves', 2: 'lunes_a_jueves', 3: 'lunes_a_jueves',
+    4: 'viernes', 5: 'sabado', 6: 'domingo'
+}
+
+def segundos_de_hora(valor):
+    """
+    Camino escalar de segundos_desde_medianoche (sin pandas): un objeto time,
+    una duración desde medianoche (timedelta), un string 'HH:MM:SS'/'HH:MM'
+    o un número de segundos. NaN si es inválido.
     """
-    # Convertir strings a time si es necesario
-    if isinstance(hora_entrada, str):
+    if isinstance(valor, time):
+        return float(valor.hour * 3600 + valor.minute * 60 + valor.second)
+    if isinstance(valor, timedelta):
+        return float(int(valor.total_seconds()))
+    if isinstance(valor, str):
+        partes = valor.strip().split(':')
+        if len(partes) not in (2, 3):
+            return float('nan')
         try:
-            hora_entrada = datetime.strptime(hora_entrada, '%H:%M:%S').time()
-        except:
-            return 0.0
+            horas, minutos = int(partes[0]), int(partes[1])
+            segundos = int(partes[2]) if len(partes) == 3 else 0
+        except ValueError:
+            return float('nan')
+        return float(horas * 3600 + minutos * 60 + segundos)
+    if isinstance(valor, (int, float, np.number)) and not isinstance(valor, bool):
+        return float(valor)
+    return float('nan')
+
+def segundos_desde_medianoche(valores):
+    """
+    Convierte horas (objetos time, strings 'HH:MM:SS'/'HH:MM' o segundos) en un
+    arreglo de segundos desde medianoche. Los valores inválidos quedan como NaN.
+    Los textos se separan por ':' en columnas y se convierten con pd.to_numeric.
+    Una columna timedelta64 (hora_entrada/hora_salida de load_data) se convierte directo.
+    """
+    if isinstance(valores, pd.Series) and pd.api.types.is_timedelta64_dtype(valores):
+        return np.floor(valores.dt.total_seconds().to_numpy(dtype=float))
+    
+    serie = pd.Series(valores, dtype=object)
+    resultado = np.full(len(serie), np.nan)
+    if serie.empty:
+        return resultado
+    
+    tipos = serie.map(type)
+    
+    # time y str pasan por el mismo texto 'HH:MM[:SS[.ffffff]]'
+    es_texto = (tipos == str) | (tipos == time)
+    if es_texto.any():
+        partes = serie[es_texto].astype(str).str.strip().str.split(':', expand=True)
+        if partes.shape[1] >= 2:
+            horas = pd.to_numeric(partes[0], errors='coerce')
+            minutos = pd.to_numeric(partes[1], errors='coerce')
+            segundos = pd.to_numeric(partes[2], errors='coerce').fillna(0) if partes.shape[1] >= 3 else 0
+            total = horas * 3600 + minutos * 60 + np.floor(segundos)
+            if partes.shape[1] > 3:
+                # Más de tres partes ('HH:MM:SS:xx') no es una hora
+                total[partes[3].notna()] = np.nan
+            resultado[es_texto.to_numpy()] = total.to_numpy(dtype=float)
+    
+    es_numero = tipos.isin([int, float, np.int64, np.float64])
+    if es_numero.any():
+        resultado[es_numero.to_numpy()] = serie[es_numero].astype(float).to_numpy()
     
-    if isinstance(hora_salida, str):
-        try:
-            hora_salida = datetime.strptime(hora_salida, '%H:%M:%S').time()
-        except:
+    return resultado
+
+class HorarioBreaks:
+    """
+    Breaks de un día compilados como intervalos ordenados (sin traslapes) en
+    segundos desde medianoche, con la suma acumulada de su duración.
+    El tiempo de break dentro de [entrada, salida] se resuelve con dos búsquedas
+    binarias: acumulado(salida) - acumulado(entrada).
+    """
+    
+    def __init__(self, breaks):
+        intervalos = []
+        for brk in breaks:
+            inicio, fin = segundos_de_hora(brk.get('inicio')), segundos_de_hora(brk.get('fin'))
+            if not np.isnan(inicio) and not np.isnan(fin) and fin > inicio:
+                intervalos.append((inicio, fin))
+        intervalos.sort()
+        
+        # Unir breaks que se traslapan para no descontar dos veces
+        unidos = []
+        for inicio, fin in intervalos:
+            if unidos and inicio <= unidos[-1][1]:
+                unidos[-1][1] = max(unidos[-1][1], fin)
+            else:
+                unidos.append([inicio, fin])
+        
+        self.intervalos = [tuple(intervalo) for intervalo in unidos]
+        self.inicios = np.array([i for i, _ in unidos], dtype=float)
+        self.fines = np.array([f for _, f in unidos], dtype=float)
+        self.duraciones = self.fines - self.inicios
+        self.acumulado = np.concatenate(([0.0], np.cumsum(self.duraciones)))
+    
+    def segundos_hasta(self, t):
+        """Segundos de break entre medianoche y t (t: arreglo de segundos)"""
+        t = np.asarray(t, dtype=float)
+        if len(self.inicios) == 0:
+            return np.zeros(t.shape)
+        # Breaks que ya terminaron antes de t
+        k = np.searchsorted(self.fines, np.nan_to_num(t, nan=0.0), side='right')
+        en_curso = k < len(self.inicios)
+        k_seguro = np.minimum(k, len(self.inicios) - 1)
+        parcial = np.where(en_curso, np.clip(t - self.inicios[k_seguro], 0, self.duraciones[k_seguro]), 0.0)
+        return self.acumulado[k] + parcial
+    
+    def descuento(self, entradas, salidas):
+        """Segundos de break dentro de cada rango [entrada, salida] (0 si es inválido o invertido)"""
+        entradas = np.asarray(entradas, dtype=float)
+        salidas = np.asarray(salidas, dtype=float)
+        segundos = self.segundos_hasta(salidas) - self.segundos_hasta(entradas)
+        validos = ~np.isnan(entradas) & ~np.isnan(salidas) & (salidas > entradas)
+        return np.where(validos, segundos, 0.0)
+    
+    def descuento_escalar(self, entrada, salida):
+        """descuento() para un solo par (ciclo sobre los pocos breaks del día, sin numpy)"""
+        if not (salida > entrada):  # también descarta NaN
             return 0.0
+        return float(sum(max(0.0, min(salida, fin) - max(entrada, inicio)) for inicio, fin in self.intervalos))
+
+class CalendarioBreaks:
+    """Un HorarioBreaks por día de la semana, compilado desde config['horarios_laborales']"""
     
-    if not isinstance(hora_entrada, time) or not isinstance(hora_salida, time):
-        return 0.0
+    def __init__(self, horarios_laborales):
+        self.por_dia = {}
+        for dia, grupo in GRUPOS_HORARIO_POR_DIA.items():
+            horario = horarios_laborales.get(grupo) or {}
+            self.por_dia[dia] = HorarioBreaks(horario.get('breaks', BREAKS_PREDETERMINADOS))
     
-    # Horarios de breaks
-    desayuno_inicio = time(9, 0)   # 9:00 AM
-    desayuno_fin = time(9, 10)      # 9:10 AM
-    almuerzo_inicio = time(12, 30)  # 12:30 PM
-    almuerzo_fin = time(13, 0)      # 1:00 PM
-    
-    descuento_total = 0.0
-    
-    # Verificar si el rango incluye el desayuno (9:00 - 9:10)
-    if hora_entrada <= desayuno_inicio and hora_salida >= desayuno_fin:
-        # Todo el desayuno está dentro del rango
-        descuento_total += 10 / 60  # 10 minutos = 0.167 horas
-        print(f"   🍞 Desayuno descontado: 10 minutos")
-    elif hora_entrada < desayuno_fin and hora_salida > desayuno_inicio:
-        # Parte del desayuno está dentro del rango
-        inicio_efectivo = max(hora_entrada, desayuno_inicio)
-        fin_efectivo = min(hora_salida, desayuno_fin)
-        
-        inicio_dt = datetime.combine(date.today(), inicio_efectivo)
-        fin_dt = datetime.combine(date.today(), fin_efectivo)
-        minutos = (fin_dt - inicio_dt).total_seconds() / 60
-        
-        descuento_total += minutos / 60
-        print(f"   🍞 Desayuno parcial descontado: {minutos:.0f} minutos")
-    
-    # Verificar si el rango incluye el almuerzo (12:30 - 1:00)
-    if hora_entrada <= almuerzo_inicio and hora_salida >= almuerzo_fin:
-        # Todo el almuerzo está dentro del rango
-        descuento_total += 30 / 60  # 30 minutos = 0.5 horas
-        print(f"   🍽️  Almuerzo descontado: 30 minutos")
-    elif hora_entrada < almuerzo_fin and hora_salida > almuerzo_inicio:
-        # Parte del almuerzo está dentro del rango
-        inicio_efectivo = max(hora_entrada, almuerzo_inicio)
-        fin_efectivo = min(hora_salida, almuerzo_fin)
-        
-        inicio_dt = datetime.combine(date.today(), inicio_efectivo)
-        fin_dt = datetime.combine(date.today(), fin_efectivo)
-        minutos = (fin_dt - inicio_dt).total_seconds() / 60
-        
-        descuento_total += minutos / 60
-        print(f"   🍽️  Almuerzo parcial descontado: {minutos:.0f} minutos")
-    
-    return descuento_total
-
-def calcular_horas(hora_entrada, hora_salida, descontar_breaks=True):
+    def para_fecha(self, fecha):
+        return self.por_dia[fecha.weekday()]
+
+@st.cache_resource
+def _cache_calendario_breaks():
+    return {}
+
+def obtener_calendario_breaks():
+    """Calendario de breaks compilado; se recompila solo cuando cambia la instantánea de configuración"""
+    config = obtener_config()
+    cache = _cache_calendario_breaks()
+    calendario = cache.get('calendario')
+    if calendario is None or cache.get('config') is not config:
+        calendario = CalendarioBreaks(config.get('horarios_laborales', {}))
+        cache['calendario'] = calendario
+        cache['config'] = config
+    return calendario
+
+def calcular_descuento_breaks_lote(entradas, salidas, fechas=None):
     """
-    Calcular horas trabajadas entre entrada y salida.
-    Por defecto descuenta automáticamente desayuno y almuerzo.
+    Horas de break que caen dentro de cada rango [entrada, salida].
+    entradas/salidas: arreglos de segundos desde medianoche (NaN = inválido).
+    fechas: fecha de cada par (o una sola fecha para todos); por defecto hoy.
+    Una fecha que no es fecha (None, texto) usa hoy, igual que calcular_descuento_breaks.
+    Los breaks de cada día salen de config.json (horarios_laborales[...]['breaks']).
     """
-    # Validar que ambos valores sean objetos time válidos
-    if pd.isna(hora_entrada) or pd.isna(hora_salida):
-        return 0.0
-    
-    # Convertir strings a time si es necesario
-    if isinstance(hora_entrada, str):
-        try:
-            hora_entrada = datetime.strptime(hora_entrada, '%H:%M:%S').time()
-        except:
-            return 0.0
+    entradas = np.asarray(entradas, dtype=float)
+    salidas = np.asarray(salidas, dtype=float)
+    calendario = obtener_calendario_breaks()
+    
+    if not isinstance(fechas, (list, tuple, np.ndarray, pd.Series, pd.Index)):
+        # Una sola fecha para todos los pares (si no es una fecha válida, se usa hoy)
+        fecha = fechas if hasattr(fechas, 'weekday') else obtener_fecha_colombia()
+        return calendario.para_fecha(fecha).descuento(entradas, salidas) / 3600
+    
+    # Varias fechas: agrupar por día de la semana (máximo 7 grupos)
+    dia_hoy = obtener_fecha_colombia().weekday()
+    dias = np.array([f.weekday() if hasattr(f, 'weekday') else dia_hoy for f in fechas])
+    descuento = np.zeros(entradas.shape)
+    for dia in np.unique(dias):
+        mascara = dias == dia
+        descuento[mascara] = calendario.por_dia[int(dia)].descuento(entradas[mascara], salidas[mascara])
+    return descuento / 3600
+
+def calcular_horas_lote(entradas, salidas, descontar_breaks=True, fechas=None):
+    """
+    Horas trabajadas para arreglos de entradas y salidas.
+    Acepta lo mismo que segundos_desde_medianoche (time, strings o segundos).
+    - Si la salida es menor que la entrada, se asume que cruza la medianoche
+    - Los pares inválidos dan 0
+    - Con descontar_breaks se restan los breaks del día y nunca queda negativo
+    """
+    entradas = segundos_desde_medianoche(entradas)
+    salidas = segundos_desde_medianoche(salidas)
     
-    if isinstance(hora_salida, str):
-        try:
-            hora_salida = datetime.strptime(hora_salida, '%H:%M:%S').time()
-        except:
-            return 0.0
+    duracion = salidas - entradas
+    duracion = np.where(duracion < 0, duracion + SEGUNDOS_POR_DIA, duracion)
+    horas = duracion / 3600
     
-    # Verificar que son objetos time
-    if not isinstance(hora_entrada, time) or not isinstance(hora_salida, time):
-        return 0.0
+    if descontar_breaks:
+        horas = np.maximum(horas - calcular_descuento_breaks_lote(entradas, salidas, fechas), 0)
     
-    entrada = datetime.combine(date.today(), hora_entrada)
-    salida = datetime.combine(date.today(), hora_salida)
+    return np.nan_to_num(horas, nan=0.0)
+
+def calcular_descuento_breaks(hora_entrada, hora_salida, fecha=None):
+    """
+    Calcula el tiempo de descuento por breaks según el rango trabajado.
+    Los breaks se configuran por día en config.json (horarios_laborales[...]['breaks']).
+    Por defecto:
+    - Desayuno: 9:00 AM a 9:10 AM (10 minutos = 0.167 horas)
+    - Almuerzo: 12:30 PM a 1:00 PM (30 minutos = 0.5 horas)
     
-    if salida < entrada:
-        salida = datetime.combine(date.today(), hora_salida) + pd.Timedelta(days=1)
+    Retorna el total de horas a descontar
+    """
+    return _descuento_breaks_escalar(segundos_de_hora(hora_entrada), segundos_de_hora(hora_salida), fecha) / 3600
+
+def _descuento_breaks_escalar(entrada, salida, fecha):
+    """Segundos de break dentro de [entrada, salida] para un solo par (mismas reglas de fecha que el lote)"""
+    fecha = fecha if hasattr(fecha, 'weekday') else obtener_fecha_colombia()
+    return obtener_calendario_breaks().para_fecha(fecha).descuento_escalar(entrada, salida)
+
+def calcular_horas(hora_entrada, hora_salida, descontar_breaks=True, fecha=None):
+    """
+    Calcular horas trabajadas entre entrada y salida.
+    Por defecto descuenta automáticamente los breaks del día (desayuno y almuerzo).
+    Mismo resultado que calcular_horas_lote, sin armar arreglos para un solo par.
+    """
+    entrada = segundos_de_hora(hora_entrada)
+    salida = segundos_de_hora(hora_salida)
+    if np.isnan(entrada) or np.isnan(salida):
+        return 0.0
     
-    diferencia = salida - entrada
-    horas_brutas = diferencia.total_seconds() / 3600
+    duracion = salida - entrada
+    if duracion < 0:
+        duracion += SEGUNDOS_POR_DIA
+    horas = duracion / 3600
     
-    # Aplicar descuentos de breaks si está habilitado
     if descontar_breaks:
-        descuento = calcular_descuento_breaks(hora_entrada, hora_salida)
-        horas_netas = horas_brutas - descuento
-        
-        if descuento > 0:
-            print(f"   ⏱️  Horas brutas: {horas_brutas:.3f} | Descuento: {descuento:.3f} | Netas: {horas_netas:.3f}")
-        
-        return max(0, horas_netas)  # No permitir valores negativos
-    
-    return horas_brutas
+        horas = max(horas - _descuento_breaks_escalar(entrada, salida, fecha) / 3600, 0.0)
+    return float(horas)
 
-def calcular_horas_conteo_diario(empleado_cedula, fecha_registro, hora_registro, hora_forzada=None):
+def calcular_horas_conteo_diario(empleado_cedula, fecha_registro, hora_registro, hora_forzada=None, contexto=None):
     """
     Nueva lógica de conteos basada en verificación directa desde Google Sheets:
     - Consulta el Sheet al momento de leer la cédula
     - Si no hay registros del día: calcula desde 7:00 AM
     - Si ya hay registros del día: calcula desde la última hora_exacta del día
     - hora_forzada: Si se proporciona, usa esta hora en lugar de la actual (para adecuación locativa)
+    - contexto: ContextoRegistro ya leído (evita volver a consultar la hoja)
     """
     hora_inicio_dia = time(7, 0)  # 7:00 AM por defecto
     
@@ -1374,12 +2753,13 @@ def calcular_horas_conteo_diario(empleado_cedula, fecha_registro, hora_registro,
     # NUEVA LÓGICA: Verificar directamente en Google Sheets
     registros_del_dia, es_primer_registro_del_dia, ultima_hora_exacta = verificar_registros_del_dia_en_sheets(
         cedula_str, 
-        fecha_registro
+        fecha_registro,
+        contexto
     )
     
     if es_primer_registro_del_dia:
         # PRIMER REGISTRO DEL DÍA - Contar desde 7:00 AM
-        tiempo_trabajado = calcular_horas(hora_inicio_dia, hora_actual_exacta)
+        tiempo_trabajado = calcular_horas(hora_inicio_dia, hora_actual_exacta, fecha=fecha_registro)
         
         print(f"✨ [PRIMER REGISTRO DEL DÍA]")
         print(f"   📅 Fecha: {fecha_registro}")
@@ -1422,7 +2802,7 @@ def calcular_horas_conteo_diario(empleado_cedula, fecha_registro, hora_registro,
             print(f"   Se registrará 0 horas ya que no hay tiempo adicional.")
             tiempo_trabajado = 0
         else:
-            tiempo_trabajado = calcular_horas(ultima_hora_obj, hora_actual_exacta)
+            tiempo_trabajado = calcular_horas(ultima_hora_obj, hora_actual_exacta, fecha=fecha_registro)
         
         print(f"🔄 [REGISTRO ADICIONAL DEL DÍA]")
         print(f"   📅 Fecha: {fecha_registro}")
@@ -1444,12 +2824,12 @@ def calcular_horas_conteo_diario(empleado_cedula, fecha_registro, hora_registro,
 
 def obtener_resumen_dia_empleado(empleado_cedula, fecha_registro):
     """Obtener resumen completo del día para un empleado"""
-    df = load_data()
+    df = load_data(fecha_inicio=fecha_registro, fecha_fin=fecha_registro)
     cedula_str = str(empleado_cedula).strip()
     
     registros_del_dia = df[
         (df['cedula'].astype(str).str.strip() == cedula_str) & 
-        (df['fecha'].astype(str) == str(fecha_registro))
+        (df['fecha'] == pd.Timestamp(fecha_registro))
     ].sort_values('hora_entrada')
     
     if len(registros_del_dia) == 0:
@@ -1477,11 +2857,11 @@ def obtener_resumen_dia_empleado(empleado_cedula, fecha_registro):
         registros_detalle.append({
             'numero': i + 1,
             'op': registro.get('op', 'N/A'),
-            'hora_entrada': registro.get('hora_entrada', 'N/A'),
-            'hora_salida': registro.get('hora_salida', 'N/A'),
+            'hora_entrada': hora_de_registro(registro.get('hora_entrada')) or 'N/A',
+            'hora_salida': hora_de_registro(registro.get('hora_salida')) or 'N/A',
             'hora_exacta': registro.get('hora_exacta', 'N/A'),
             'horas_trabajadas': horas_trabajadas,
-            'estado': 'Cerrado' if registro.get('hora_salida') else 'Abierto'
+            'estado': 'Cerrado' if pd.notna(registro.get('hora_salida')) else 'Abierto'
         })
     
     return {
@@ -1494,13 +2874,13 @@ def obtener_resumen_dia_empleado(empleado_cedula, fecha_registro):
 
 def buscar_empleado_por_codigo(codigo_barras):
     """Buscar empleado por código de barras en configuración local"""
-    config = load_config()
+    config = obtener_config()
     codigos = config.get('codigos_barras', {})
     return codigos.get(codigo_barras, None)
 
 def diagnosticar_conexion_sheets():
     """Diagnosticar el estado de la conexión con Google Sheets"""
-    config = load_config()
+    config = obtener_config()
     gs_config = config.get('google_sheets', {})
     
     diagnosticos = []
@@ -1578,34 +2958,148 @@ def diagnosticar_conexion_sheets():
     
     return diagnosticos
 
-def conectar_google_sheets():
-    """Conectar a Google Sheets usando las credenciales configuradas (local o Streamlit Cloud)"""
-    from google.oauth2.service_account import Credentials  # Importar siempre al inicio
+# ============================================
+# POOL DE CONEXIONES A GOOGLE SHEETS
+# Un solo cliente autorizado por proceso (por spreadsheet + credenciales),
+# reutilizado por todas las sesiones de Streamlit
+# ============================================
+
+SCOPES_GOOGLE_SHEETS = [
+    'https://spreadsheets.google.com/feeds',
+    'https://www.googleapis.com/auth/drive'
+]
+
+class PoolSheets:
+    """
+    Pool de clientes de Google Sheets compartido por todo el proceso.
+    Por cada (spreadsheet_id, fuente de credenciales) guarda las credenciales,
+    el cliente autorizado, el spreadsheet abierto y los worksheets ya resueltos,
+    de modo que el handshake de autenticación se hace una sola vez.
+    Las llamadas de red (authorize, open_by_key, worksheet, refresh) se hacen
+    fuera del lock del pool; el lock solo protege la publicación de entradas.
+    Cada cliente nuevo pasa por limitar_peticiones_sheets, así que todas las
+    peticiones HTTP a Sheets del proceso comparten un mismo tope.
+    """
     
-    config = load_config()
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entradas = {}
+    
+    def obtener_spreadsheet(self, spreadsheet_id, fuente_credenciales, crear_credenciales):
+        """Retorna el spreadsheet del pool, autorizando solo si no existe todavía"""
+        clave = (spreadsheet_id, fuente_credenciales)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+        
+        if entrada is not None:
+            self._refrescar_token(entrada)
+            return entrada['spreadsheet']
+        
+        # Autorizar sin tener el lock: las demás hojas del pool siguen disponibles
+        credenciales = crear_credenciales()
+        cliente = limitar_peticiones_sheets(gspread.authorize(credenciales))
+        spreadsheet = cliente.open_by_key(spreadsheet_id)
+        nueva = {
+            'credenciales': credenciales,
+            'cliente': cliente,
+            'spreadsheet': spreadsheet,
+            'worksheets': {},
+            'lock_token': threading.Lock()
+        }
+        
+        with self._lock:
+            # Si otro hilo publicó primero, se usa su entrada y se descarta la nueva
+            entrada = self._entradas.setdefault(clave, nueva)
+        if entrada is nueva:
+            print(f"🔐 [POOL SHEETS] Cliente autorizado para {spreadsheet_id} ({fuente_credenciales})")
+        return entrada['spreadsheet']
+    
+    def _refrescar_token(self, entrada):
+        """Refresca el token de acceso si ya expiró (un solo refresco a la vez por cliente)"""
+        credenciales = entrada['credenciales']
+        if credenciales.token and credenciales.expired:
+            with entrada['lock_token']:
+                if credenciales.expired:
+                    credenciales.refresh(Request())
+    
+    def obtener_worksheet(self, spreadsheet, nombre):
+        """Retorna el worksheet cacheado del spreadsheet (lo resuelve la primera vez)"""
+        with self._lock:
+            entrada = next((e for e in self._entradas.values() if e['spreadsheet'] is spreadsheet), None)
+            worksheet = entrada['worksheets'].get(nombre) if entrada is not None else None
+        
+        if worksheet is not None:
+            return worksheet
+        
+        worksheet = spreadsheet.worksheet(nombre)
+        if entrada is None:
+            # Spreadsheet fuera del pool (ej: cliente de diagnóstico)
+            return worksheet
+        
+        with self._lock:
+            return entrada['worksheets'].setdefault(nombre, worksheet)
+    
+    def invalidar(self, spreadsheet_id=None, worksheet=None):
+        """
+        Invalida entradas del pool.
+        - Sin argumentos: descarta todos los clientes (fuerza nueva autenticación)
+        - spreadsheet_id: descarta solo los clientes de ese spreadsheet
+        - worksheet: descarta solo el handle cacheado de esa hoja
+        """
+        with self._lock:
+            if worksheet is not None:
+                for clave, entrada in self._entradas.items():
+                    if spreadsheet_id is None or clave[0] == spreadsheet_id:
+                        entrada['worksheets'].pop(worksheet, None)
+                return
+            
+            if spreadsheet_id is None:
+                self._entradas.clear()
+            else:
+                for clave in [c for c in self._entradas if c[0] == spreadsheet_id]:
+                    del self._entradas[clave]
+
+@st.cache_resource
+def obtener_pool_sheets():
+    """Pool de conexiones único por proceso"""
+    return PoolSheets()
+
+def obtener_worksheet(spreadsheet, nombre):
+    """Obtener una hoja del spreadsheet reutilizando el handle cacheado en el pool"""
+    return obtener_pool_sheets().obtener_worksheet(spreadsheet, nombre)
+
+def invalidar_conexion_sheets(worksheet=None):
+    """Descartar clientes/hojas cacheados (ej: tras un error de autenticación o cambio de configuración)"""
+    obtener_pool_sheets().invalidar(worksheet=worksheet)
+
+def conectar_google_sheets():
+    """Conectar a Google Sheets usando las credenciales configuradas (local o Streamlit Cloud).
+    La conexión se obtiene del pool del proceso: solo se autoriza la primera vez."""
+    config = obtener_config()
     gs_config = config.get('google_sheets', {})
     
     if not gs_config.get('enabled', False):
         return None, "Google Sheets no está habilitado"
     
     try:
-        scope = [
-            'https://spreadsheets.google.com/feeds',
-            'https://www.googleapis.com/auth/drive'
-        ]
+        spreadsheet_id = gs_config.get('spreadsheet_id', '')
+        if not spreadsheet_id:
+            return None, "ID de Google Sheets no configurado"
         
-        credentials = None
+        fuente_credenciales = None
+        crear_credenciales = None
         
         # OPCIÓN 1: Intentar usar Streamlit Secrets (para Streamlit Cloud)
         try:
             if hasattr(st, 'secrets') and 'gcp_service_account' in st.secrets:
                 credentials_dict = dict(st.secrets["gcp_service_account"])
-                credentials = Credentials.from_service_account_info(credentials_dict, scopes=scope)
+                fuente_credenciales = f"secrets:{credentials_dict.get('client_email', '')}"
+                crear_credenciales = lambda: Credentials.from_service_account_info(credentials_dict, scopes=SCOPES_GOOGLE_SHEETS)
         except Exception as e:
             pass  # Si falla, intentar con archivo local
         
         # OPCIÓN 2: Usar archivo local credentials.json
-        if credentials is None:
+        if crear_credenciales is None:
             credentials_file = gs_config.get('credentials_file', '')
             
             # Si la ruta es relativa, convertir a absoluta
@@ -1619,20 +3113,679 @@ def conectar_google_sheets():
             if not os.path.exists(credentials_file):
                 return None, f"Archivo de credenciales no encontrado: {credentials_file}"
             
-            credentials = Credentials.from_service_account_file(credentials_file, scopes=scope)
+            fuente_credenciales = f"archivo:{credentials_file}"
+            crear_credenciales = lambda: Credentials.from_service_account_file(credentials_file, scopes=SCOPES_GOOGLE_SHEETS)
         
-        gc = gspread.authorize(credentials)
-        
-        spreadsheet_id = gs_config.get('spreadsheet_id', '')
-        if not spreadsheet_id:
-            return None, "ID de Google Sheets no configurado"
-        
-        spreadsheet = gc.open_by_key(spreadsheet_id)
+        spreadsheet = obtener_pool_sheets().obtener_spreadsheet(spreadsheet_id, fuente_credenciales, crear_credenciales)
         return spreadsheet, "Conexión exitosa"
         
     except Exception as e:
         return None, f"Error al conectar: {str(e)}"
 
+# ============================================
+# DESCARGAS EN PARALELO
+# Las lecturas independientes de Sheets (varias hojas a la vez) se
+# ejecutan en un grupo de hilos compartido por el proceso.
+# El tope de peticiones simultáneas no depende de ese grupo: lo impone un
+# semáforo sobre la sesión HTTP de cada cliente del pool, de modo que el
+# sincronizador, las recargas de datos maestros y la interfaz comparten
+# el mismo límite y no se agota la cuota de la API.
+# (El hilo de conectividad solo abre sockets, no hace peticiones a Sheets.)
+# ============================================
+
+MAX_DESCARGAS_SIMULTANEAS = 3  # peticiones a Sheets en vuelo al mismo tiempo
+
+@st.cache_resource
+def obtener_limite_peticiones_sheets():
+    """Semáforo compartido por todas las peticiones HTTP a Sheets del proceso"""
+    return threading.BoundedSemaphore(MAX_DESCARGAS_SIMULTANEAS)
+
+def limitar_peticiones_sheets(cliente):
+    """
+    Hace que cada petición HTTP del cliente gspread espere un cupo del semáforo.
+    El cupo se toma solo durante una petición, nunca mientras se espera a otra,
+    por eso no puede bloquear al grupo de hilos ni al sincronizador.
+    Retorna el mismo cliente.
+    """
+    # gspread 6 guarda la sesión en http_client; gspread 5 en el propio cliente
+    sesion = getattr(getattr(cliente, 'http_client', cliente), 'session', None)
+    if sesion is None or getattr(sesion, '_chronotrack_limitada', False):
+        return cliente
+    
+    semaforo = obtener_limite_peticiones_sheets()
+    peticion_original = sesion.request
+    
+    def peticion_limitada(*args, **kwargs):
+        with semaforo:
+            return peticion_original(*args, **kwargs)
+    
+    sesion.request = peticion_limitada
+    sesion._chronotrack_limitada = True
+    return cliente
+
+@st.cache_resource
+def obtener_ejecutor_sheets():
+    """Grupo de hilos para descargas de Sheets, único por proceso"""
+    return ThreadPoolExecutor(max_workers=MAX_DESCARGAS_SIMULTANEAS, thread_name_prefix='chronotrack-sheets')
+
+def ejecutar_en_paralelo(tareas):
+    """
+    Ejecuta tareas independientes (descargas) al mismo tiempo.
+    tareas: dict nombre -> función sin argumentos
+    Retorna: dict nombre -> (resultado, error) - error es None si la tarea terminó bien
+    """
+    if threading.current_thread().name.startswith('chronotrack-sheets'):
+        # Ya estamos dentro del grupo: en serie, para no esperar por hilos del mismo grupo
+        futuros = None
+    else:
+        ejecutor = obtener_ejecutor_sheets()
+        futuros = {nombre: ejecutor.submit(funcion) for nombre, funcion in tareas.items()}
+    
+    resultados = {}
+    for nombre, funcion in tareas.items():
+        try:
+            resultados[nombre] = (futuros[nombre].result() if futuros else funcion(), None)
+        except Exception as e:
+            resultados[nombre] = (None, e)
+    return resultados
+
+# ============================================
+# NORMALIZACIÓN DE TEXTO
+# Los nombres de actividad se comparan sin tildes ni mayúsculas.
+# El resultado se memoriza por proceso y el mapa de Servicio se
+# recalcula solo cuando se descarga de nuevo la hoja (versión de la descarga).
+# ============================================
+
+@st.cache_resource
+def obtener_normalizador_texto():
+    """Normalizador con memoria LRU, único por proceso"""
+    @lru_cache(maxsize=8192)
+    def normalizar(texto):
+        texto = texto.lower().strip()
+        if texto.isascii():
+            return texto
+        # Normalizar Unicode y quitar acentos
+        texto = unicodedata.normalize('NFD', texto)
+        return ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
+    return normalizar
+
+def normalizar_texto(texto):
+    """Normaliza texto: minúsculas y sin tildes"""
+    return obtener_normalizador_texto()(str(texto))
+
+class MapaServicios:
+    """
+    Actividades de la hoja 'Servicio' con su nombre normalizado.
+    - servicios: lista en el orden de la hoja (numero, actividad, clave)
+    - por_nombre: nombre normalizado -> código (si se repite, gana la última fila)
+    """
+    
+    def __init__(self, filas, idx_actividad, idx_numero=None):
+        self.servicios = []
+        self.por_nombre = {}
+        for row in filas:
+            if len(row) > idx_actividad:
+                actividad = str(row[idx_actividad]).strip()
+                numero = str(row[idx_numero]).strip() if idx_numero is not None and len(row) > idx_numero else ''
+                if actividad:
+                    clave = normalizar_texto(actividad)
+                    self.servicios.append({'numero': numero, 'actividad': actividad, 'clave': clave})
+                    self.por_nombre[clave] = numero
+
+@st.cache_resource
+def _cache_hoja_servicio():
+    return {'lock': threading.Lock()}
+
+def leer_hoja_servicio(spreadsheet):
+    """
+    Hoja 'Servicio' descargada como máximo una vez por TTL de datos maestros
+    (config 'datos_maestros' -> 'ttl_segundos').
+    Retorna: (esquema, filas, version) - version es el momento de la descarga
+    """
+    cache = _cache_hoja_servicio()
+    ttl = config_valor('datos_maestros', 'ttl_segundos', defecto=DatosMaestros.TTL_PREDETERMINADO, tipo=float)
+    with cache['lock']:
+        descarga = cache.get('descarga')
+        if descarga is not None and monotonic() - descarga[2] <= ttl:
+            return descarga
+    
+    esquema, filas = leer_hoja(obtener_worksheet(spreadsheet, 'Servicio'), 'Servicio')
+    descarga = (esquema, filas, monotonic())
+    with cache['lock']:
+        cache['descarga'] = descarga
+    return descarga
+
+@st.cache_resource
+def _cache_mapa_servicios():
+    return {}
+
+def obtener_mapa_servicios(filas, idx_actividad, idx_numero, version):
+    """Mapa de servicios compilado; se reconstruye solo con otra descarga de la hoja (version)"""
+    clave = (version, idx_actividad, idx_numero)
+    cache = _cache_mapa_servicios()
+    mapa = cache.get(clave)
+    if mapa is None:
+        mapa = MapaServicios(filas, idx_actividad, idx_numero)
+        cache.clear()
+        cache[clave] = mapa
+    return mapa
+
+# ============================================
+# ESQUEMAS DE LAS HOJAS
+# Cada campo lógico tiene sus encabezados aceptados (en orden de preferencia).
+# Los índices se resuelven una vez por versión de encabezados y las filas
+# se leen por posición, sin volver a comparar encabezados en cada lectura.
+# ============================================
+
+ESQUEMAS_HOJAS = {
+    'Registros': {
+        'fecha': ('fecha',),
+        'cedula': ('cédula', 'cedula'),
+        'nombre': ('nombre',),
+        'orden': ('orden',),
+        'actividad': ('actividad',),
+        'tiempo': ('tiempo [hr]', 'tiempo'),
+        'hora_exacta': ('hora_exacta',),
+        'id_registro': ('id_registro',),
+    },
+    'Datos_colab': {
+        'cedula': ('cedula', 'cédula', 'codigo'),
+        'nombre': ('nombre', 'empleado'),
+    },
+    'Servicio': {
+        'codigo': ('codigo', 'código', 'numero'),
+        'actividad': ('actividad', 'nomservicio', 'descripcion'),
+    },
+    'OPS': {
+        'orden': ('orden', 'op'),
+        'referencia': ('referencia',),
+        'cantidades': ('cantidades', 'cantidad'),
+        'cliente': ('cliente',),
+        'item': ('item', 'descripcion'),
+        'estado': ('estado',),
+        'tiemposprome': ('tiemposprome',),
+    },
+}
+
+class EsquemaHoja:
+    """
+    Columnas de una hoja resueltas contra sus encabezados.
+    - indices: campo -> índice de columna (None si la hoja no lo tiene)
+    - accesor(*campos): función que lee esos campos de una fila por posición
+    """
+    
+    def __init__(self, nombre, headers):
+        self.nombre = nombre
+        self.headers = list(headers)
+        posiciones = {}
+        for idx, header in enumerate(self.headers):
+            posiciones.setdefault(str(header).strip().lower(), idx)
+        self.indices = {
+            campo: next((posiciones[a] for a in alias if a in posiciones), None)
+            for campo, alias in ESQUEMAS_HOJAS[nombre].items()
+        }
+    
+    def tiene(self, *campos):
+        return all(self.indices.get(campo) is not None for campo in campos)
+    
+    def accesor(self, *campos):
+        """Lector compilado: fila -> tupla de textos (sin espacios) de los campos pedidos"""
+        indices = tuple(self.indices.get(campo) for campo in campos)
+        def leer(fila):
+            n = len(fila)
+            return tuple(str(fila[i]).strip() if i is not None and i < n else '' for i in indices)
+        return leer
+    
+    def registro(self, fila):
+        """Fila como dict campo -> texto, con todos los campos del esquema"""
+        return dict(zip(self.indices, self.accesor(*self.indices)(fila)))
+
+@st.cache_resource
+def _cache_esquemas():
+    return {}
+
+def obtener_esquema(nombre, headers):
+    """Esquema compilado para estos encabezados (se reutiliza mientras no cambien)"""
+    clave = (nombre, tuple(headers))
+    cache = _cache_esquemas()
+    esquema = cache.get(clave)
+    if esquema is None:
+        esquema = EsquemaHoja(nombre, headers)
+        cache[clave] = esquema
+    return esquema
+
+def leer_hoja(worksheet, nombre):
+    """
+    Descarga la hoja una sola vez.
+    Retorna: (esquema, filas) - filas sin el encabezado
+    """
+    all_values = worksheet.get_all_values()
+    headers = all_values[0] if all_values else []
+    return obtener_esquema(nombre, headers), all_values[1:]
+
+# ============================================
+# ESPEJO LOCAL DE LA HOJA REGISTROS
+# Copia en memoria indexada por (cédula, fecha) y por OP.
+# Solo descarga las filas agregadas desde la última sincronización.
+# ============================================
+
+ETAPAS_PROYECTO = ('corte', 'mecanizado', 'doblado', 'ensamble')
+
+def clasificar_etapa(actividad):
+    """Etapa del proyecto (corte/mecanizado/doblado/ensamble) según el nombre de la actividad, o None"""
+    actividad = str(actividad).strip().upper()
+    for etapa in ETAPAS_PROYECTO:
+        if etapa.upper() in actividad:
+            return etapa
+    return None
+
+def convertir_tiempo_registro(valor):
+    """Convierte el texto de 'Tiempo [Hr]' (coma o punto decimal) a float; 0 si no es válido"""
+    try:
+        return float(str(valor).replace(',', '.')) if valor else 0
+    except (TypeError, ValueError):
+        return 0
+
+class EspejoRegistros:
+    """
+    Copia en memoria de la hoja 'Registros'.
+    - La primera vez descarga la hoja completa
+    - Después solo pide el rango desde la última fila conocida (filas nuevas al final);
+      si esa fila ya no coincide (se borraron o movieron filas), recarga completa
+    - Cada cierto tiempo hace una recarga completa para reflejar ediciones manuales
+    - Mantiene las horas acumuladas por OP y etapa a medida que llegan filas
+    - Mantiene el conjunto de id_registro presentes (deduplicación de envíos)
+    """
+    
+    INTERVALO_RECARGA_COMPLETA = 600  # segundos
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.headers = []
+        self.filas = []
+        self.columnas = {}
+        self._por_cedula_fecha = {}
+        self._por_op = {}
+        self._horas_por_op = {}
+        self._ids = set()
+        self._ultima_carga_completa = None
+    
+    def sincronizar(self, worksheet):
+        """Trae las filas nuevas de la hoja (o la hoja completa si toca recarga)"""
+        with self._lock:
+            if (not self.headers or self._ultima_carga_completa is None or
+                    monotonic() - self._ultima_carga_completa > self.INTERVALO_RECARGA_COMPLETA):
+                self._carga_completa(worksheet)
+            else:
+                self._sincronizar_cola(worksheet)
+    
+    def invalidar(self):
+        """Fuerza una recarga completa en la próxima sincronización"""
+        with self._lock:
+            self._ultima_carga_completa = None
+    
+    def _carga_completa(self, worksheet):
+        all_values = worksheet.get_all_values()
+        self.headers = all_values[0] if all_values else []
+        self.filas = []
+        self._por_cedula_fecha = {}
+        self._por_op = {}
+        self._horas_por_op = {}
+        self._ids = set()
+        self.columnas = self._resolver_columnas(self.headers)
+        self._agregar_filas(all_values[1:])
+        self._ultima_carga_completa = monotonic()
+        print(f"📥 [ESPEJO REGISTROS] Carga completa: {len(self.filas)} filas")
+    
+    def _sincronizar_cola(self, worksheet):
+        if not self.filas:
+            # Sin filas no hay ancla: se pide desde la primera fila de datos
+            primera_fila = 2
+        else:
+            primera_fila = len(self.filas) + 1  # +1 por encabezados: última fila conocida (ancla)
+        ultima_columna = gspread.utils.rowcol_to_a1(1, max(len(self.headers), 1))[:-1]
+        nuevas = worksheet.get(f"A{primera_fila}:{ultima_columna}")
+        
+        if self.filas:
+            # La hoja se achicó o cambió antes del final conocido: los índices ya no sirven
+            if not nuevas or self._recortar(nuevas[0]) != self._recortar(self.filas[-1]):
+                print(f"♻️ [ESPEJO REGISTROS] La fila {primera_fila} cambió (filas borradas o movidas), recarga completa")
+                self._carga_completa(worksheet)
+                return
+            nuevas = nuevas[1:]
+        
+        if nuevas:
+            self._agregar_filas(nuevas)
+            print(f"📥 [ESPEJO REGISTROS] {len(nuevas)} fila(s) nuevas (total {len(self.filas)})")
+    
+    @staticmethod
+    def _recortar(fila):
+        """Fila como lista de textos sin celdas vacías al final (así la devuelve la API)"""
+        valores = [str(v) for v in fila]
+        while valores and valores[-1] == '':
+            valores.pop()
+        return valores
+    
+    @staticmethod
+    def _resolver_columnas(headers):
+        esquema = obtener_esquema('Registros', headers)
+        return {campo: idx for campo, idx in esquema.indices.items() if idx is not None}
+    
+    def _agregar_filas(self, filas):
+        ancho = len(self.headers)
+        idx_cedula = self.columnas.get('cedula')
+        idx_fecha = self.columnas.get('fecha')
+        idx_orden = self.columnas.get('orden')
+        idx_actividad = self.columnas.get('actividad')
+        idx_tiempo = self.columnas.get('tiempo')
+        idx_id = self.columnas.get('id_registro')
+        sumar_horas = idx_orden is not None and idx_actividad is not None and idx_tiempo is not None
+        
+        for fila in filas:
+            fila = list(fila)
+            if len(fila) < ancho:
+                fila.extend([''] * (ancho - len(fila)))
+            posicion = len(self.filas)
+            self.filas.append(fila)
+            
+            if idx_cedula is not None and idx_fecha is not None:
+                clave = (str(fila[idx_cedula]).strip(), str(fila[idx_fecha]).strip())
+                self._por_cedula_fecha.setdefault(clave, []).append(posicion)
+            if idx_orden is not None:
+                orden = str(fila[idx_orden]).strip()
+                if orden:
+                    self._por_op.setdefault(orden, []).append(posicion)
+                    if sumar_horas:
+                        etapa = clasificar_etapa(fila[idx_actividad])
+                        if etapa:
+                            horas = self._horas_por_op.setdefault(orden, dict.fromkeys(ETAPAS_PROYECTO, 0))
+                            horas[etapa] += convertir_tiempo_registro(fila[idx_tiempo])
+            if idx_id is not None:
+                id_registro = str(fila[idx_id]).strip()
+                if id_registro:
+                    self._ids.add(id_registro)
+    
+    def filas_de_cedula_fecha(self, cedula, fecha_str):
+        """Filas de una cédula en una fecha (formato de la hoja), en orden de la hoja"""
+        with self._lock:
+            posiciones = self._por_cedula_fecha.get((str(cedula).strip(), str(fecha_str).strip()), [])
+            return [self.filas[p] for p in posiciones]
+    
+    def filas_de_op(self, orden):
+        """Filas de una OP, en orden de la hoja"""
+        with self._lock:
+            posiciones = self._por_op.get(str(orden).strip(), [])
+            return [self.filas[p] for p in posiciones]
+    
+    def horas_de_op(self, orden):
+        """Horas acumuladas por etapa de una OP (copia; ceros si no tiene registros)"""
+        with self._lock:
+            horas = self._horas_por_op.get(str(orden).strip())
+            return dict(horas) if horas else dict.fromkeys(ETAPAS_PROYECTO, 0)
+    
+    def ids_presentes(self, ids):
+        """Subconjunto de 'ids' que ya tiene la hoja"""
+        with self._lock:
+            return {i for i in ids if i and i in self._ids}
+
+@st.cache_resource
+def obtener_espejo_registros():
+    """Espejo de Registros único por proceso"""
+    return EspejoRegistros()
+
+# Columna (1-based) preferida para id_registro en 'Registros': justo después de hora_exacta.
+# Las columnas anteriores las ocupan los datos de construir_fila_registros
+COLUMNA_ID_REGISTRO = 17
+
+def asegurar_columna_id_registro(worksheet, espejo):
+    """
+    Ubica la columna 'id_registro' de Registros, creándola si la hoja aún no la tiene
+    (en la columna 17 o, si está ocupada, en la primera libre después de ella).
+    Retorna su posición (0-based) o None si no se puede usar: en ese caso las
+    filas se escriben sin id y no se deduplica.
+    """
+    with espejo._lock:
+        idx = espejo.columnas.get('id_registro')
+        if idx is not None:
+            if idx < COLUMNA_ID_REGISTRO - 1:
+                print(f"⚠️ [ESPEJO REGISTROS] 'id_registro' está en la columna {idx + 1}, que ocupan los datos del registro")
+                return None
+            return idx
+        
+        idx = COLUMNA_ID_REGISTRO - 1
+        while idx < len(espejo.headers) and str(espejo.headers[idx]).strip():
+            idx += 1
+        if idx != COLUMNA_ID_REGISTRO - 1:
+            print(f"⚠️ [ESPEJO REGISTROS] La columna {COLUMNA_ID_REGISTRO} ya tiene otro encabezado, 'id_registro' va en la columna {idx + 1}")
+        
+        columnas_hoja = getattr(worksheet, 'col_count', None)
+        if columnas_hoja is not None and idx + 1 > columnas_hoja:
+            worksheet.add_cols(idx + 1 - columnas_hoja)
+        worksheet.update_cell(1, idx + 1, 'id_registro')
+        print(f"🆕 [ESPEJO REGISTROS] Columna 'id_registro' creada en Registros (columna {idx + 1})")
+        espejo.invalidar()
+        espejo.sincronizar(worksheet)
+        return espejo.columnas.get('id_registro')
+
+def ids_registro_en_hoja(worksheet, ids):
+    """
+    Sincroniza el espejo (solo la cola de la hoja) y retorna (ids ya presentes en
+    Registros, posición 0-based de la columna id_registro o None).
+    Si hace falta, crea la columna id_registro.
+    """
+    espejo = obtener_espejo_registros()
+    espejo.sincronizar(worksheet)
+    idx_id = asegurar_columna_id_registro(worksheet, espejo)
+    if idx_id is None:
+        return set(), None
+    return espejo.ids_presentes(ids), idx_id
+
+def ubicar_id_registro(fila, idx_id):
+    """
+    Mueve el id_registro de una fila de construir_fila_registros a la columna
+    real de la hoja (idx_id, 0-based). Sin columna utilizable la fila va sin id.
+    """
+    posicion = COLUMNA_ID_REGISTRO - 1
+    if idx_id == posicion:
+        return fila
+    datos = fila[:posicion]
+    if idx_id is None:
+        return datos
+    return datos + [''] * (idx_id - posicion) + [fila[posicion]]
+
+def filtrar_filas_ya_en_hoja(worksheet, filas, ids_registro):
+    """
+    Quita del lote las filas cuyo id_registro ya está en la hoja.
+    ids_registro va en paralelo a filas. Retorna (filas, ids_registro); todo si no se puede revisar.
+    """
+    try:
+        presentes, _ = ids_registro_en_hoja(worksheet, ids_registro)
+    except Exception as e:
+        print(f"⚠️ [SYNC LOTES] No se pudo revisar ids en la hoja: {e}")
+        return filas, ids_registro
+    if not presentes:
+        return filas, ids_registro
+    print(f"♻️ [SYNC LOTES] {len(presentes)} fila(s) del lote ya estaban en la hoja")
+    quedan = [i for i, id_registro in enumerate(ids_registro) if id_registro not in presentes]
+    return [filas[i] for i in quedan], [ids_registro[i] for i in quedan]
+
+def sincronizar_espejo_registros():
+    """
+    Sincroniza el espejo local con la hoja 'Registros'.
+    Retorna: (espejo, mensaje) - espejo es None si no hay conexión
+    """
+    spreadsheet, mensaje = conectar_google_sheets()
+    if spreadsheet is None:
+        return None, mensaje
+    
+    config = obtener_config()
+    worksheet_name = config.get('google_sheets', {}).get('worksheet_registros', 'Registros')
+    worksheet = obtener_worksheet(spreadsheet, worksheet_name)
+    
+    espejo = obtener_espejo_registros()
+    try:
+        espejo.sincronizar(worksheet)
+    except Exception as e:
+        marcar_conexion_caida(e)
+        raise
+    return espejo, "Espejo sincronizado"
+
+# ============================================
+# LECTURA DE REGISTROS POR RANGO DE FECHAS
+# La hoja se llena en orden de llegada, así que los registros de un día
+# quedan en un bloque de filas. Se indexa solo la columna Fecha y los
+# reportes piden únicamente las filas que cubren el rango solicitado.
+# ============================================
+
+def parsear_fecha_registro(fecha_str):
+    """Fecha de la hoja ('dd/mm/yyyy' o 'yyyy-mm-dd') como date, o None"""
+    fecha_str = str(fecha_str).strip()
+    for formato in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(fecha_str, formato).date()
+        except ValueError:
+            continue
+    return None
+
+class IndiceFechasRegistros:
+    """
+    Índice fecha -> (primera fila, última fila) de la hoja 'Registros'.
+    Solo descarga la columna Fecha (completa la primera vez, luego solo la cola).
+    Guarda la última fila indexada completa (ancla) y la vuelve a leer en cada
+    sincronización: si ya no coincide (se borraron, movieron o editaron filas
+    anteriores, o la hoja se achicó) el índice se reconstruye.
+    """
+    
+    INTERVALO_RECARGA_COMPLETA = 600  # segundos
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.headers = []
+        self.idx_fecha = None
+        self.total_filas = 0      # filas de datos indexadas (sin encabezado)
+        self.rangos = {}          # date -> [primera_fila, ultima_fila] (números de fila de la hoja)
+        self._ancla = None        # contenido de la fila total_filas + 1 (recortado)
+        self._ultima_carga_completa = None
+    
+    def sincronizar(self, worksheet):
+        with self._lock:
+            if (self.idx_fecha is None or self._ultima_carga_completa is None or
+                    monotonic() - self._ultima_carga_completa > self.INTERVALO_RECARGA_COMPLETA):
+                self._reiniciar(worksheet)
+            if self.idx_fecha is None:
+                return
+            
+            letra = gspread.utils.rowcol_to_a1(1, self.idx_fecha + 1)[:-1]
+            if self.total_filas == 0:
+                primera_fila = 2
+                nuevas = worksheet.get(f"{letra}{primera_fila}:{letra}")
+            else:
+                # Ancla completa y cola de la columna Fecha en una sola petición
+                fila_ancla = self.total_filas + 1
+                ancla, nuevas = worksheet.batch_get([
+                    f"A{fila_ancla}:{self._ultima_columna()}{fila_ancla}",
+                    f"{letra}{fila_ancla}:{letra}"
+                ])
+                if EspejoRegistros._recortar(ancla[0] if ancla else []) != self._ancla:
+                    print(f"♻️ [ÍNDICE FECHAS] La fila {fila_ancla} cambió (filas borradas o movidas), reconstrucción")
+                    self._reiniciar(worksheet)
+                    if self.idx_fecha is None:
+                        return
+                    letra = gspread.utils.rowcol_to_a1(1, self.idx_fecha + 1)[:-1]
+                    primera_fila = 2
+                    nuevas = worksheet.get(f"{letra}{primera_fila}:{letra}")
+                else:
+                    primera_fila = fila_ancla + 1
+                    nuevas = list(nuevas or [])[1:]
+            
+            if not nuevas:
+                return
+            
+            for desplazamiento, valor in enumerate(nuevas):
+                numero_fila = primera_fila + desplazamiento
+                fecha = parsear_fecha_registro(valor[0]) if valor else None
+                if fecha is not None:
+                    rango = self.rangos.setdefault(fecha, [numero_fila, numero_fila])
+                    rango[1] = numero_fila
+            self.total_filas += len(nuevas)
+            
+            fila_ancla = self.total_filas + 1
+            ancla = worksheet.get(f"A{fila_ancla}:{self._ultima_columna()}{fila_ancla}")
+            self._ancla = EspejoRegistros._recortar(ancla[0] if ancla else [])
+    
+    def _reiniciar(self, worksheet):
+        self.headers = worksheet.row_values(1)
+        self.idx_fecha = obtener_esquema('Registros', self.headers).indices['fecha']
+        self.total_filas = 0
+        self.rangos = {}
+        self._ancla = None
+        self._ultima_carga_completa = monotonic()
+    
+    def _ultima_columna(self):
+        return gspread.utils.rowcol_to_a1(1, max(len(self.headers), 1))[:-1]
+    
+    def rango_filas(self, fecha_inicio, fecha_fin):
+        """(primera, ultima) fila de la hoja que cubre el rango de fechas, o None si no hay registros"""
+        with self._lock:
+            rangos = [r for f, r in self.rangos.items() if fecha_inicio <= f <= fecha_fin]
+            if not rangos:
+                return None
+            return min(r[0] for r in rangos), max(r[1] for r in rangos)
+
+@st.cache_resource
+def obtener_indice_fechas_registros():
+    """Índice de fechas de Registros único por proceso"""
+    return IndiceFechasRegistros()
+
+def leer_registros_por_fecha(fecha_inicio=None, fecha_fin=None):
+    """
+    Filas de la hoja 'Registros' para un rango de fechas.
+    - Con rango: pide solo el bloque A1 de filas que contiene esas fechas
+    - Sin rango: usa el espejo completo de Registros
+    Retorna: (headers, filas) - filas ya filtradas por fecha; ([], []) si no hay conexión
+    """
+    if fecha_inicio is None or fecha_fin is None:
+        espejo, mensaje = sincronizar_espejo_registros()
+        if espejo is None:
+            return [], []
+        return list(espejo.headers), list(espejo.filas)
+    
+    spreadsheet, mensaje = conectar_google_sheets()
+    if spreadsheet is None:
+        return [], []
+    
+    config = obtener_config()
+    worksheet_name = config.get('google_sheets', {}).get('worksheet_registros', 'Registros')
+    worksheet = obtener_worksheet(spreadsheet, worksheet_name)
+    
+    indice = obtener_indice_fechas_registros()
+    try:
+        indice.sincronizar(worksheet)
+        if indice.idx_fecha is None:
+            return indice.headers, []
+        
+        rango = indice.rango_filas(fecha_inicio, fecha_fin)
+        if rango is None:
+            return indice.headers, []
+        
+        ultima_columna = gspread.utils.rowcol_to_a1(1, max(len(indice.headers), 1))[:-1]
+        filas = worksheet.get(f"A{rango[0]}:{ultima_columna}{rango[1]}")
+    except Exception as e:
+        marcar_conexion_caida(e)
+        raise
+    
+    print(f"📥 [REGISTROS POR FECHA] {fecha_inicio} a {fecha_fin}: filas {rango[0]}-{rango[1]}")
+    
+    # El bloque puede incluir filas de otras fechas intercaladas: filtrar
+    ancho = len(indice.headers)
+    resultado = []
+    for fila in filas:
+        fila = list(fila) + [''] * (ancho - len(fila))
+        fecha = parsear_fecha_registro(fila[indice.idx_fecha])
+        if fecha is not None and fecha_inicio <= fecha <= fecha_fin:
+            resultado.append(fila)
+    return indice.headers, resultado
+
 def obtener_ultimo_registro_sheets(cedula):
     """Buscar el último registro de un empleado en la hoja 'Registros' de Google Sheets y extraer hora_exacta"""
     spreadsheet, mensaje = conectar_google_sheets()
@@ -1641,50 +3794,35 @@ def obtener_ultimo_registro_sheets(cedula):
         return None, mensaje
     
     try:
-        config = load_config()
-        worksheet_name = config.get('google_sheets', {}).get('worksheet_registros', 'Registros')
-        worksheet = spreadsheet.worksheet(worksheet_name)
-        
-        # Obtener todos los registros
+        # Filas de Registros desde el espejo local (solo se descargan las nuevas)
         try:
-            all_values = worksheet.get_all_values()
-            if len(all_values) < 2:
+            espejo, mensaje = sincronizar_espejo_registros()
+            if espejo is None:
+                return None, mensaje
+            if not espejo.filas:
                 return None, "La hoja 'Registros' está vacía"
             
-            headers = all_values[0]
-            rows = all_values[1:]
-            
-            # Encontrar el índice de las columnas relevantes
-            try:
-                cedula_idx = headers.index('Cédula')
-            except ValueError:
-                try:
-                    cedula_idx = headers.index('cedula')
-                except ValueError:
-                    return None, "No se encontró la columna 'Cédula' en la hoja 'Registros'"
-            
-            try:
-                hora_exacta_idx = headers.index('hora_exacta')
-            except ValueError:
+            headers = espejo.headers
+            esquema = obtener_esquema('Registros', headers)
+            if not esquema.tiene('cedula'):
+                return None, "No se encontró la columna 'Cédula' en la hoja 'Registros'"
+            if not esquema.tiene('hora_exacta'):
                 return None, "No se encontró la columna 'hora_exacta' en la hoja 'Registros'"
+            leer = esquema.accesor('cedula', 'hora_exacta')
             
             # Buscar registros de esta cédula (del más reciente al más antiguo)
             ultimo_registro = None
-            for row in reversed(rows):  # Recorrer desde el final
-                if len(row) > cedula_idx:
-                    cedula_en_fila = str(row[cedula_idx]).strip()
-                    if cedula_en_fila == str(cedula).strip():
-                        # Encontramos el último registro de esta cédula
-                        if len(row) > hora_exacta_idx and row[hora_exacta_idx]:
-                            hora_exacta = row[hora_exacta_idx].strip()
-                            if hora_exacta:
-                                # Construir objeto con información del registro
-                                ultimo_registro = {
-                                    'hora_exacta': hora_exacta,
-                                    'fila_completa': row,
-                                    'headers': headers
-                                }
-                                break
+            cedula_str = str(cedula).strip()
+            for row in reversed(espejo.filas):  # Recorrer desde el final
+                cedula_en_fila, hora_exacta = leer(row)
+                if cedula_en_fila == cedula_str and hora_exacta:
+                    # Construir objeto con información del registro
+                    ultimo_registro = {
+                        'hora_exacta': hora_exacta,
+                        'fila_completa': row,
+                        'headers': headers
+                    }
+                    break
             
             if ultimo_registro:
                 return ultimo_registro, "Último registro encontrado"
@@ -1697,73 +3835,102 @@ def obtener_ultimo_registro_sheets(cedula):
     except Exception as e:
         return None, f"Error al buscar último registro: {str(e)}"
 
-def verificar_registros_del_dia_en_sheets(cedula, fecha_actual):
+# Posición de cada campo en las filas que arma construir_fila_registros
+COLUMNAS_FILA_REGISTROS = {'fecha': 0, 'cedula': 1, 'nombre': 2, 'orden': 3, 'actividad': 6, 'tiempo': 8, 'hora_exacta': 15, 'id_registro': 16}
+
+class ContextoRegistro:
+    """
+    Registros del día de una cédula, leídos una sola vez por guardado.
+    Lo comparten la verificación de doble guardado y el cálculo de la última
+    hora_exacta, así cada escaneo sincroniza el espejo de Registros una sola vez.
+    Incluye al final los registros de la cola de salida que aún no llegan a Sheets.
+    """
+    
+    def __init__(self, cedula, fecha):
+        self.cedula = str(cedula).strip()
+        self.fecha_str = fecha.strftime('%d/%m/%Y') if hasattr(fecha, 'strftime') else str(fecha)
+        self.disponible = False   # True si se pudo leer la hoja (o hay registros en cola) y tiene las columnas necesarias
+        self.mensaje = ""
+        self.filas = []
+        self.idx_hora_exacta = None
+        
+        # La cola se lee antes que la hoja para que un registro que se entregue en
+        # medio no quede fuera; si ya está en la hoja se descarta por id_registro
+        en_cola = registros_pendientes_de_cedula_fecha(self.cedula, self.fecha_str)
+        
+        try:
+            espejo, mensaje = sincronizar_espejo_registros()
+        except Exception as e:
+            espejo, mensaje = None, f"Error leyendo Registros: {e}"
+        
+        if espejo is None:
+            self.mensaje = mensaje
+            if en_cola:
+                # Sin hoja: los registros en cola bastan para conocer la última hora del día
+                self.disponible = True
+                self.idx_hora_exacta = COLUMNAS_FILA_REGISTROS['hora_exacta']
+                self.filas = en_cola
+            return
+        
+        if espejo.filas and ('cedula' not in espejo.columnas or 'fecha' not in espejo.columnas):
+            self.mensaje = "Columnas no encontradas"
+            return
+        
+        self.disponible = True
+        self.idx_hora_exacta = espejo.columnas.get('hora_exacta')
+        self.filas = espejo.filas_de_cedula_fecha(self.cedula, self.fecha_str) if espejo.filas else []
+        entregados = espejo.ids_presentes(fila[COLUMNAS_FILA_REGISTROS['id_registro']] for fila in en_cola)
+        self.filas += [self._en_columnas_de_hoja(fila, espejo) for fila in en_cola
+                       if fila[COLUMNAS_FILA_REGISTROS['id_registro']] not in entregados]
+    
+    @staticmethod
+    def _en_columnas_de_hoja(fila, espejo):
+        """Reubica una fila de construir_fila_registros según las columnas reales de la hoja"""
+        if not espejo.headers:
+            return fila
+        reubicada = [''] * len(espejo.headers)
+        for campo, posicion in COLUMNAS_FILA_REGISTROS.items():
+            idx = espejo.columnas.get(campo)
+            if idx is not None:
+                reubicada[idx] = fila[posicion]
+        return reubicada
+    
+    def hora_exacta(self, fila):
+        """hora_exacta de una fila (None si la columna no existe)"""
+        if self.idx_hora_exacta is None or len(fila) <= self.idx_hora_exacta:
+            return None
+        return fila[self.idx_hora_exacta].strip()
+    
+    def ultima_hora_exacta(self):
+        """hora_exacta del último registro del día (None si no hay)"""
+        return self.hora_exacta(self.filas[-1]) if self.filas else None
+
+def verificar_registros_del_dia_en_sheets(cedula, fecha_actual, contexto=None):
     """
     Verifica en Google Sheets si la cédula ya tiene registros en el día actual.
+    Usa el espejo local de Registros (solo trae las filas nuevas de la hoja).
+    Si se pasa un ContextoRegistro, reutiliza sus filas sin volver a leer la hoja.
     Retorna:
     - registros_del_dia: lista de registros del día actual
     - es_primer_registro_del_dia: True si no hay registros del día, False si ya hay
     - ultima_hora_exacta_del_dia: la hora_exacta del último registro del día (si existe)
     """
-    spreadsheet, mensaje = conectar_google_sheets()
-    
-    if spreadsheet is None:
-        print(f"⚠️ [VERIFICACIÓN SHEETS] No se pudo conectar: {mensaje}")
-        return [], True, None  # Asumir primer registro si no hay conexión
-    
     try:
-        config = load_config()
-        worksheet_name = config.get('google_sheets', {}).get('worksheet_registros', 'Registros')
-        worksheet = spreadsheet.worksheet(worksheet_name)
+        if contexto is None:
+            contexto = ContextoRegistro(cedula, fecha_actual)
         
-        all_values = worksheet.get_all_values()
-        if len(all_values) < 2:
-            print(f"✅ [VERIFICACIÓN SHEETS] Hoja vacía - PRIMER REGISTRO DEL DÍA")
-            return [], True, None
-        
-        headers = all_values[0]
-        rows = all_values[1:]
-        
-        # Encontrar índices de columnas
-        cedula_idx = None
-        fecha_idx = None
-        hora_exacta_idx = None
-        
-        for idx, header in enumerate(headers):
-            header_lower = header.lower().strip()
-            if 'cédula' in header_lower or 'cedula' in header_lower:
-                cedula_idx = idx
-            elif 'fecha' in header_lower:
-                fecha_idx = idx
-            elif 'hora_exacta' in header_lower:
-                hora_exacta_idx = idx
-        
-        if cedula_idx is None or fecha_idx is None:
-            print(f"⚠️ [VERIFICACIÓN SHEETS] Columnas no encontradas")
-            return [], True, None
-        
-        # Formatear fecha actual para comparación
-        if hasattr(fecha_actual, 'strftime'):
-            fecha_str = fecha_actual.strftime('%d/%m/%Y')
-        else:
-            fecha_str = str(fecha_actual)
+        if not contexto.disponible:
+            print(f"⚠️ [VERIFICACIÓN SHEETS] No se pudo verificar: {contexto.mensaje}")
+            return [], True, None  # Asumir primer registro si no hay conexión
         
-        cedula_str = str(cedula).strip()
-        registros_del_dia = []
+        cedula_str = contexto.cedula
+        fecha_str = contexto.fecha_str
         
-        # Buscar todos los registros de esta cédula en esta fecha
-        for row in rows:
-            if len(row) > max(cedula_idx, fecha_idx):
-                cedula_en_fila = str(row[cedula_idx]).strip()
-                fecha_en_fila = str(row[fecha_idx]).strip()
-                
-                # Comparar cédula y fecha
-                if cedula_en_fila == cedula_str and fecha_en_fila == fecha_str:
-                    registro_info = {
-                        'fila': row,
-                        'hora_exacta': row[hora_exacta_idx].strip() if hora_exacta_idx and len(row) > hora_exacta_idx else None
-                    }
-                    registros_del_dia.append(registro_info)
+        # Todos los registros de esta cédula en esta fecha (búsqueda por índice)
+        registros_del_dia = [
+            {'fila': row, 'hora_exacta': contexto.hora_exacta(row)}
+            for row in contexto.filas
+        ]
         
         # Determinar si es primer registro del día
         es_primer_registro = len(registros_del_dia) == 0
@@ -1782,256 +3949,64 @@ def verificar_registros_del_dia_en_sheets(cedula, fecha_actual):
         
     except Exception as e:
         print(f"⚠️ [ERROR VERIFICACIÓN SHEETS] {str(e)}")
-        return [], True, None  # En caso de error, asumir primer registro
-
-def buscar_colaborador_en_datos_colab(codigo_barras):
-    """Buscar colaborador en la hoja 'Datos_colab' de Google Sheets.
-    Si no hay internet, usa el caché local."""
-    
-    # ============================================
-    # VERIFICAR CONEXIÓN - SI NO HAY, USAR CACHÉ
-    # ============================================
-    tiene_conexion, _ = verificar_conexion_internet(timeout=2)
-    
-    if not tiene_conexion:
-        # Usar caché local
-        nombre, mensaje = buscar_colaborador_en_cache(codigo_barras)
-        if nombre:
-            return nombre, mensaje
-        else:
-            return None, "📴 Sin internet. Colaborador no encontrado en caché local. Actualiza el caché cuando tengas conexión."
-    
-    # ============================================
-    # HAY CONEXIÓN - BUSCAR EN GOOGLE SHEETS
-    # ============================================
-    spreadsheet, mensaje = conectar_google_sheets()
-    
-    if spreadsheet is None:
-        # Falló la conexión a Sheets, intentar caché
-        nombre, mensaje_cache = buscar_colaborador_en_cache(codigo_barras)
-        if nombre:
-            return nombre, mensaje_cache
-        return None, mensaje
-    
-    try:
-        config = load_config()
-        worksheet_name = config.get('google_sheets', {}).get('worksheet_empleados', 'Datos_colab')
-        worksheet = spreadsheet.worksheet(worksheet_name)
-        
-        # Obtener datos usando los encabezados esperados para evitar duplicados
-        try:
-            records = worksheet.get_all_records(expected_headers=['cedula', 'nombre'])
-        except:
-            # Si falla con encabezados específicos, intentar con todos los datos
-            try:
-                records = worksheet.get_all_records()
-            except:
-                # Si todo falla, obtener datos raw y procesarlos manualmente
-                all_values = worksheet.get_all_values()
-                if len(all_values) < 2:
-                    return None, "La hoja Datos_colab está vacía"
-                
-                headers = all_values[0]
-                rows = all_values[1:]
-                
-                records = []
-                for row in rows:
-                    record = {}
-                    for i, header in enumerate(headers):
-                        if i < len(row) and header.strip():  # Solo usar encabezados no vacíos
-                            record[header.strip()] = row[i] if i < len(row) else ''
-                    if record:  # Solo agregar registros no vacíos
-                        records.append(record)
-        
-        for record in records:
-            # Buscar en la columna 'cedula' (código de barras)
-            if 'cedula' in record and str(record['cedula']) == str(codigo_barras):
-                cedula_encontrada = record['cedula']
-                nombre_encontrado = record.get('nombre', '')
-                
-                if nombre_encontrado:
-                    return nombre_encontrado, "Colaborador encontrado en Google Sheets"
-        
-        return None, "Colaborador no encontrado en Google Sheets"
-        
-    except Exception as e:
-        return None, f"Error al buscar en Google Sheets: {str(e)}"
-
-def buscar_servicio_por_codigo(codigo_barras):
-    """Buscar servicio por código de barras en la hoja 'Servicio'.
-    Si no hay internet, usa el caché local."""
-    
-    # ============================================
-    # VERIFICAR CONEXIÓN - SI NO HAY, USAR CACHÉ
-    # ============================================
-    tiene_conexion, _ = verificar_conexion_internet(timeout=2)
-    
-    if not tiene_conexion:
-        # Usar caché local
-        codigo, actividad, mensaje = buscar_servicio_en_cache(codigo_barras)
-        if codigo and actividad:
-            return codigo, actividad, mensaje
-        else:
-            return None, None, "📴 Sin internet. Servicio no encontrado en caché local."
-    
-    # ============================================
-    # HAY CONEXIÓN - BUSCAR EN GOOGLE SHEETS
-    # ============================================
-    spreadsheet, mensaje = conectar_google_sheets()
-    
-    if spreadsheet is None:
-        # Falló la conexión, intentar caché
-        codigo, actividad, mensaje_cache = buscar_servicio_en_cache(codigo_barras)
-        if codigo and actividad:
-            return codigo, actividad, mensaje_cache
-        return None, None, f"Error de conexión: {mensaje}"
-    
-    try:
-        worksheet = spreadsheet.worksheet('Servicio')
-        
-        # Obtener datos de manera más robusta para evitar encabezados duplicados
-        try:
-            # Intentar con encabezados esperados específicos
-            records = worksheet.get_all_records(expected_headers=['codigo', 'actividad'])
-        except:
-            try:
-                # Si falla, obtener datos raw y procesarlos manualmente
-                all_values = worksheet.get_all_values()
-                if len(all_values) < 2:
-                    return None, None, "La hoja 'Servicio' está vacía o solo tiene encabezados"
-                
-                headers = all_values[0]
-                rows = all_values[1:]
-                
-                records = []
-                for row in rows:
-                    record = {}
-                    for i, header in enumerate(headers):
-                        if i < len(row) and header.strip():  # Solo usar encabezados no vacíos
-                            record[header.strip()] = row[i] if i < len(row) else ''
-                    if record:  # Solo agregar registros no vacíos
-                        records.append(record)
-            except Exception as e:
-                return None, None, f"Error al leer datos de la hoja 'Servicio': {str(e)}"
-        
-        # Verificar que hay datos
-        if not records:
-            return None, None, "La hoja 'Servicio' está vacía"
-        
-        # Obtener las claves y limpiarlas de espacios
-        encabezados_originales = list(records[0].keys())
-        encabezados_limpios = [str(k).strip().lower() for k in encabezados_originales]
-        
-        # Buscar los encabezados de forma más flexible
-        columna_codigo = None
-        columna_actividad = None
-        
-        for i, encabezado in enumerate(encabezados_limpios):
-            if encabezado == 'codigo':
-                columna_codigo = encabezados_originales[i]
-            elif encabezado == 'actividad':
-                columna_actividad = encabezados_originales[i]
-        
-        # Verificar que encontramos ambas columnas
-        if columna_codigo is None:
-            return None, None, f"Columna 'codigo' no encontrada. Encabezados disponibles: {encabezados_originales}"
-        
-        if columna_actividad is None:
-            return None, None, f"Columna 'actividad' no encontrada. Encabezados disponibles: {encabezados_originales}"
-        
-        # Buscar el código
-        for record in records:
-            if columna_codigo in record:
-                codigo_en_hoja = str(record[columna_codigo]).strip()
-                codigo_buscado = str(codigo_barras).strip()
-                
-                if codigo_en_hoja == codigo_buscado:
-                    codigo_encontrado = record[columna_codigo]
-                    actividad_encontrada = str(record.get(columna_actividad, '')).strip()
-                    
-                    if actividad_encontrada:
-                        return codigo_encontrado, actividad_encontrada, "Servicio encontrado"
-                    else:
-                        return None, None, f"Código encontrado pero actividad vacía para código '{codigo_barras}'"
-        
-        return None, None, f"Código '{codigo_barras}' no encontrado en {len(records)} registros"
-        
-    except Exception as e:
-        return None, None, f"Error al buscar servicio: {str(e)}"
+        return [], True, None  # En caso de error, asumir primer registro
+
+def buscar_colaborador_en_datos_colab(codigo_barras):
+    """Buscar colaborador en la hoja 'Datos_colab' de Google Sheets.
+    Responde desde los datos maestros en memoria (ver DatosMaestros);
+    sin conexión o si Sheets falla, usa el caché local."""
+    colab, en_linea, actualizando = obtener_datos_maestros().buscar('colaboradores', codigo_barras)
+    
+    if colab:
+        if en_linea:
+            return colab.get('nombre', ''), "Colaborador encontrado en Google Sheets"
+        return colab.get('nombre', ''), "Colaborador encontrado (modo offline)"
+    
+    if actualizando:
+        return None, "Colaborador no encontrado. Actualizando datos de Google Sheets, intenta de nuevo en unos segundos"
+    if en_linea:
+        return None, "Colaborador no encontrado en Google Sheets"
+    return None, "📴 Sin internet. Colaborador no encontrado en caché local. Actualiza el caché cuando tengas conexión."
+
+def buscar_servicio_por_codigo(codigo_barras):
+    """Buscar servicio por código de barras en la hoja 'Servicio'.
+    Responde desde los datos maestros en memoria (ver DatosMaestros);
+    sin conexión o si Sheets falla, usa el caché local."""
+    servicio, en_linea, actualizando = obtener_datos_maestros().buscar('servicios', codigo_barras)
+    
+    if servicio:
+        mensaje = "Servicio encontrado" if en_linea else "Servicio encontrado (modo offline)"
+        return str(servicio.get('codigo', '')).strip(), servicio.get('actividad', ''), mensaje
+    
+    if actualizando:
+        return None, None, f"Código '{codigo_barras}' no encontrado. Actualizando la hoja 'Servicio', intenta de nuevo en unos segundos"
+    if en_linea:
+        return None, None, f"Código '{codigo_barras}' no encontrado en la hoja 'Servicio'"
+    return None, None, "📴 Sin internet. Servicio no encontrado en caché local."
 
 def buscar_op_por_codigo(codigo_barras):
     """Buscar OP por código de barras en la hoja 'OPS' y traer toda la información.
-    Si no hay internet, usa el caché local."""
-    
-    # ============================================
-    # VERIFICAR CONEXIÓN - SI NO HAY, USAR CACHÉ
-    # ============================================
-    tiene_conexion, _ = verificar_conexion_internet(timeout=2)
-    
-    if not tiene_conexion:
-        # Usar caché local
-        op_info, mensaje = buscar_op_en_cache(codigo_barras)
-        if op_info:
-            return op_info, mensaje
-        else:
-            return None, "📴 Sin internet. OP no encontrada en caché local."
-    
-    # ============================================
-    # HAY CONEXIÓN - BUSCAR EN GOOGLE SHEETS
-    # ============================================
-    spreadsheet, mensaje = conectar_google_sheets()
-    
-    if spreadsheet is None:
-        # Falló la conexión, intentar caché
-        op_info, mensaje_cache = buscar_op_en_cache(codigo_barras)
-        if op_info:
-            return op_info, mensaje_cache
-        return None, f"Error de conexión: {mensaje}"
+    Responde desde los datos maestros en memoria (ver DatosMaestros);
+    sin conexión o si Sheets falla, usa el caché local."""
+    op, en_linea, actualizando = obtener_datos_maestros().buscar('ops', codigo_barras)
+    
+    if op:
+        op_info = {
+            'orden': op.get('orden', ''),
+            'referencia': op.get('referencia', ''),
+            'cantidades': op.get('cantidades', ''),
+            'cliente': op.get('cliente', ''),
+            'item': op.get('item', '')
+        }
+        if en_linea:
+            return op_info, "OP encontrada con información completa"
+        return op_info, "OP encontrada (modo offline)"
     
-    try:
-        worksheet = spreadsheet.worksheet('OPS')
-        
-        # Obtener datos de manera robusta para evitar encabezados duplicados
-        try:
-            records = worksheet.get_all_records(expected_headers=['orden', 'referencia', 'Cantidades', 'cliente', 'item'])
-        except:
-            try:
-                all_values = worksheet.get_all_values()
-                if len(all_values) < 2:
-                    return None, "La hoja 'OPS' está vacía"
-                
-                headers = all_values[0]
-                rows = all_values[1:]
-                
-                records = []
-                for row in rows:
-                    record = {}
-                    for i, header in enumerate(headers):
-                        if i < len(row) and header.strip():
-                            record[header.strip()] = row[i] if i < len(row) else ''
-                    if record:
-                        records.append(record)
-            except Exception as e:
-                return None, f"Error al leer hoja 'OPS': {str(e)}"
-        
-        for record in records:
-            # Buscar en la columna 'orden' (código de barras)
-            if 'orden' in record and str(record['orden']) == str(codigo_barras):
-                # Si se encontró la OP, extraer toda la información
-                op_info = {
-                    'orden': str(record.get('orden', '')),
-                    'referencia': str(record.get('referencia', '')),
-                    'cantidades': str(record.get('Cantidades', '')),
-                    'cliente': str(record.get('cliente', '')),
-                    'item': str(record.get('item', ''))
-                }
-                
-                return op_info, "OP encontrada con información completa"
-        
+    if actualizando:
+        return None, "OP no encontrada. Actualizando la hoja OPS, intenta de nuevo en unos segundos"
+    if en_linea:
         return None, "OP no encontrada en la hoja OPS"
-        
-    except Exception as e:
-        return None, f"Error al buscar OP: {str(e)}"
+    return None, "📴 Sin internet. OP no encontrada en caché local."
 
 def verificar_estructura_servicio():
     """Función de debug para verificar la estructura de la hoja Servicio"""
@@ -2041,13 +4016,12 @@ def verificar_estructura_servicio():
         return f"Error de conexión: {mensaje}"
     
     try:
-        worksheet = spreadsheet.worksheet('Servicio')
+        worksheet = obtener_worksheet(spreadsheet, 'Servicio')
         
-        # Obtener encabezados (primera fila)
-        encabezados = worksheet.row_values(1)
-        
-        # Obtener algunos registros de ejemplo
+        # Una sola descarga: encabezados (primera fila) y datos
         all_values = worksheet.get_all_values()
+        encabezados = all_values[0] if all_values else []
+        esquema = obtener_esquema('Servicio', encabezados)
         
         info_debug = []
         info_debug.append(f"📊 Total de filas: {len(all_values)}")
@@ -2061,18 +4035,12 @@ def verificar_estructura_servicio():
             info_debug.append(f"📄 Primera fila de datos: {all_values[1]}")
             if len(all_values) > 2:
                 info_debug.append(f"📄 Segunda fila de datos: {all_values[2]}")
+            info_debug.append(f"📝 Primer registro: {esquema.registro(all_values[1])}")
         
-        # Obtener records para ver la estructura
-        records = worksheet.get_all_records()
-        if records:
-            info_debug.append(f"📝 Primer registro: {records[0]}")
-            info_debug.append(f"🔑 Claves: {list(records[0].keys())}")
-            
-            # Verificar específicamente las claves que buscamos
-            claves_disponibles = list(records[0].keys())
-            for clave in claves_disponibles:
-                clave_limpia = str(clave).strip().lower()
-                info_debug.append(f"  '{clave}' → '{clave_limpia}'")
+        # Columnas que resuelve el esquema para cada campo
+        for campo, idx in esquema.indices.items():
+            encabezado = encabezados[idx] if idx is not None else None
+            info_debug.append(f"🔑 '{campo}' → columna {idx} ({encabezado!r})")
         
         return "\n".join(info_debug)
         
@@ -2087,55 +4055,24 @@ def obtener_servicios():
         return [], mensaje
     
     try:
-        worksheet = spreadsheet.worksheet('Servicio')
+        worksheet = obtener_worksheet(spreadsheet, 'Servicio')
         
-        # Obtener datos de manera robusta para evitar encabezados duplicados
+        # Una sola descarga; las columnas se leen por posición según el esquema
         try:
-            records = worksheet.get_all_records(expected_headers=['codigo', 'actividad'])
-        except:
-            try:
-                all_values = worksheet.get_all_values()
-                if len(all_values) < 2:
-                    return [], "La hoja 'Servicio' está vacía"
-                
-                headers = all_values[0]
-                rows = all_values[1:]
-                
-                records = []
-                for row in rows:
-                    record = {}
-                    for i, header in enumerate(headers):
-                        if i < len(row) and header.strip():
-                            record[header.strip()] = row[i] if i < len(row) else ''
-                    if record:
-                        records.append(record)
-            except Exception as e:
-                return [], f"Error al leer hoja 'Servicio': {str(e)}"
+            esquema, filas = leer_hoja(worksheet, 'Servicio')
+        except Exception as e:
+            return [], f"Error al leer hoja 'Servicio': {str(e)}"
         
-        if not records:
+        if not filas:
             return [], "La hoja 'Servicio' está vacía"
         
-        # Obtener las claves y limpiarlas de espacios
-        encabezados_originales = list(records[0].keys())
-        encabezados_limpios = [str(k).strip().lower() for k in encabezados_originales]
-        
-        # Buscar los encabezados de forma más flexible
-        columna_codigo = None
-        columna_actividad = None
-        
-        for i, encabezado in enumerate(encabezados_limpios):
-            if encabezado == 'codigo':
-                columna_codigo = encabezados_originales[i]
-            elif encabezado == 'actividad':
-                columna_actividad = encabezados_originales[i]
-        
-        if not columna_codigo or not columna_actividad:
-            return [], f"Encabezados no encontrados. Disponibles: {encabezados_originales}"
+        if not esquema.tiene('codigo', 'actividad'):
+            return [], f"Encabezados no encontrados. Disponibles: {esquema.headers}"
         
+        leer = esquema.accesor('codigo', 'actividad')
         servicios = []
-        for record in records:
-            codigo = str(record.get(columna_codigo, '')).strip()
-            actividad = str(record.get(columna_actividad, '')).strip()
+        for fila in filas:
+            codigo, actividad = leer(fila)
             
             if codigo and actividad:
                 servicios.append({
@@ -2174,7 +4111,7 @@ def obtener_ultimo_registro_del_dia(empleado, fecha_actual, df):
     """Obtiene el último registro del empleado en el día actual"""
     registros_del_dia = df[
         (df['empleado'] == empleado) & 
-        (df['fecha'] == fecha_actual)
+        (df['fecha'] == pd.Timestamp(fecha_actual))
     ].sort_values('hora_entrada', ascending=False)
     
     if not registros_del_dia.empty:
@@ -2215,7 +4152,7 @@ def obtener_ultimo_registro_por_cedula(cedula, fecha_actual, df):
         if not registros_por_cedula.empty:
             # Filtrar por fecha
             registros_del_dia = registros_por_cedula[
-                registros_por_cedula['fecha'].astype(str) == str(fecha_buscar)
+                registros_por_cedula['fecha'] == pd.Timestamp(fecha_buscar)
             ]
             print(f"DEBUG: Registros del día {fecha_buscar}: {len(registros_del_dia)}")
             
@@ -2233,8 +4170,8 @@ def obtener_ultimo_registro_por_cedula(cedula, fecha_actual, df):
 
 def registrar_actividad_continua(empleado, codigo_barras, servicio_info=None):
     """Registrar actividad continua desde las 7:00 AM o último registro"""
-    df = load_data()
     fecha_actual = obtener_fecha_colombia()
+    df = load_data(fecha_inicio=fecha_actual, fecha_fin=fecha_actual)
     hora_actual = obtener_hora_colombia_time()
     
     # Obtener el último registro del día
@@ -2242,18 +4179,18 @@ def registrar_actividad_continua(empleado, codigo_barras, servicio_info=None):
     
     if ultimo_registro is not None:
         # Ya hay registros del día, calcular desde el último registro
-        if pd.isna(ultimo_registro['hora_salida']) or ultimo_registro['hora_salida'] == '':
+        if pd.isna(ultimo_registro['hora_salida']):
             # El último registro no tiene salida, cerrarlo primero
             idx = ultimo_registro.name
-            df.loc[idx, 'hora_salida'] = hora_actual.strftime('%H:%M:%S') if hasattr(hora_actual, 'strftime') else str(hora_actual)
             
             # Calcular horas de la actividad anterior
-            hora_entrada_anterior = ultimo_registro['hora_entrada']
-            if isinstance(hora_entrada_anterior, str):
-                hora_entrada_anterior = datetime.strptime(hora_entrada_anterior, '%H:%M:%S').time()
+            hora_entrada_anterior = hora_de_registro(ultimo_registro['hora_entrada'])
             
             horas_actividad_anterior = calcular_horas(hora_entrada_anterior, hora_actual)
-            df.loc[idx, 'horas_trabajadas'] = round(horas_actividad_anterior, 2)
+            actualizar_registro_local(idx, {
+                'hora_salida': hora_actual.strftime('%H:%M:%S') if hasattr(hora_actual, 'strftime') else str(hora_actual),
+                'horas_trabajadas': round(horas_actividad_anterior, 2)
+            })
         
         # Hora de inicio para el nuevo registro es la misma hora actual
         hora_inicio_nueva_actividad = hora_actual
@@ -2282,8 +4219,7 @@ def registrar_actividad_continua(empleado, codigo_barras, servicio_info=None):
         'servicio': servicio_info if servicio_info else ''
     }
     
-    df = pd.concat([df, pd.DataFrame([nuevo_registro])], ignore_index=True)
-    save_data(df)
+    insertar_registro_local(nuevo_registro)
     
     # Calcular horas totales del día hasta ahora
     horas_totales_dia = calcular_horas_desde_inicio_dia(hora_actual, fecha_actual)
@@ -2292,10 +4228,10 @@ def registrar_actividad_continua(empleado, codigo_barras, servicio_info=None):
 
 def obtener_resumen_actividades_dia(empleado, fecha_actual):
     """Obtiene un resumen de todas las actividades del empleado en el día"""
-    df = load_data()
+    df = load_data(fecha_inicio=fecha_actual, fecha_fin=fecha_actual)
     registros_dia = df[
         (df['empleado'] == empleado) & 
-        (df['fecha'] == fecha_actual)
+        (df['fecha'] == pd.Timestamp(fecha_actual))
     ].sort_values('hora_entrada')
     
     if registros_dia.empty:
@@ -2313,8 +4249,8 @@ def obtener_resumen_actividades_dia(empleado, fecha_actual):
     for _, registro in registros_dia.iterrows():
         actividad = {
             'servicio': registro.get('servicio', 'Sin especificar'),
-            'hora_inicio': registro['hora_entrada'],
-            'hora_fin': registro.get('hora_salida', 'En curso'),
+            'hora_inicio': hora_de_registro(registro['hora_entrada']),
+            'hora_fin': hora_de_registro(registro.get('hora_salida')) or 'En curso',
             'horas': registro.get('horas_trabajadas', 0) if pd.notna(registro.get('horas_trabajadas')) else 0
         }
         
@@ -2325,7 +4261,7 @@ def obtener_resumen_actividades_dia(empleado, fecha_actual):
     
     # Verificar si hay actividad en curso
     ultima_actividad = registros_dia.iloc[-1]
-    estado_actual = 'terminada' if pd.notna(ultima_actividad['hora_salida']) and ultima_actividad['hora_salida'] != '' else 'en_curso'
+    estado_actual = 'terminada' if pd.notna(ultima_actividad['hora_salida']) else 'en_curso'
     
     return {
         'total_actividades': len(actividades),
@@ -2346,50 +4282,27 @@ def obtener_lista_ops():
         if spreadsheet is None:
             return [], f"Error de conexión: {mensaje}"
         
-        worksheet = spreadsheet.worksheet('OPS')
+        worksheet = obtener_worksheet(spreadsheet, 'OPS')
         
-        # Obtener todos los registros - leer TODAS las columnas
+        # Una sola descarga; las columnas se leen por posición según el esquema
         try:
-            all_values = worksheet.get_all_values()
-            if len(all_values) < 2:
+            esquema, filas = leer_hoja(worksheet, 'OPS')
+            if not filas:
                 return [], "La hoja 'OPS' está vacía"
-            
-            headers = all_values[0]
-            rows = all_values[1:]
-            
-            records = []
-            for row in rows:
-                record = {}
-                for i, header in enumerate(headers):
-                    if header.strip():
-                        record[header.strip()] = row[i] if i < len(row) else ''
-                if record:
-                    records.append(record)
         except Exception as e:
             return [], f"Error al leer hoja 'OPS': {str(e)}"
         
+        leer = esquema.accesor('orden', 'cliente', 'referencia', 'item', 'cantidades', 'estado', 'tiemposprome')
+        
         # Crear lista de OPs con información relevante
         lista_ops = []
-        for record in records:
-            orden = str(record.get('orden', '')).strip()
+        for fila in filas:
+            orden, cliente, referencia, item, cantidades, estado, tiemposprome = leer(fila)
             if orden:  # Solo agregar si tiene orden
-                cliente = str(record.get('cliente', '')).strip()
-                referencia = str(record.get('referencia', '')).strip()
-                item = str(record.get('item', '')).strip()
-                cantidades = str(record.get('Cantidades', '')).strip()
-                estado = str(record.get('estado', '')).strip()  # Estado de planos
-                
                 # Filtrar OPs con estado "Terminado" - no mostrar en la lista
                 if estado.lower() == 'terminado':
                     continue  # Saltar esta OP, no agregarla a la lista
                 
-                # Buscar tiemposprome (insensible a mayúsculas/minúsculas)
-                tiemposprome = ''
-                for key in record.keys():
-                    if key.lower() == 'tiemposprome':
-                        tiemposprome = str(record.get(key, '')).strip()
-                        break
-                
                 # Parsear tiemposprome (formato: "10,35,32,54")
                 tiempos_estimados = {'corte': 0, 'mecanizado': 0, 'doblado': 0, 'ensamble': 0}
                 if tiemposprome:
@@ -2427,71 +4340,17 @@ def obtener_horas_trabajadas_por_actividad(orden):
     """
     Obtener las horas trabajadas por actividad (CORTE, MECANIZADO, DOBLADO, ENSAMBLE)
     desde el sheet Registros para una OP específica.
+    Las horas salen de la tabla por OP y etapa que mantiene el espejo de Registros.
     """
     try:
-        spreadsheet, mensaje = conectar_google_sheets()
-        if spreadsheet is None:
-            return {'corte': 0, 'mecanizado': 0, 'doblado': 0, 'ensamble': 0}
-        
-        config = load_config()
-        worksheet_name = config.get('google_sheets', {}).get('worksheet_registros', 'Registros')
-        worksheet = spreadsheet.worksheet(worksheet_name)
-        
-        # Obtener todos los registros
-        all_values = worksheet.get_all_values()
-        if len(all_values) < 2:
-            return {'corte': 0, 'mecanizado': 0, 'doblado': 0, 'ensamble': 0}
-        
-        headers = all_values[0]
-        rows = all_values[1:]
-        
-        # Buscar índices de las columnas necesarias
-        idx_orden = None
-        idx_actividad = None
-        idx_tiempo = None
-        
-        for i, header in enumerate(headers):
-            header_lower = header.lower().strip()
-            if header_lower == 'orden':
-                idx_orden = i
-            elif header_lower == 'actividad':
-                idx_actividad = i
-            elif header_lower == 'tiempo [hr]' or header_lower == 'tiempo':
-                idx_tiempo = i
-        
-        if idx_orden is None or idx_actividad is None or idx_tiempo is None:
-            return {'corte': 0, 'mecanizado': 0, 'doblado': 0, 'ensamble': 0}
-        
-        # Sumar horas por actividad para la OP especificada
-        horas_trabajadas = {'corte': 0, 'mecanizado': 0, 'doblado': 0, 'ensamble': 0}
-        
-        for row in rows:
-            if len(row) > max(idx_orden, idx_actividad, idx_tiempo):
-                orden_registro = str(row[idx_orden]).strip()
-                
-                # Verificar si es la OP que buscamos
-                if orden_registro == str(orden).strip():
-                    actividad = str(row[idx_actividad]).strip().upper()
-                    try:
-                        tiempo = float(str(row[idx_tiempo]).replace(',', '.')) if row[idx_tiempo] else 0
-                    except:
-                        tiempo = 0
-                    
-                    # Clasificar por actividad
-                    if 'CORTE' in actividad:
-                        horas_trabajadas['corte'] += tiempo
-                    elif 'MECANIZADO' in actividad:
-                        horas_trabajadas['mecanizado'] += tiempo
-                    elif 'DOBLADO' in actividad:
-                        horas_trabajadas['doblado'] += tiempo
-                    elif 'ENSAMBLE' in actividad:
-                        horas_trabajadas['ensamble'] += tiempo
-        
-        return horas_trabajadas
+        espejo, mensaje = sincronizar_espejo_registros()
+        if espejo is None:
+            return dict.fromkeys(ETAPAS_PROYECTO, 0)
+        return espejo.horas_de_op(orden)
         
     except Exception as e:
         print(f"Error obteniendo horas trabajadas: {e}")
-        return {'corte': 0, 'mecanizado': 0, 'doblado': 0, 'ensamble': 0}
+        return dict.fromkeys(ETAPAS_PROYECTO, 0)
 
 def calcular_progreso(horas_trabajadas, tiempo_estimado):
     """Calcular el porcentaje de progreso. Puede superar 100%."""
@@ -2529,39 +4388,76 @@ def obtener_color_estado_barra(progreso):
             'color_texto': '#721c24'
         }
 
+def obtener_progreso_todas_ops():
+    """
+    Progreso por etapa de todas las OPs no terminadas.
+    Una sola sincronización del espejo de Registros; las horas salen de su tabla por OP y etapa.
+    Retorna: (lista, mensaje) - cada elemento trae 'etapas' con horas, estimado, progreso y estado,
+    más 'exceso_horas' (suma de horas por encima del estimado) y 'progreso_maximo'
+    """
+    lista_ops, mensaje = obtener_lista_ops()
+    if not lista_ops:
+        return [], mensaje
+    
+    try:
+        espejo, mensaje_espejo = sincronizar_espejo_registros()
+    except Exception as e:
+        print(f"Error obteniendo horas trabajadas: {e}")
+        espejo, mensaje_espejo = None, str(e)
+    if espejo is None:
+        return [], f"No se pudo leer Registros: {mensaje_espejo}"
+    
+    progreso_ops = []
+    for op in lista_ops:
+        horas = espejo.horas_de_op(op['orden'])
+        etapas = {}
+        exceso_horas = 0
+        progreso_maximo = 0
+        for etapa in ETAPAS_PROYECTO:
+            estimado = op['tiempos_estimados'].get(etapa, 0)
+            progreso = calcular_progreso(horas[etapa], estimado)
+            etapas[etapa] = {
+                'horas': horas[etapa],
+                'estimado': estimado,
+                'progreso': progreso,
+                **obtener_color_estado_barra(progreso)
+            }
+            if estimado > 0:
+                exceso_horas += max(horas[etapa] - estimado, 0)
+            progreso_maximo = max(progreso_maximo, progreso)
+        
+        progreso_ops.append({
+            'orden': op['orden'],
+            'cliente': op['cliente'],
+            'referencia': op['referencia'],
+            'etapas': etapas,
+            'horas_totales': sum(horas.values()),
+            'estimado_total': sum(op['tiempos_estimados'].get(etapa, 0) for etapa in ETAPAS_PROYECTO),
+            'exceso_horas': exceso_horas,
+            'progreso_maximo': progreso_maximo
+        })
+    
+    return progreso_ops, "OK"
+
 def obtener_nombres_empleados_registros():
     """Obtener lista de nombres únicos de empleados del sheet Registros"""
     try:
-        spreadsheet, mensaje = conectar_google_sheets()
-        if spreadsheet is None:
-            return []
-        
-        worksheet_registros = spreadsheet.worksheet('Registros')
-        registros_values = worksheet_registros.get_all_values()
+        headers_reg, rows_reg = leer_registros_por_fecha()
         
-        if len(registros_values) < 2:
+        if not rows_reg:
             return []
         
-        headers_reg = registros_values[0]
-        rows_reg = registros_values[1:]
-        
-        # Buscar índice de la columna Nombre
-        idx_nombre = None
-        for i, header in enumerate(headers_reg):
-            if header.lower().strip() == 'nombre':
-                idx_nombre = i
-                break
-        
-        if idx_nombre is None:
+        esquema = obtener_esquema('Registros', headers_reg)
+        if not esquema.tiene('nombre'):
             return []
+        leer = esquema.accesor('nombre')
         
         # Obtener nombres únicos
         nombres = set()
         for row in rows_reg:
-            if len(row) > idx_nombre:
-                nombre = str(row[idx_nombre]).strip()
-                if nombre:
-                    nombres.add(nombre)
+            nombre, = leer(row)
+            if nombre:
+                nombres.add(nombre)
         
         return sorted(list(nombres))
     except:
@@ -2571,55 +4467,32 @@ def obtener_horas_por_dia_empleado(nombre_empleado, fecha_inicio=None, fecha_fin
     """Obtener las horas trabajadas por día para un empleado específico"""
     HORAS_ESPERADAS = 8.833
     try:
-        spreadsheet, mensaje = conectar_google_sheets()
-        if spreadsheet is None:
-            return [], HORAS_ESPERADAS
-        
-        worksheet_registros = spreadsheet.worksheet('Registros')
-        registros_values = worksheet_registros.get_all_values()
+        # Solo las filas del rango de fechas (o todas si no hay rango)
+        headers_reg, rows_reg = leer_registros_por_fecha(fecha_inicio, fecha_fin)
         
-        if len(registros_values) < 2:
+        if not rows_reg:
             return [], HORAS_ESPERADAS
         
-        headers_reg = registros_values[0]
-        rows_reg = registros_values[1:]
-        
-        # Buscar índices
-        idx_nombre = None
-        idx_fecha = None
-        idx_tiempo = None
-        for i, header in enumerate(headers_reg):
-            header_lower = header.lower().strip()
-            if header_lower == 'nombre':
-                idx_nombre = i
-            if header_lower == 'fecha':
-                idx_fecha = i
-            if header_lower == 'tiempo [hr]' or header_lower == 'tiempo':
-                idx_tiempo = i
-        
-        if idx_nombre is None or idx_fecha is None or idx_tiempo is None:
+        esquema = obtener_esquema('Registros', headers_reg)
+        if not esquema.tiene('nombre', 'fecha', 'tiempo'):
             return [], HORAS_ESPERADAS
+        leer = esquema.accesor('nombre', 'fecha', 'tiempo')
+        ancho_minimo = max(esquema.indices['nombre'], esquema.indices['fecha'], esquema.indices['tiempo'])
         
         # Agrupar horas por día
         horas_por_dia = {}
         for row in rows_reg:
-            if len(row) > max(idx_nombre, idx_fecha, idx_tiempo):
-                nombre_reg = str(row[idx_nombre]).strip()
+            if len(row) > ancho_minimo:
+                nombre_reg, fecha_str, tiempo_str = leer(row)
                 if nombre_reg.lower() != nombre_empleado.lower():
                     continue
                 
-                fecha_str = str(row[idx_fecha]).strip()
-                tiempo_str = str(row[idx_tiempo]).strip().replace(',', '.')
+                tiempo_str = tiempo_str.replace(',', '.')
                 
                 # Parsear fecha
-                fecha_registro = None
-                try:
-                    fecha_registro = datetime.strptime(fecha_str, '%d/%m/%Y').date()
-                except:
-                    try:
-                        fecha_registro = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-                    except:
-                        continue
+                fecha_registro = parsear_fecha_registro(fecha_str)
+                if fecha_registro is None:
+                    continue
                 
                 # Filtrar por rango de fechas
                 if fecha_inicio and fecha_fin:
@@ -2661,26 +4534,23 @@ def obtener_actividades_servicio(fecha_inicio=None, fecha_fin=None, nombre_emple
         if spreadsheet is None:
             return [], f"Error de conexión: {mensaje}"
         
-        # ===== OBTENER ACTIVIDADES DE SERVICIO =====
-        worksheet = spreadsheet.worksheet('Servicio')
+        # ===== DESCARGAR SERVICIO Y REGISTROS A LA VEZ =====
+        descargas = ejecutar_en_paralelo({
+            'servicio': lambda: leer_hoja_servicio(spreadsheet),
+            # Solo las filas del rango de fechas (o todas si no hay rango)
+            'registros': lambda: leer_registros_por_fecha(fecha_inicio, fecha_fin)
+        })
         
-        # Obtener todos los registros
-        all_values = worksheet.get_all_values()
-        if len(all_values) < 2:
+        # ===== OBTENER ACTIVIDADES DE SERVICIO =====
+        descarga_servicio, error_servicio = descargas['servicio']
+        if error_servicio is not None:
+            raise error_servicio
+        esquema_servicio, rows, version_servicio = descarga_servicio
+        if not rows:
             return [], "La hoja 'Servicio' está vacía"
         
-        headers = all_values[0]
-        rows = all_values[1:]
-        
-        # Buscar índice de la columna 'actividad' (insensible a mayúsculas)
-        idx_actividad = None
-        idx_numero = None
-        for i, header in enumerate(headers):
-            header_lower = header.lower().strip()
-            if header_lower == 'actividad' or header_lower == 'nomservicio':
-                idx_actividad = i
-            if header_lower == 'numero' or header_lower == 'código' or header_lower == 'codigo':
-                idx_numero = i
+        idx_actividad = esquema_servicio.indices['actividad']
+        idx_numero = esquema_servicio.indices['codigo']
         
         if idx_actividad is None:
             return [], "No se encontró la columna 'actividad' en el sheet Servicio"
@@ -2689,41 +4559,32 @@ def obtener_actividades_servicio(fecha_inicio=None, fecha_fin=None, nombre_emple
         # Obtener registros para sumar horas por actividad
         horas_por_actividad = {}
         try:
-            worksheet_registros = spreadsheet.worksheet('Registros')
-            registros_values = worksheet_registros.get_all_values()
+            descarga_registros, error_registros = descargas['registros']
+            if error_registros is not None:
+                raise error_registros
+            headers_reg, rows_reg = descarga_registros
             
-            if len(registros_values) >= 2:
-                headers_reg = registros_values[0]
-                rows_reg = registros_values[1:]
+            if rows_reg:
                 
-                # Buscar índices de Actividad, Tiempo [Hr], Fecha y Nombre
-                idx_actividad_reg = None
-                idx_tiempo = None
-                idx_fecha = None
-                idx_nombre = None
-                for i, header in enumerate(headers_reg):
-                    header_lower = header.lower().strip()
-                    if header_lower == 'actividad':
-                        idx_actividad_reg = i
-                    if header_lower == 'tiempo [hr]' or header_lower == 'tiempo':
-                        idx_tiempo = i
-                    if header_lower == 'fecha':
-                        idx_fecha = i
-                    if header_lower == 'nombre':
-                        idx_nombre = i
+                # Columnas de Actividad, Tiempo [Hr], Fecha y Nombre
+                esquema_reg = obtener_esquema('Registros', headers_reg)
                 
-                if idx_actividad_reg is not None and idx_tiempo is not None:
+                if esquema_reg.tiene('actividad', 'tiempo'):
+                    leer = esquema_reg.accesor('actividad', 'tiempo', 'fecha', 'nombre')
+                    ancho_minimo = max(esquema_reg.indices['actividad'], esquema_reg.indices['tiempo'])
+                    filtrar_nombre = nombre_empleado is not None and nombre_empleado != "" and esquema_reg.tiene('nombre')
+                    filtrar_fecha = fecha_inicio is not None and fecha_fin is not None and esquema_reg.tiene('fecha')
                     for row in rows_reg:
-                        if len(row) > max(idx_actividad_reg, idx_tiempo):
+                        if len(row) > ancho_minimo:
+                            actividad_reg, tiempo_str, fecha_str, nombre_reg = leer(row)
+                            
                             # Filtrar por nombre si se especificó
-                            if nombre_empleado is not None and nombre_empleado != "" and idx_nombre is not None:
-                                nombre_reg = str(row[idx_nombre]).strip() if len(row) > idx_nombre else ''
+                            if filtrar_nombre:
                                 if nombre_reg.lower() != nombre_empleado.lower():
                                     continue  # Saltar registros de otros empleados
                             
                             # Filtrar por fecha si se especificó rango
-                            if fecha_inicio is not None and fecha_fin is not None and idx_fecha is not None:
-                                fecha_str = str(row[idx_fecha]).strip() if len(row) > idx_fecha else ''
+                            if filtrar_fecha:
                                 if fecha_str:
                                     try:
                                         # Intentar parsear la fecha (formato dd/mm/yyyy)
@@ -2739,8 +4600,7 @@ def obtener_actividades_servicio(fecha_inicio=None, fecha_fin=None, nombre_emple
                                         except:
                                             pass  # Si no se puede parsear, incluir el registro
                             
-                            actividad_reg = str(row[idx_actividad_reg]).strip()
-                            tiempo_str = str(row[idx_tiempo]).strip().replace(',', '.')
+                            tiempo_str = tiempo_str.replace(',', '.')
                             try:
                                 tiempo = float(tiempo_str) if tiempo_str else 0
                             except:
@@ -2754,27 +4614,8 @@ def obtener_actividades_servicio(fecha_inicio=None, fecha_fin=None, nombre_emple
             print(f"Error al obtener horas de Registros: {e}")
         
         # ===== CREAR LISTA DE ACTIVIDADES CON HORAS =====
-        # Función para normalizar texto (quitar tildes y convertir a minúsculas)
-        import unicodedata
-        def normalizar_texto(texto):
-            """Normaliza texto: minúsculas y sin tildes"""
-            texto = str(texto).lower().strip()
-            # Normalizar Unicode y quitar acentos
-            texto = unicodedata.normalize('NFD', texto)
-            texto = ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
-            return texto
-        
-        # Crear mapa de actividades normalizadas para comparación
-        actividades_servicio_normalizadas = {}
-        for row in rows:
-            if len(row) > idx_actividad:
-                actividad = str(row[idx_actividad]).strip()
-                numero = str(row[idx_numero]).strip() if idx_numero is not None and len(row) > idx_numero else ''
-                if actividad:
-                    actividades_servicio_normalizadas[normalizar_texto(actividad)] = {
-                        'numero': numero,
-                        'actividad': actividad
-                    }
+        # Mapa de actividades normalizadas de Servicio (se reutiliza mientras la hoja no cambie)
+        mapa_servicios = obtener_mapa_servicios(rows, idx_actividad, idx_numero, version_servicio)
         
         # Normalizar horas_por_actividad para comparación
         horas_por_actividad_normalizado = {}
@@ -2785,26 +4626,19 @@ def obtener_actividades_servicio(fecha_inicio=None, fecha_fin=None, nombre_emple
             horas_por_actividad_normalizado[act_normalizado]['horas'] += horas
         
         actividades = []
-        actividades_ya_agregadas = set()
         
         # Primero agregar actividades del sheet Servicio
-        for row in rows:
-            if len(row) > idx_actividad:
-                actividad = str(row[idx_actividad]).strip()
-                numero = str(row[idx_numero]).strip() if idx_numero is not None and len(row) > idx_numero else ''
-                if actividad:
-                    act_normalizado = normalizar_texto(actividad)
-                    horas = horas_por_actividad_normalizado.get(act_normalizado, {}).get('horas', 0)
-                    actividades.append({
-                        'numero': numero,
-                        'actividad': actividad,
-                        'horas': round(horas, 2)
-                    })
-                    actividades_ya_agregadas.add(act_normalizado)
+        for servicio in mapa_servicios.servicios:
+            horas = horas_por_actividad_normalizado.get(servicio['clave'], {}).get('horas', 0)
+            actividades.append({
+                'numero': servicio['numero'],
+                'actividad': servicio['actividad'],
+                'horas': round(horas, 2)
+            })
         
         # Luego agregar actividades de Registros que NO están en Servicio
         for act_normalizado, info in horas_por_actividad_normalizado.items():
-            if act_normalizado not in actividades_ya_agregadas:
+            if act_normalizado not in mapa_servicios.por_nombre:
                 actividades.append({
                     'numero': '?',  # No tiene código porque no está en Servicio
                     'actividad': f"{info['nombre_original']} (no en Servicio)",
@@ -2816,6 +4650,102 @@ def obtener_actividades_servicio(fecha_inicio=None, fecha_fin=None, nombre_emple
     except Exception as e:
         return [], f"Error al obtener actividades: {str(e)}"
 
+def mostrar_avance_todas_ops():
+    """Tabla con el avance por etapa de todas las OPs no terminadas, ordenable por exceso"""
+    st.markdown("""
+    <div style='
+        background: white;
+        padding: 25px;
+        border-radius: 15px;
+        border-left: 5px solid #3EAEA5;
+        box-shadow: 0 5px 20px rgba(62, 174, 165, 0.15);
+        margin-bottom: 20px;
+    '>
+        <h3 style='color: #2D8B84; margin-bottom: 15px;'>📋 Avance de todas las OPs abiertas</h3>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    progreso_ops, mensaje = obtener_progreso_todas_ops()
+    if not progreso_ops:
+        st.warning(f"⚠️ No se encontraron OPs: {mensaje}")
+        return
+    
+    criterios_orden = {
+        "Mayor exceso de horas": lambda op: (-op['exceso_horas'], -op['progreso_maximo']),
+        "Mayor progreso en una etapa": lambda op: (-op['progreso_maximo'], -op['exceso_horas']),
+        "Más horas trabajadas": lambda op: -op['horas_totales'],
+        "Número de OP": lambda op: op['orden']
+    }
+    
+    col_orden, col_filtro = st.columns([2, 1])
+    with col_orden:
+        criterio = st.selectbox("Ordenar por", options=list(criterios_orden), index=0, key="avance_ops_orden")
+    with col_filtro:
+        st.markdown("<br>", unsafe_allow_html=True)
+        solo_excedidas = st.checkbox("Solo OPs con exceso", value=False, key="avance_ops_solo_exceso")
+    
+    if solo_excedidas:
+        progreso_ops = [op for op in progreso_ops if op['exceso_horas'] > 0]
+    progreso_ops = sorted(progreso_ops, key=criterios_orden[criterio])
+    
+    criticas = sum(1 for op in progreso_ops if op['exceso_horas'] > 0)
+    st.markdown(f"""
+    <div style='
+        background: linear-gradient(135deg, #E8F4FD 0%, #F0F8FF 100%);
+        padding: 15px;
+        border-radius: 10px;
+        margin-bottom: 15px;
+        display: flex;
+        justify-content: space-between;
+        align-items: center;
+        flex-wrap: wrap;
+        gap: 10px;
+    '>
+        <span style='font-size: 16px; color: #0056b3;'>📋 OPs mostradas: <strong>{len(progreso_ops)}</strong></span>
+        <span style='font-size: 16px; color: #DC3545;'>⚠️ OPs con exceso: <strong>{criticas}</strong></span>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    filas_html = ""
+    for i, op in enumerate(progreso_ops, 1):
+        bg_color = '#f8f9fa' if i % 2 == 0 else 'white'
+        celdas_etapas = ""
+        for etapa in ETAPAS_PROYECTO:
+            datos = op['etapas'][etapa]
+            if datos['estimado'] > 0:
+                celdas_etapas += f"<td style='padding: 10px 12px; text-align: center;'><span style='background: {datos['color']}; color: white; padding: 3px 8px; border-radius: 10px; font-weight: 600;'>{datos['progreso']:.0f}%</span><br><span style='font-size: 12px; color: #6c757d;'>{datos['horas']:.1f} / {datos['estimado']:.1f} h</span></td>"
+            else:
+                celdas_etapas += f"<td style='padding: 10px 12px; text-align: center; font-size: 12px; color: #6c757d;'>{datos['horas']:.1f} h<br>sin estimado</td>"
+        exceso_color = '#DC3545' if op['exceso_horas'] > 0 else '#28a745'
+        filas_html += f"<tr style='background: {bg_color}; border-bottom: 1px solid #dee2e6;'><td style='padding: 10px 12px; font-weight: 600; color: #2D8B84;'>{op['orden']}</td><td style='padding: 10px 12px; color: #212529;'>{op['cliente']}<br><span style='font-size: 12px; color: #6c757d;'>{op['referencia']}</span></td>{celdas_etapas}<td style='padding: 10px 12px; text-align: right; font-weight: 600; color: {exceso_color};'>{op['exceso_horas']:.2f} hrs</td></tr>"
+    
+    encabezados_etapas = "".join(
+        f"<th style='padding: 12px; text-align: center; position: sticky; top: 0; background: #2D8B84;'>{etapa.capitalize()}</th>"
+        for etapa in ETAPAS_PROYECTO
+    )
+    st.markdown(f"""
+    <div style='max-height: 500px; overflow-y: auto; border-radius: 10px; border: 1px solid #dee2e6;'>
+    <table style='width: 100%; border-collapse: collapse; font-family: Poppins, sans-serif; font-size: 14px;'>
+        <thead>
+            <tr style='color: white;'>
+                <th style='padding: 12px; text-align: left; position: sticky; top: 0; background: #2D8B84;'>OP</th>
+                <th style='padding: 12px; text-align: left; position: sticky; top: 0; background: #2D8B84;'>Cliente / Referencia</th>
+                {encabezados_etapas}
+                <th style='padding: 12px; text-align: right; position: sticky; top: 0; background: #2D8B84;'>Exceso</th>
+            </tr>
+        </thead>
+        <tbody>
+            {filas_html}
+        </tbody>
+    </table>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    st.markdown("<br>", unsafe_allow_html=True)
+    if st.button("❌ Cerrar Reporte", type="secondary", key="cerrar_avance_todas_ops"):
+        st.session_state.mostrar_avance_todas_ops = False
+        st.rerun()
+
 def pantalla_avance_proyecto():
     """Pantalla para registrar avance de proyectos"""
     
@@ -2854,26 +4784,41 @@ def pantalla_avance_proyecto():
     </div>
     """, unsafe_allow_html=True)
     
-    # Inicializar estado para mostrar reporte
+    # Inicializar estado para mostrar reportes
     if 'mostrar_reporte_general' not in st.session_state:
         st.session_state.mostrar_reporte_general = False
+    if 'mostrar_avance_todas_ops' not in st.session_state:
+        st.session_state.mostrar_avance_todas_ops = False
     
-    # Botones: Volver y Reporte General
+    # Botones: Volver, Reporte General y Avance de todas las OPs
     col_btn1, col_btn2, col_btn3 = st.columns([1, 1, 2])
     
     with col_btn1:
         if st.button("← Volver al Inicio", type="secondary"):
             st.session_state.screen = 'inicio'
             st.session_state.mostrar_reporte_general = False
+            st.session_state.mostrar_avance_todas_ops = False
             st.rerun()
     
     with col_btn2:
         if st.button("📊 Reporte General", type="primary"):
             st.session_state.mostrar_reporte_general = not st.session_state.mostrar_reporte_general
+            st.session_state.mostrar_avance_todas_ops = False
+            st.rerun()
+    
+    with col_btn3:
+        if st.button("📋 Avance de todas las OPs", type="primary"):
+            st.session_state.mostrar_avance_todas_ops = not st.session_state.mostrar_avance_todas_ops
+            st.session_state.mostrar_reporte_general = False
             st.rerun()
     
     st.markdown("<br>", unsafe_allow_html=True)
     
+    # Reporte de avance de todas las OPs abiertas
+    if st.session_state.mostrar_avance_todas_ops:
+        mostrar_avance_todas_ops()
+        return
+    
     # Si se activa el reporte general, mostrar las actividades
     if st.session_state.mostrar_reporte_general:
         st.markdown("""
@@ -3854,6 +5799,25 @@ def pantalla_inicio():
             st.session_state.screen = 'admin_login'
             st.rerun()
 
+# ============================================
+# MENSAJES FLASH ENTRE PASOS
+# Los pasos del registro avanzan con st.rerun() inmediato; el mensaje del paso
+# anterior se guarda en session_state y se muestra al inicio del siguiente
+# render, sin bloquear el script con sleep.
+# ============================================
+
+def programar_mensaje_flash(tipo, mensaje=None):
+    """Encolar un mensaje para el próximo render ('success', 'info', 'warning', 'error' o 'balloons')"""
+    st.session_state.setdefault('mensajes_flash', []).append((tipo, mensaje))
+
+def mostrar_mensajes_flash():
+    """Mostrar y consumir los mensajes encolados por el paso anterior"""
+    for tipo, mensaje in st.session_state.pop('mensajes_flash', []):
+        if tipo == 'balloons':
+            st.balloons()
+        else:
+            getattr(st, tipo, st.info)(mensaje)
+
 def pantalla_registro_colaborador():
     """Pantalla de registro paso a paso con códigos de barras - Diseño Tekpro estilo tarjeta"""
     
@@ -3921,6 +5885,9 @@ def pantalla_registro_colaborador():
     if 'empleado_data' not in st.session_state:
         st.session_state.empleado_data = {}
     
+    # Mensajes del paso anterior (el avance entre pasos es inmediato)
+    mostrar_mensajes_flash()
+    
     # Paso 1: Código de barras de la cédula
     if st.session_state.step == 1:
         mostrar_paso_cedula()
@@ -4049,31 +6016,19 @@ def mostrar_paso_actividad():
                         'item': 'SERVICIO DIRECTO'
                     }
                     
-                    # Mostrar mensaje especial y saltar directo al paso 4
-                    st.success(f"✅ Servicio encontrado: {numero} - {nomservicio}")
-                    st.info("🔧 Servicio directo - OP automática: 0000")
-                    
-                    # Esperar un momento y saltar al paso 4 (confirmación)
-                    import time
-                    time.sleep(1)
+                    # Mostrar mensaje especial en el paso 4 y saltar directo a él
+                    programar_mensaje_flash('success', f"✅ Servicio encontrado: {numero} - {nomservicio}")
+                    programar_mensaje_flash('info', "🔧 Servicio directo - OP automática: 0000")
                     st.session_state.step = 4
                     st.rerun()
                 else:
                     # Servicios normales: continuar con el paso de OP
-                    st.success(f"✅ Servicio encontrado: {numero} - {nomservicio}")
-                    
-                    # Esperar un momento para mostrar el mensaje y luego avanzar al paso 3
-                    import time
-                    time.sleep(1)
+                    programar_mensaje_flash('success', f"✅ Servicio encontrado: {numero} - {nomservicio}")
                     st.session_state.step = 3
                     st.rerun()
             except ValueError:
                 # Si no es un número, continuar normalmente
-                st.success(f"✅ Servicio encontrado: {numero} - {nomservicio}")
-                
-                # Esperar un momento para mostrar el mensaje y luego avanzar
-                import time
-                time.sleep(1)
+                programar_mensaje_flash('success', f"✅ Servicio encontrado: {numero} - {nomservicio}")
                 st.session_state.step = 3
                 st.rerun()
         else:
@@ -4155,12 +6110,8 @@ def mostrar_paso_op():
             st.session_state.empleado_data['codigo_op'] = codigo_op
             st.session_state.empleado_data['op_info'] = op_info
             
-            # Mostrar mensaje de éxito y avanzar al paso 4 (confirmación)
-            st.success(f"✅ OP encontrada: {op_info['orden']} - {op_info['cliente']}")
-            
-            # Esperar un momento para mostrar el mensaje y luego avanzar
-            import time
-            time.sleep(1)
+            # Mensaje de éxito en el paso 4 (confirmación) y avanzar
+            programar_mensaje_flash('success', f"✅ OP encontrada: {op_info['orden']} - {op_info['cliente']}")
             st.session_state.step = 4
             st.rerun()
         else:
@@ -4197,8 +6148,8 @@ def mostrar_confirmacion_guardado():
 
     
     # Calcular tiempo de la actividad anterior basado en cédula
-    df = load_data()
     fecha_actual = obtener_fecha_colombia()
+    df = load_data(fecha_inicio=fecha_actual, fecha_fin=fecha_actual)
     hora_actual = obtener_hora_colombia_time()
     
     # Debug: mostrar información del DataFrame
@@ -4211,9 +6162,7 @@ def mostrar_confirmacion_guardado():
     
     tiempo_actividad_anterior = 0
     if ultimo_registro is not None:
-        hora_entrada_anterior = ultimo_registro['hora_entrada']
-        if isinstance(hora_entrada_anterior, str):
-            hora_entrada_anterior = datetime.strptime(hora_entrada_anterior, '%H:%M:%S').time()
+        hora_entrada_anterior = hora_de_registro(ultimo_registro['hora_entrada'])
         tiempo_actividad_anterior = calcular_horas(hora_entrada_anterior, hora_actual)
     
     # Calcular los valores para mostrar en la confirmación
@@ -4289,14 +6238,8 @@ def mostrar_confirmacion_guardado():
     
     with col3:
         if st.button("💾 Guardar Registro", type="primary"):
-            # Guardar el registro completo
+            # Guardar el registro completo (deja su confirmación como mensaje flash)
             guardar_registro_completo(empleado_data)
-            # Mostrar confirmación
-            st.success("✅ ¡Registro guardado exitosamente!")
-            
-            # Esperar un momento para mostrar el mensaje
-            import time
-            time.sleep(1)
             
             # Limpiar TODOS los datos de sesión para nuevo registro
             st.session_state.step = 1
@@ -4312,8 +6255,8 @@ def finalizar_actividad_actual(empleado, hora_finalizacion=None):
     if hora_finalizacion is None:
         hora_finalizacion = obtener_hora_colombia_time()
     
-    df = load_data()
     fecha_actual = obtener_fecha_colombia()
+    df = load_data(fecha_inicio=fecha_actual, fecha_fin=fecha_actual)
     
     # Buscar el último registro sin salida
     ultimo_registro = obtener_ultimo_registro_del_dia(empleado, fecha_actual, df)
@@ -4323,108 +6266,73 @@ def finalizar_actividad_por_cedula(cedula, hora_finalizacion=None):
     if hora_finalizacion is None:
         hora_finalizacion = obtener_hora_colombia_time()
     
-    df = load_data()
     fecha_actual = obtener_fecha_colombia()
+    df = load_data(fecha_inicio=fecha_actual, fecha_fin=fecha_actual)
     
     # Buscar el último registro sin salida basado en cédula
     ultimo_registro = obtener_ultimo_registro_por_cedula(cedula, fecha_actual, df)
     
-    if ultimo_registro is not None and (pd.isna(ultimo_registro['hora_salida']) or ultimo_registro['hora_salida'] == ''):
+    if ultimo_registro is not None and pd.isna(ultimo_registro['hora_salida']):
         # Finalizar el registro
         idx = ultimo_registro.name
-        df.loc[idx, 'hora_salida'] = hora_finalizacion.strftime('%H:%M:%S') if hasattr(hora_finalizacion, 'strftime') else str(hora_finalizacion)
         
         # Calcular horas trabajadas
-        hora_entrada = ultimo_registro['hora_entrada']
-        if isinstance(hora_entrada, str):
-            hora_entrada = datetime.strptime(hora_entrada, '%H:%M:%S').time()
+        hora_entrada = hora_de_registro(ultimo_registro['hora_entrada'])
         
         horas_trabajadas = calcular_horas(hora_entrada, hora_finalizacion)
-        df.loc[idx, 'horas_trabajadas'] = round(horas_trabajadas, 2)
         
-        # Guardar cambios
-        save_data(df)
+        # Guardar cambios (solo este registro)
+        actualizar_registro_local(idx, {
+            'hora_salida': hora_finalizacion.strftime('%H:%M:%S') if hasattr(hora_finalizacion, 'strftime') else str(hora_finalizacion),
+            'horas_trabajadas': round(horas_trabajadas, 2)
+        })
         
         return True, horas_trabajadas
     
     return False, 0
 
-def verificar_doble_guardado(cedula, minutos_minimos=1):
+def verificar_doble_guardado(cedula, minutos_minimos=1, contexto=None):
     """
     Verifica si el empleado ha guardado un registro en los últimos X minutos.  
+    Si se pasa un ContextoRegistro (del día de hoy), reutiliza sus filas.
     Retorna (puede_guardar, segundos_restantes, mensaje)
     """
     try:
-        # Conectar a Google Sheets para obtener el último registro
-        spreadsheet, mensaje = conectar_google_sheets()
-        if spreadsheet is None:
-            # Si no hay conexión, permitir el guardado (mejor no bloquear)
-            return True, 0, ""
+        # Obtener los registros de hoy desde el espejo local de Registros
+        if contexto is None:
+            contexto = ContextoRegistro(cedula, obtener_fecha_colombia())
         
-        config = load_config()
-        worksheet_name = config.get('google_sheets', {}).get('worksheet_registros', 'Registros')
-        worksheet = spreadsheet.worksheet(worksheet_name)
+        if not contexto.disponible or contexto.idx_hora_exacta is None:
+            # Si no hay conexión o no están las columnas, permitir el guardado (mejor no bloquear)
+            return True, 0, ""
         
-        # Obtener todos los registros
-        all_values = worksheet.get_all_values()
-        if len(all_values) < 2:
-            return True, 0, ""  # No hay registros, puede guardar
-        
-        headers = all_values[0]
-        rows = all_values[1:]
-        
-        # Buscar índices de las columnas necesarias
-        idx_cedula = None
-        idx_fecha = None
-        idx_hora_exacta = None
-        
-        for i, header in enumerate(headers):
-            header_lower = header.lower().strip()
-            if header_lower == 'cédula' or header_lower == 'cedula':
-                idx_cedula = i
-            elif header_lower == 'fecha':
-                idx_fecha = i
-            elif header_lower == 'hora_exacta':
-                idx_hora_exacta = i
-        
-        if idx_cedula is None or idx_hora_exacta is None:
-            return True, 0, ""  # No se encontraron columnas, permitir
-        
-        # Buscar el último registro de esta cédula (recorrer de atrás hacia adelante)
-        fecha_hoy = obtener_fecha_colombia().strftime('%d/%m/%Y')
         hora_ahora = obtener_hora_colombia()
         
-        for row in reversed(rows):
-            if len(row) > max(idx_cedula, idx_hora_exacta):
-                cedula_registro = str(row[idx_cedula]).strip()
-                if cedula_registro == str(cedula).strip():
-                    # Encontramos el último registro de esta cédula
-                    fecha_registro = row[idx_fecha] if idx_fecha is not None and len(row) > idx_fecha else ''
-                    hora_exacta_str = row[idx_hora_exacta].strip()
-                    
-                    # Solo verificar registros de hoy
-                    if fecha_registro == fecha_hoy and hora_exacta_str:
-                        try:
-                            # Parsear la hora exacta (formato HH:MM:SS)
-                            hora_parts = hora_exacta_str.split(':')
-                            if len(hora_parts) >= 2:
-                                hora_registro = hora_ahora.replace(
-                                    hour=int(hora_parts[0]),
-                                    minute=int(hora_parts[1]),
-                                    second=int(hora_parts[2]) if len(hora_parts) > 2 else 0,
-                                    microsecond=0
-                                )
-                                
-                                # Calcular diferencia en segundos
-                                diferencia = (hora_ahora - hora_registro).total_seconds()
-                                
-                                # Si la diferencia es menor a minutos_minimos * 60 segundos
-                                if diferencia < (minutos_minimos * 60):
-                                    segundos_restantes = int((minutos_minimos * 60) - diferencia)
-                                    return False, segundos_restantes, f"⏳ Debes esperar {segundos_restantes} segundos antes de guardar otro registro."
-                        except:
-                            pass
-                    break  # Ya encontramos el último registro de esta cédula
+        # Último registro de hoy de esta cédula
+        if contexto.filas:
+            hora_exacta_str = contexto.ultima_hora_exacta() or ''
+            
+            if hora_exacta_str:
+                try:
+                    # Parsear la hora exacta (formato HH:MM:SS)
+                    hora_parts = hora_exacta_str.split(':')
+                    if len(hora_parts) >= 2:
+                        hora_registro = hora_ahora.replace(
+                            hour=int(hora_parts[0]),
+                            minute=int(hora_parts[1]),
+                            second=int(hora_parts[2]) if len(hora_parts) > 2 else 0,
+                            microsecond=0
+                        )
+                        
+                        # Calcular diferencia en segundos
+                        diferencia = (hora_ahora - hora_registro).total_seconds()
+                        
+                        # Si la diferencia es menor a minutos_minimos * 60 segundos
+                        if diferencia < (minutos_minimos * 60):
+                            segundos_restantes = int((minutos_minimos * 60) - diferencia)
+                            return False, segundos_restantes, f"⏳ Debes esperar {segundos_restantes} segundos antes de guardar otro registro."
+                except:
+                    pass
         
         return True, 0, ""
         
@@ -4435,18 +6343,20 @@ def verificar_doble_guardado(cedula, minutos_minimos=1):
 
 def guardar_registro_completo(empleado_data):
     """Guardar registro usando la nueva lógica de conteos diarios"""
-    df = load_data()
     fecha_actual = obtener_fecha_colombia()
     hora_actual = obtener_hora_colombia_time()
     empleado = empleado_data['nombre']
     cedula = empleado_data['cedula']
     
+    # Registros del día leídos una sola vez (doble guardado + conteo diario)
+    contexto = ContextoRegistro(cedula, fecha_actual)
+    
     # ============================================
     # VERIFICAR DOBLE GUARDADO (menos de 1 minuto)
     # ============================================
-    puede_guardar, segundos_restantes, mensaje_bloqueo = verificar_doble_guardado(cedula, minutos_minimos=1)
+    puede_guardar, segundos_restantes, mensaje_bloqueo = verificar_doble_guardado(cedula, minutos_minimos=1, contexto=contexto)
     if not puede_guardar:
-        st.error(f"""⛔ **Registro bloqueado por seguridad**
+        programar_mensaje_flash('error', f"""⛔ **Registro bloqueado por seguridad**
         
 {mensaje_bloqueo}
 
@@ -4481,12 +6391,9 @@ Se crearán **DOS registros**:
     # NUEVA LÓGICA DE CONTEOS DIARIOS
     st.info("🕐 Aplicando nueva lógica de conteos diarios...")
     
-    # IMPORTANTE: Recargar el DataFrame más actual antes del cálculo
-    df_actualizado = load_data()
-    
     # Calcular usando la nueva lógica con DataFrame actualizado
     # Usamos la hora actual REAL (no la hora de cierre de adecuación locativa)
-    conteo_resultado = calcular_horas_conteo_diario(cedula, fecha_actual, hora_actual, None)
+    conteo_resultado = calcular_horas_conteo_diario(cedula, fecha_actual, hora_actual, None, contexto=contexto)
 
     
     # Debug: Mostrar información de la nueva lógica
@@ -4528,7 +6435,11 @@ Se crearán **DOS registros**:
         else:
             hora_fin_str = str(conteo_resultado['hora_fin_conteo'])
     
+    # El mismo id identifica el registro en el almacén local y en la hoja
+    id_registro = nuevo_id_registro()
+    
     nuevo_registro = {
+        'id_registro': id_registro,
         'fecha': fecha_actual,
         'cedula': cedula,
         'empleado': empleado,
@@ -4550,20 +6461,20 @@ Se crearán **DOS registros**:
         'servicio': f"{str(servicio_info.get('numero', '')).strip()} - {str(servicio_info.get('nomservicio', '')).strip()}" if servicio_info and servicio_info.get('numero') and servicio_info.get('nomservicio') else ''
     }
     
-    # PASO 5: Guardar en archivo local INMEDIATAMENTE
-    df = pd.concat([df, pd.DataFrame([nuevo_registro])], ignore_index=True)
-    save_data(df)
+    # PASO 5: Guardar en almacén local INMEDIATAMENTE (una sola fila nueva)
+    insertar_registro_local(nuevo_registro)
     
     # PASO 6: Guardar registro en Google Sheets
-    config = load_config()
+    config = obtener_config()
     gs_enabled = config.get('google_sheets', {}).get('enabled', False)
     
     # Guardar registro actual en Google Sheets (tanto primer registro como siguientes)
     if gs_enabled:
         try:
-            mensaje_guardado = "🔄 Guardando primer registro del día en Google Sheets..." if conteo_resultado['es_primer_registro'] else "🔄 Guardando nueva actividad en Google Sheets..."
+            mensaje_guardado = "📤 Primer registro del día en cola para Google Sheets" if conteo_resultado['es_primer_registro'] else "📤 Nueva actividad en cola para Google Sheets"
             st.info(mensaje_guardado)
             registro_actual_para_sheets = {
+                'id_registro': id_registro,
                 'fecha': fecha_actual,
                 'cedula': cedula,
                 'empleado': empleado,
@@ -4585,24 +6496,23 @@ Se crearán **DOS registros**:
                 'servicio': f"{str(servicio_info.get('numero', '')).strip()} - {str(servicio_info.get('nomservicio', '')).strip()}" if servicio_info and servicio_info.get('numero') and servicio_info.get('nomservicio') else ''
             }
             
-            guardar_en_google_sheets_simple(registro_actual_para_sheets)
-            if conteo_resultado['es_primer_registro']:
-                st.success(f"✅ Primer registro del día guardado - Tiempo: {conteo_resultado['tiempo_trabajado']:.2f} horas")
-            else:
-                st.success(f"✅ Nueva actividad guardada - Tiempo inicial: {conteo_resultado['tiempo_trabajado']:.3f} horas")
+            registros_para_sheets = [registro_actual_para_sheets]
             
             # ============================================
             # PASO 6B: GUARDAR SEGUNDO REGISTRO DE ADECUACIÓN LOCATIVA
             # Si es horario de adecuación locativa, guardar el registro automático
             # ============================================
+            registro_adecuacion_local = None
             if es_adecuacion and info_adecuacion and info_adecuacion['tiempo_adecuacion'] > 0:
-                st.info(f"🏠 Guardando registro automático de Adecuación Locativa...")
+                st.info(f"🏠 Encolando registro automático de Adecuación Locativa...")
                 
                 servicio_adecuacion = obtener_servicio_adecuacion_locativa()
                 hora_cierre = info_adecuacion['hora_cierre']
+                id_registro_adecuacion = nuevo_id_registro()
                 
                 # Crear registro de Adecuación Locativa
                 registro_adecuacion_para_sheets = {
+                    'id_registro': id_registro_adecuacion,
                     'fecha': fecha_actual,
                     'cedula': cedula,
                     'empleado': empleado,
@@ -4624,11 +6534,12 @@ Se crearán **DOS registros**:
                     'servicio': f"{servicio_adecuacion['numero']} - {servicio_adecuacion['nomservicio']}"
                 }
                 
-                # Guardar en Google Sheets
-                guardar_en_google_sheets_simple(registro_adecuacion_para_sheets)
+                # Se encola junto con la OP: ambos salen en el mismo lote
+                registros_para_sheets.append(registro_adecuacion_para_sheets)
                 
                 # También guardar en archivo local
                 registro_adecuacion_local = {
+                    'id_registro': id_registro_adecuacion,
                     'fecha': fecha_actual,
                     'cedula': cedula,
                     'empleado': empleado,
@@ -4649,17 +6560,25 @@ Se crearán **DOS registros**:
                     'referencia': 'N/A',
                     'servicio': f"{servicio_adecuacion['numero']} - {servicio_adecuacion['nomservicio']}"
                 }
+            
+            # Una sola escritura en la cola de salida antes de despertar al trabajador
+            guardar_en_google_sheets_simple(*registros_para_sheets)
+            if conteo_resultado['es_primer_registro']:
+                programar_mensaje_flash('success', f"✅ {empleado}: primer registro del día guardado - Tiempo: {conteo_resultado['tiempo_trabajado']:.2f} horas")
+            else:
+                programar_mensaje_flash('success', f"✅ {empleado}: nueva actividad guardada - Tiempo: {conteo_resultado['tiempo_trabajado']:.3f} horas")
+            
+            if registro_adecuacion_local is not None:
+                insertar_registro_local(registro_adecuacion_local)
                 
-                df = load_data()
-                df = pd.concat([df, pd.DataFrame([registro_adecuacion_local])], ignore_index=True)
-                save_data(df)
-                
-                st.success(f"✅ Adecuación Locativa guardada - Tiempo: {info_adecuacion['tiempo_adecuacion']:.3f} horas ({int(info_adecuacion['tiempo_adecuacion'] * 60)} minutos)")
+                programar_mensaje_flash('success', f"✅ Adecuación Locativa guardada - Tiempo: {info_adecuacion['tiempo_adecuacion']:.3f} horas ({int(info_adecuacion['tiempo_adecuacion'] * 60)} minutos)")
             
         except Exception as e:
             tipo_registro = "primer registro" if conteo_resultado['es_primer_registro'] else "nueva actividad"
-            st.error(f"❌ Error guardando {tipo_registro}: {str(e)}")
-            st.info("📝 Datos guardados solo localmente")
+            programar_mensaje_flash('error', f"❌ Error guardando {tipo_registro}: {str(e)}")
+            programar_mensaje_flash('info', "📝 Datos guardados solo localmente")
+    else:
+        programar_mensaje_flash('success', f"✅ {empleado}: registro guardado localmente - Tiempo: {conteo_resultado['tiempo_trabajado']:.3f} horas")
     
     # PASO 7: Mostrar resumen del día y nueva actividad
     resumen_dia = obtener_resumen_dia_empleado(cedula, fecha_actual)
@@ -4686,14 +6605,14 @@ Se crearán **DOS registros**:
     if conteo_resultado['es_primer_registro']:
         st.success("✅ **PRIMER REGISTRO ABSOLUTO DE ESTA CÉDULA**")
         st.info(f"🕐 Tiempo desde las 7:00 AM hasta {conteo_resultado['hora_exacta_registro']} = {conteo_resultado['tiempo_trabajado']:.3f} horas")
-        st.info("📋 Registro guardado en Google Sheets")
+        st.info("📋 Registro en cola para Google Sheets")
     else:
         if conteo_resultado.get('es_primer_registro_del_dia', False):
             st.success("✅ **PRIMER REGISTRO DEL DÍA - BASADO EN ÚLTIMA HORA**")
         else:
             st.success("✅ **REGISTRO ADICIONAL - BASADO EN ÚLTIMA HORA**")
         st.info(f"🕐 Tiempo desde {conteo_resultado['hora_inicio_conteo']} hasta {conteo_resultado['hora_exacta_registro']} = {conteo_resultado['tiempo_trabajado']:.3f} horas")
-        st.info("� Registro guardado en Google Sheets")
+        st.info("� Registro en cola para Google Sheets")
     
     # Información sobre el sistema de horas exactas
     with st.expander("ℹ️ Cómo funciona el nuevo sistema basado en última hora"):
@@ -4729,11 +6648,9 @@ Se crearán **DOS registros**:
            - ✅ Tiempo real trabajado por actividad
         """)
     
-    st.balloons()
+    programar_mensaje_flash('balloons')
     
-    # Redirigir automáticamente al paso 1 (ingresar cédula) después de 1 segundo
-    import time
-    time.sleep(1)
+    # Redirigir de inmediato al paso 1 (ingresar cédula); la confirmación se muestra allí
     
     # Limpiar TODOS los datos de sesión para nuevo registro completo
     # Esto fuerza a pasar por los pasos 1, 2 y 3 nuevamente
@@ -4755,18 +6672,18 @@ Se crearán **DOS registros**:
     st.session_state.screen = 'registro_colaborador'
     st.rerun()
 
-def guardar_en_google_sheets_simple(registro):
-    """Función ultra-básica para guardar en Google Sheets con máxima confiabilidad.
-    Si no hay conexión, guarda localmente y sincroniza después."""
-    
-    # ============================================
-    # VERIFICAR CONEXIÓN A INTERNET PRIMERO
-    # ============================================
-    tiene_conexion, msg_conexion = verificar_conexion_internet(timeout=3)
-    
-    if not tiene_conexion:
-        # NO hay internet - guardar localmente
-        num_pendientes = guardar_registro_pendiente(registro)
+def guardar_en_google_sheets_simple(*registros):
+    """Guardar uno o varios registros para Google Sheets sin esperar a la red.
+    Los registros entran juntos a la cola de salida local (diario de pendientes,
+    con fsync) antes de despertar al trabajador de sincronización, que los sube
+    en segundo plano, en el mismo lote y con reintentos.
+    Retorna True en cuanto los registros quedaron guardados localmente."""
+    num_pendientes = guardar_registros_pendientes(registros)
+    
+    trabajador = obtener_trabajador_sincronizacion()
+    trabajador.solicitar_sincronizacion()
+    
+    if trabajador.obtener_estado()['conectado'] is False:
         st.warning(f"""📴 **Sin conexión a internet**
         
 El registro se ha guardado **localmente** y se sincronizará automáticamente cuando vuelva la conexión.
@@ -4774,128 +6691,9 @@ El registro se ha guardado **localmente** y se sincronizará automáticamente cu
 📋 Registros pendientes de sincronizar: **{num_pendientes}**
 
 ✅ **No te preocupes**, tus registros están seguros.""")
-        return True  # Retornar True porque se guardó localmente
-    
-    # HAY internet - intentar guardar normalmente
-    try:
-        spreadsheet, mensaje = conectar_google_sheets()
-        if not spreadsheet:
-            raise Exception(f"No se pudo conectar: {mensaje}")
-        
-        # Obtener la hoja 'Registros' existente (no crear nueva)
-        try:
-            worksheet = spreadsheet.worksheet('Registros')
-        except:
-            raise Exception("No se pudo acceder a la hoja 'Registros'. Verifica que exista en el Google Sheet.")
-        
-        # Preparar datos según la estructura exacta del Sheet
-        fecha_obj = registro.get('fecha')
-        if hasattr(fecha_obj, 'strftime'):
-            fecha_str = fecha_obj.strftime('%d/%m/%Y')
-        else:
-            fecha_str = str(fecha_obj)
-        
-        # Extraer información del servicio si existe
-        servicio = registro.get('servicio', '')
-        codigo_servicio = ''
-        actividad_servicio = ''
-        
-        if servicio and ' - ' in servicio:
-            partes_servicio = servicio.split(' - ', 1)
-            codigo_servicio = partes_servicio[0].strip()
-            actividad_servicio = partes_servicio[1].strip()
-        
-        # Formatear horas de entrada y salida
-        hora_entrada = registro.get('hora_entrada', '')
-        hora_salida = registro.get('hora_salida', '')
-        
-        if isinstance(hora_entrada, time):
-            hora_entrada = hora_entrada.strftime('%H:%M:%S')
-        elif not isinstance(hora_entrada, str):
-            hora_entrada = str(hora_entrada)
-            
-        if isinstance(hora_salida, time):
-            hora_salida = hora_salida.strftime('%H:%M:%S')
-        elif not isinstance(hora_salida, str):
-            hora_salida = str(hora_salida)
-        
-        # 🆕 USAR EL TIEMPO CALCULADO directamente desde el registro
-        tiempo_horas_calculado = registro.get('tiempo_horas', 0)
-        
-        # Asegurar que el tiempo se guarde correctamente incluso para primer registro del día
-        print(f"💾 [GUARDADO SHEETS] Tiempo a guardar: {tiempo_horas_calculado} horas")
-        
-        # Fila de datos según estructura exacta del Sheet:
-        # Fecha | Cédula | Nombre | Orden | Cliente | Código | Actividad | Item | Tiempo [Hr] | Cantidades | Proceso | Mes | Año | Semana | REFERENCIA | hora_exacta
-        fila_datos = [
-            fecha_str,  # Fecha
-            str(registro.get('cedula', '')),  # Cédula
-            str(registro.get('empleado', '')),  # Nombre
-            str(registro.get('op', '')),  # Orden
-            str(registro.get('nombre_cliente', '')),  # Cliente
-            codigo_servicio,  # Código
-            actividad_servicio,  # Actividad
-            str(registro.get('descripcion_op', '')),  # Item
-            float(tiempo_horas_calculado) if tiempo_horas_calculado else 0,  # Tiempo [Hr] - como número para evitar apóstrofe
-            str(registro.get('op_info', {}).get('cantidades', registro.get('cantidades', ''))),  # Cantidades (de OPS)
-            str(registro.get('descripcion_proceso', 'PRODUCCION')),  # Proceso
-            str(registro.get('mes', '')),  # Mes
-            str(registro.get('año', '')),  # Año
-            str(registro.get('semana', '')),  # Semana
-            str(registro.get('referencia', str(registro.get('codigo_producto', '')))),  # REFERENCIA
-            str(registro.get('hora_exacta', '')),  # hora_exacta (última columna)
-        ]
-        
-        # Agregar la fila (USER_ENTERED para que números se guarden como números)
-        worksheet.append_row(fila_datos, value_input_option='USER_ENTERED')
-        return True
-        
-    except Exception as e:
-        # Si falla, intentar con método aún más básico
-        try:
-            import gspread
-            from google.oauth2.service_account import Credentials
-            
-            config = load_config()
-            gs_config = config.get('google_sheets', {})
-            credentials_file = gs_config.get('credentials_file', '')
-            
-            if credentials_file and os.path.exists(credentials_file):
-                scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-                creds = Credentials.from_service_account_file(credentials_file, scopes=scope)
-                client = gspread.authorize(creds)
-                
-                spreadsheet_url = gs_config.get('spreadsheet_url', '')
-                if spreadsheet_url:
-                    spreadsheet = client.open_by_url(spreadsheet_url)
-                    worksheet = spreadsheet.worksheet('Registros')
-                    
-                    # Solo datos esenciales
-                    fila_minima = [
-                        str(registro.get('fecha', '')),
-                        str(registro.get('empleado', '')),
-                        str(registro.get('op', '')),
-                        float(registro.get('tiempo_horas', 0)) if registro.get('tiempo_horas', 0) else 0
-                    ]
-                    
-                    worksheet.append_row(fila_minima, value_input_option='USER_ENTERED')
-                    return True
-        except Exception as e2:
-            pass
-        
-        # ============================================
-        # SI TODO FALLA - GUARDAR LOCALMENTE
-        # ============================================
-        num_pendientes = guardar_registro_pendiente(registro)
-        st.warning(f"""⚠️ **Error de conexión con Google Sheets**
-        
-El registro se ha guardado **localmente** y se sincronizará automáticamente después.
-
-📋 Registros pendientes: **{num_pendientes}**
-🔄 Se sincronizarán cuando vuelva la conexión.
-
-Error técnico: {str(e)[:100]}""")
-        return True  # Retornar True porque se guardó localmente
+    else:
+        print(f"📤 [COLA SHEETS] {len(registros)} registro(s) encolado(s) ({num_pendientes} en cola)")
+    return True
 
 def guardar_en_google_sheets(registro):
     """Guardar registro en Google Sheets en la hoja 'Registros' existente"""
@@ -4903,11 +6701,11 @@ def guardar_en_google_sheets(registro):
     if spreadsheet:
         try:
             # Obtener el nombre de la hoja de registros de la configuración
-            config = load_config()
+            config = obtener_config()
             worksheet_name = config.get('google_sheets', {}).get('worksheet_registros', 'Registros')
             
             # Acceder a la hoja de registros
-            worksheet = spreadsheet.worksheet(worksheet_name)
+            worksheet = obtener_worksheet(spreadsheet, worksheet_name)
             
             # Preparar datos según la estructura existente
             fecha_obj = registro['fecha']
@@ -4966,7 +6764,7 @@ def pantalla_login_admin():
         st.error("🚫 **Acceso temporalmente bloqueado**")
         st.warning("Has excedido el número máximo de intentos de login. Contacta al administrador del sistema.")
         
-        config = load_config()
+        config = obtener_config()
         admin_config = config.get('admin', {})
         max_attempts = admin_config.get('max_attempts', 3)
         
@@ -5004,7 +6802,7 @@ def pantalla_login_admin():
         st.markdown("<br>", unsafe_allow_html=True)
         
         # Mostrar intentos restantes
-        config = load_config()
+        config = obtener_config()
         admin_config = config.get('admin', {})
         max_attempts = admin_config.get('max_attempts', 3)
         intentos_restantes = max_attempts - st.session_state.login_attempts
@@ -5108,9 +6906,8 @@ def mostrar_dashboard():
     """Mostrar dashboard con estadísticas"""
     st.subheader("📊 Resumen de Hoy")
     
-    df = load_data()
     fecha_hoy = obtener_fecha_colombia()
-    registros_hoy = df[df['fecha'] == fecha_hoy]
+    registros_hoy = load_data(fecha_inicio=fecha_hoy, fecha_fin=fecha_hoy)
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -5119,12 +6916,12 @@ def mostrar_dashboard():
         st.metric("Entradas Hoy", entradas_hoy)
     
     with col2:
-        salidas_hoy = len(registros_hoy[registros_hoy['hora_salida'].notna() & (registros_hoy['hora_salida'] != '')])
+        salidas_hoy = len(registros_hoy[registros_hoy['hora_salida'].notna()])
         st.metric("Salidas Hoy", salidas_hoy)
     
     with col3:
         empleados_activos = len(registros_hoy[(registros_hoy['hora_entrada'].notna()) & 
-                                            (pd.isna(registros_hoy['hora_salida']) | (registros_hoy['hora_salida'] == ''))])
+                                            (registros_hoy['hora_salida'].isna())])
         st.metric("Empleados Activos", empleados_activos)
     
     with col4:
@@ -5149,7 +6946,7 @@ def mostrar_dashboard():
     
     with col2:
         # Verificar configuración de Google Sheets
-        config = load_config()
+        config = obtener_config()
         gs_config = config.get('google_sheets', {})
         gs_status = "🟢 Conectado" if gs_config.get('enabled') else "🔴 Desconectado"
         
@@ -5244,7 +7041,7 @@ def mostrar_dashboard():
         st.info("No hay registros para el día de hoy")
     st.subheader("📋 Registros Recientes")
     if not registros_hoy.empty:
-        st.dataframe(registros_hoy.sort_values('hora_entrada', ascending=False), use_container_width=True)
+        st.dataframe(registros_para_mostrar(registros_hoy.sort_values('hora_entrada', ascending=False)), use_container_width=True)
     else:
         st.info("No hay registros para hoy")
 
@@ -5333,12 +7130,12 @@ def ver_registros():
         df_filtrado = df_filtrado[df_filtrado['empleado'] == empleado_filtro]
     
     df_filtrado = df_filtrado[
-        (df_filtrado['fecha'] >= fecha_inicio) & 
-        (df_filtrado['fecha'] <= fecha_fin)
+        (df_filtrado['fecha'] >= pd.Timestamp(fecha_inicio)) & 
+        (df_filtrado['fecha'] <= pd.Timestamp(fecha_fin))
     ]
     
     if not df_filtrado.empty:
-        st.dataframe(df_filtrado.sort_values('fecha', ascending=False), use_container_width=True)
+        st.dataframe(registros_para_mostrar(df_filtrado.sort_values('fecha', ascending=False)), use_container_width=True)
         
         st.subheader("📊 Estadísticas del Período")
         col1, col2, col3 = st.columns(3)
@@ -5356,7 +7153,7 @@ def ver_registros():
             st.metric("Empleados Activos", empleados_activos)
         
         if st.button("📥 Exportar a CSV"):
-            csv = df_filtrado.to_csv(index=False)
+            csv = registros_para_mostrar(df_filtrado).to_csv(index=False)
             st.download_button(
                 label="Descargar CSV",
                 data=csv,
@@ -5369,9 +7166,10 @@ def ver_registros():
 def obtener_horas_por_op(df_filtrado=None, fecha_inicio=None, fecha_fin=None):
     """Obtener horas trabajadas agrupadas por Orden de Producción"""
     if df_filtrado is None:
-        df = load_data()
         if fecha_inicio and fecha_fin:
-            df = df[(df['fecha'] >= fecha_inicio) & (df['fecha'] <= fecha_fin)]
+            df = load_data(fecha_inicio=fecha_inicio, fecha_fin=fecha_fin)
+        else:
+            df = load_data()
     else:
         df = df_filtrado
     
@@ -5402,7 +7200,7 @@ def obtener_horas_por_op(df_filtrado=None, fecha_inicio=None, fecha_fin=None):
     df_con_op['horas_trabajadas'] = pd.to_numeric(df_con_op['horas_trabajadas'], errors='coerce')
     
     # Agrupar por OP y sumar horas
-    reporte_op = df_con_op.groupby('op').agg({
+    reporte_op = df_con_op.groupby('op', observed=True).agg({
         'horas_trabajadas': 'sum',
         'nombre_cliente': 'first',  # Tomar el primer cliente (debería ser el mismo para toda la OP)
         'codigo_producto': 'first',  # Tomar la primera referencia
@@ -5413,6 +7211,8 @@ def obtener_horas_por_op(df_filtrado=None, fecha_inicio=None, fecha_fin=None):
     
     # Aplanar columnas multinivel
     reporte_op.columns = ['OP', 'Horas_Totales', 'Cliente', 'Referencia', 'Item', 'Empleados_Unicos', 'Fecha_Inicio', 'Fecha_Fin']
+    reporte_op['Fecha_Inicio'] = reporte_op['Fecha_Inicio'].dt.date
+    reporte_op['Fecha_Fin'] = reporte_op['Fecha_Fin'].dt.date
     
     # Redondear horas y ordenar por horas totales
     reporte_op['Horas_Totales'] = reporte_op['Horas_Totales'].round(2)
@@ -5422,7 +7222,10 @@ def obtener_horas_por_op(df_filtrado=None, fecha_inicio=None, fecha_fin=None):
 
 def obtener_detalle_op(op_seleccionada, fecha_inicio=None, fecha_fin=None):
     """Obtener detalle de horas por empleado para una OP específica"""
-    df = load_data()
+    if fecha_inicio and fecha_fin:
+        df = load_data(fecha_inicio=fecha_inicio, fecha_fin=fecha_fin)
+    else:
+        df = load_data()
     
     if df.empty:
         return pd.DataFrame()
@@ -5431,9 +7234,6 @@ def obtener_detalle_op(op_seleccionada, fecha_inicio=None, fecha_fin=None):
     if 'op' not in df.columns or 'horas_trabajadas' not in df.columns:
         return pd.DataFrame()
     
-    if fecha_inicio and fecha_fin:
-        df = df[(df['fecha'] >= fecha_inicio) & (df['fecha'] <= fecha_fin)]
-    
     # Filtrar por OP específica
     df_op = df[
         (df['op'] == op_seleccionada) &
@@ -5449,7 +7249,7 @@ def obtener_detalle_op(op_seleccionada, fecha_inicio=None, fecha_fin=None):
     df_op['horas_trabajadas'] = pd.to_numeric(df_op['horas_trabajadas'], errors='coerce')
     
     # Agrupar por empleado y fecha para ver detalle
-    detalle = df_op.groupby(['empleado', 'fecha']).agg({
+    detalle = df_op.groupby(['empleado', 'fecha'], observed=True).agg({
         'horas_trabajadas': 'sum',
         'codigo_actividad': lambda x: ', '.join(x.unique()),  # Actividades realizadas
         'hora_entrada': 'first',
@@ -5458,7 +7258,7 @@ def obtener_detalle_op(op_seleccionada, fecha_inicio=None, fecha_fin=None):
     
     # Redondear horas
     detalle['horas_trabajadas'] = detalle['horas_trabajadas'].round(2)
-    detalle = detalle.sort_values(['empleado', 'fecha'])
+    detalle = registros_para_mostrar(detalle.sort_values(['empleado', 'fecha']))
     
     return detalle
 
@@ -5496,8 +7296,7 @@ def mostrar_reportes_op():
         
         # Mostrar información de debug
         with st.expander("🔍 Información de debug"):
-            df = load_data()
-            df_periodo = df[(df['fecha'] >= fecha_inicio) & (df['fecha'] <= fecha_fin)]
+            df_periodo = load_data(fecha_inicio=fecha_inicio, fecha_fin=fecha_fin)
             
             st.write(f"**Total registros en período:** {len(df_periodo)}")
             
@@ -5663,7 +7462,7 @@ def mostrar_reportes_op():
                 
                 # Resumen por empleado
                 st.subheader("📊 Resumen por Empleado")
-                resumen_empleados = detalle_op.groupby('empleado')['horas_trabajadas'].sum().reset_index()
+                resumen_empleados = detalle_op.groupby('empleado', observed=True)['horas_trabajadas'].sum().reset_index()
                 resumen_empleados = resumen_empleados.sort_values('horas_trabajadas', ascending=False)
                 resumen_empleados['horas_trabajadas'] = resumen_empleados['horas_trabajadas'].round(2)
                 
@@ -5866,23 +7665,32 @@ def configurar_sistema():
             v_horas = (salida_dt - entrada_dt).total_seconds() / 3600
             st.metric("Horas Viernes:", f"{v_horas:.1f}h")
         
+        # Breaks configurados (se editan en config.json: horarios_laborales -> <día> -> breaks)
+        for grupo, etiqueta in [('lunes_a_jueves', 'L-J'), ('viernes', 'Viernes'), ('sabado', 'Sábado')]:
+            breaks_grupo = horarios_config.get(grupo, {}).get('breaks', BREAKS_PREDETERMINADOS)
+            texto_breaks = ", ".join(f"{b.get('nombre', 'break')} {b.get('inicio')}-{b.get('fin')}" for b in breaks_grupo) or "sin breaks"
+            st.caption(f"☕ Breaks {etiqueta}: {texto_breaks}")
+        
         if st.button("💾 Guardar Horarios Laborales"):
-            config['horarios_laborales'] = {
-                'lunes_a_jueves': {
-                    'hora_entrada': lj_entrada.strftime('%H:%M'),
-                    'hora_salida': lj_salida.strftime('%H:%M'),
-                    'horas_normales': round(lj_horas, 1),
-                    'tolerancia_entrada': int(lj_tolerancia),
-                    'tolerancia_salida': int(lj_tolerancia)
-                },
-                'viernes': {
-                    'hora_entrada': v_entrada.strftime('%H:%M'),
-                    'hora_salida': v_salida.strftime('%H:%M'),
-                    'horas_normales': round(v_horas, 1),
-                    'tolerancia_entrada': int(v_tolerancia),
-                    'tolerancia_salida': int(v_tolerancia)
-                }
+            # Actualizar solo los campos editados (conserva breaks, sábado y otros días)
+            horarios_nuevos = dict(horarios_config)
+            horarios_nuevos['lunes_a_jueves'] = {
+                **horarios_config.get('lunes_a_jueves', {}),
+                'hora_entrada': lj_entrada.strftime('%H:%M'),
+                'hora_salida': lj_salida.strftime('%H:%M'),
+                'horas_normales': round(lj_horas, 1),
+                'tolerancia_entrada': int(lj_tolerancia),
+                'tolerancia_salida': int(lj_tolerancia)
             }
+            horarios_nuevos['viernes'] = {
+                **horarios_config.get('viernes', {}),
+                'hora_entrada': v_entrada.strftime('%H:%M'),
+                'hora_salida': v_salida.strftime('%H:%M'),
+                'horas_normales': round(v_horas, 1),
+                'tolerancia_entrada': int(v_tolerancia),
+                'tolerancia_salida': int(v_tolerancia)
+            }
+            config['horarios_laborales'] = horarios_nuevos
             save_config(config)
             st.success("✅ Horarios laborales actualizados")
             
@@ -5908,24 +7716,29 @@ def configurar_sistema():
         else:
             st.warning(f"⏳ **Pendientes:** {len(pendientes)} registro(s) por sincronizar")
     
-    # Si hay registros pendientes, mostrarlos
+    # Estado de entrega de cada registro (cola de salida + últimos entregados)
+    estados_entrega = obtener_diario_pendientes().estados_entrega()
+    if estados_entrega:
+        iconos_estado = {'pendiente': '⏳ Pendiente', 'enviando': '📤 Enviando', 'fallido': '⚠️ Fallido (se reintenta)', 'entregado': '✅ Entregado'}
+        df_entregas = pd.DataFrame([{
+            '#': e['id'],
+            'Estado': iconos_estado.get(e['estado'], e['estado']),
+            'Empleado': e['empleado'],
+            'Cédula': e['cedula'],
+            'Fecha': e['fecha'],
+            'OP': e['op'],
+            'Tiempo [Hr]': round(float(e['tiempo_horas'] or 0), 3),
+            'Hora exacta': e['hora_exacta'],
+            'Guardado': e['guardado'],
+            'Intentos': e['intentos'],
+            'Actualizado': e['actualizado'],
+            'Último error': e['ultimo_error'] or '',
+        } for e in estados_entrega])
+        en_cola = sum(1 for e in estados_entrega if e['estado'] != 'entregado')
+        with st.expander(f"📋 Estado de entrega ({en_cola} en cola, {len(estados_entrega) - en_cola} entregados recientes)", expanded=en_cola > 0):
+            st.dataframe(df_entregas, use_container_width=True, hide_index=True)
+    
     if pendientes:
-        with st.expander(f"📋 Ver {len(pendientes)} registro(s) pendientes", expanded=True):
-            for i, reg in enumerate(pendientes):
-                col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
-                with col1:
-                    st.write(f"**{reg.get('empleado', 'N/A')}**")
-                    st.caption(f"Cédula: {reg.get('cedula', 'N/A')}")
-                with col2:
-                    st.write(f"📅 {reg.get('fecha', 'N/A')}")
-                    st.caption(f"OP: {reg.get('op', 'N/A')}")
-                with col3:
-                    st.write(f"⏱️ {reg.get('tiempo_horas', 0):.3f} hrs")
-                    st.caption(f"Guardado: {reg.get('_timestamp_offline', 'N/A')}")
-                with col4:
-                    st.write(f"#{reg.get('_id_pendiente', i+1)}")
-                st.divider()
-        
         # Botones de acción
         col_btn1, col_btn2, col_btn3 = st.columns(3)
         
@@ -6034,7 +7847,7 @@ def configurar_sistema():
            - También puedes ver los registros pendientes antes de sincronizar
         
         4. **📁 Archivo de respaldo:**
-           - Los registros se guardan en `registros_pendientes.json`
+           - Los registros se guardan en `registros_pendientes.jsonl`
            - Este archivo persiste aunque se cierre la aplicación
         
         5. **📥 Caché de datos:**
@@ -6144,6 +7957,7 @@ def configurar_sistema():
                 'credentials_file': credentials_file
             }
             save_config(temp_config)
+            invalidar_conexion_sheets()
             
             spreadsheet, mensaje = conectar_google_sheets()
             if spreadsheet:
@@ -6159,6 +7973,7 @@ def configurar_sistema():
             'credentials_file': credentials_file if gs_enabled else ''
         }
         save_config(config)
+        invalidar_conexion_sheets()
         st.success("Configuración guardada correctamente")
     
     st.subheader("ℹ️ Información del Sistema")
@@ -6168,13 +7983,13 @@ def configurar_sistema():
     with col1:
         st.info(f"""
         **Archivos del sistema:**
-        - Datos: {DATA_FILE}
+        - Datos: {DB_FILE}
         - Configuración: {CONFIG_FILE}
         """)
     
     with col2:
-        if os.path.exists(DATA_FILE):
-            file_size = os.path.getsize(DATA_FILE)
+        if os.path.exists(DB_FILE):
+            file_size = os.path.getsize(DB_FILE)
             st.info(f"""
             **Estado de archivos:**
             - Tamaño datos: {file_size} bytes
@@ -6243,23 +8058,8 @@ def main():
     # ============================================
     if 'sync_intentado' not in st.session_state:
         st.session_state.sync_intentado = True
-        tiene_conexion, _ = verificar_conexion_internet(timeout=2)
-        
-        if tiene_conexion:
-            # Sincronizar registros pendientes
-            pendientes = obtener_registros_pendientes()
-            if pendientes:
-                sincronizados, fallidos, restantes = sincronizar_registros_pendientes_silencioso()
-                if sincronizados > 0:
-                    st.toast(f"✅ {sincronizados} registro(s) pendientes sincronizados automáticamente")
-            
-            # Actualizar caché de datos para modo offline
-            cache = obtener_cache_datos()
-            # Solo actualizar si el caché está vacío o tiene más de 1 hora
-            if not cache.get('colaboradores') or not cache.get('ultima_actualizacion'):
-                exito, mensaje = actualizar_todo_cache_desde_sheets()
-                if exito:
-                    st.toast("📥 Datos descargados para modo offline")
+        # Los registros pendientes y el caché offline los actualiza el trabajador de fondo
+        obtener_trabajador_sincronizacion().solicitar_sincronizacion()
     
     if st.session_state.admin_mode and st.session_state.screen == 'admin' and st.session_state.admin_authenticated:
         pantalla_admin()